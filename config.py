@@ -16,6 +16,22 @@ SEND_INTERVAL_MIN = 5
 SEND_INTERVAL_MAX = 10
 LANE_SEGMENTATION_FRAME_COUNT = 5  # Số lượng frames mới nhất để gửi (k frames)
 
+# Bộ điều khiển nhịp gửi (rate controller) cho phân đoạn làn đường
+LANE_RATE_MIN_FRAMES = 2              # Số frames tối thiểu mỗi cửa sổ khi đứng yên
+LANE_RATE_STATIONARY_KMH = 0.8        # Dưới tốc độ này coi như người dùng đứng yên
+LANE_RATE_WALKING_KMH = 5.0           # Tốc độ đi bộ nhanh -> gửi dày nhất
+LANE_RATE_SCENE_CHANGE_FULL = 60.0    # Tổng khác biệt cảnh trong cửa sổ coi như "thay đổi hoàn toàn"
+LANE_RATE_SMOOTHING = 0.5             # Hệ số làm mượt (EWMA) cho chu kỳ gửi
+LANE_RATE_LATENCY_MARGIN = 1.2        # Chu kỳ gửi >= latency server * hệ số này
+LANE_ENCODE_WORKERS = 2               # Số thread encode JPEG song song (cv2.imencode nhả GIL)
+LANE_JPEG_QUALITY = 95                # Chất lượng JPEG gửi lên server (95 = mặc định của OpenCV)
+# Định dạng upload cửa sổ: "jpeg" (k ảnh độc lập), "h264" (clip GOP nhỏ), "mjpeg" (clip intra-only)
+# hoặc "stream" (upload từng frame ngay khi chụp vào session trên server)
+LANE_UPLOAD_FORMAT = os.getenv("LANE_UPLOAD_FORMAT", "jpeg")
+LANE_CLIP_GOP = 5                     # Số frames giữa 2 keyframe của clip H.264
+LANE_CLIP_ENDPOINT = "/navigate_clip/"  # Endpoint nhận clip + manifest (fallback: /navigate_batch10/)
+LANE_STREAM_ENDPOINT = "/navigate_session/"  # Endpoint session cho chế độ streaming (fallback: /navigate_batch10/)
+
 # Cấu hình MQTT
 # Địa chỉ IP của máy chủ MQTT
 BROKER_HOST = os.getenv("BROKER_HOST", "192.168.1.11")
@@ -29,6 +45,36 @@ DEVICE_ID = "device001"
 
 BROKER_WS_PATH = os.getenv("BROKER_WS_PATH", "/")
 
+# Message nhận được xử lý trên worker theo lớp topic (không chạy trên thread mạng của paho),
+# dung lượng hàng đợi mỗi lớp - đầy thì bỏ message cũ nhất
+MQTT_DISPATCH_QUEUES = {"signaling": 64, "audio": 512, "command": 64}
+MQTT_SERIALIZER = os.getenv("MQTT_SERIALIZER", "auto")  # auto (orjson nếu đã cài) | orjson | json
+MQTT_LOG_PAYLOAD_MAX = 256  # Payload nhận lớn hơn bấy nhiêu byte thì chỉ log kích thước
+
+# Telemetry: GPS, pin, cảm biến và sức khoẻ pipeline gộp thành một bản ghi trên device_status (mqtt/telemetry.py)
+TELEMETRY_SAMPLE_S = 1.0        # Chu kỳ lấy mẫu (chỉ đọc trạng thái cục bộ)
+TELEMETRY_MIN_INTERVAL_S = 5.0  # Có thay đổi: hai lần gửi cách nhau ít nhất bấy nhiêu giây
+TELEMETRY_MAX_INTERVAL_S = 60.0  # Không đổi gì: vẫn gửi sau bấy nhiêu giây (heartbeat)
+TELEMETRY_GPS_MIN_MOVE_M = 10.0  # Di chuyển ít hơn thì coi như vị trí không đổi (nhiễu GPS)
+TELEMETRY_SPEED_MIN_CHANGE_KMH = 0.5  # Tốc độ đổi ít hơn thì không tính là thay đổi (nhiễu GPS)
+TELEMETRY_GPS_LEGACY = os.getenv("TELEMETRY_GPS_LEGACY", "true").lower() == "true"  # Gửi kèm device_gps cho app mobile
+
+# Outbox: message publish khi mất kết nối broker được lưu xuống đĩa (SQLite WAL), gửi lại khi kết nối lại
+MQTT_OUTBOX_ENABLED = os.getenv("MQTT_OUTBOX_ENABLED", "true").lower() == "true"
+MQTT_OUTBOX_PATH = os.getenv("MQTT_OUTBOX_PATH", os.path.join(BASE_DIR, "mqtt_outbox.db"))
+MQTT_OUTBOX_MAX_MESSAGES = 5000  # Đầy thì bỏ message cũ nhất của lớp ưu tiên thấp nhất
+MQTT_OUTBOX_BATCH = 50        # Số message mỗi lô khi gửi lại
+MQTT_MAX_QUEUED_MESSAGES = 1000  # Hàng đợi RAM của paho (QoS>0 đang chờ gửi), đầy thì vào outbox
+# Lớp topic (xem mqtt/outbox.py) -> (ưu tiên: nhỏ gửi trước, thời gian giữ tối đa giây)
+MQTT_OUTBOX_POLICIES = {
+    "alert": (0, 24 * 3600),  # Cảnh báo vật cản
+    "signaling": (0, 60),     # WebRTC (offer SOS, candidate) - quá 1 phút thì cuộc gọi đã hỏng
+    "status": (1, 3600),
+    "stt": (2, 30),           # Audio giọng nói - trả lời muộn hơn thì vô nghĩa
+    "default": (2, 3600),
+    "gps": (3, 600),
+}
+
 # USB Composite Device mic (48000 Hz)
 # MIC_INDEX = 11
 # AUDIO_SAMPLE_RATE = 48000
@@ -38,11 +84,73 @@ MIC_NAME = "USB Audio Device"
 AUDIO_SAMPLE_RATE = 44100  
 
 AUDIO_CHUNK_MS = 1000     # Giảm latency
+MIC_BLOCK_MS = 20         # Block của callback MicBroker (ms) - mic mở một lần, chia cho VAD/WebRTC/WebSocket
+MIC_RING_SECONDS = 2.0    # Dung lượng ring buffer của mỗi subscriber mic (giây)
 SILENCE_THRESHOLD = 0.2  # Giảm ngưỡng để dễ phát hiện giọng nói hơn
 SILENCE_DURATION = 2.0    # Giảm thời gian im lặng để phản hồi nhanh hơn
 MIN_SPEECH_DURATION = 0.8  # Giảm thời gian tối thiểu để chấp nhận câu ngắn hơn
+MAX_SPEECH_DURATION = 30.0  # Độ dài tối đa một câu (giây) - giới hạn bộ nhớ buffer VAD
 MAX_AMP = 0.8
 
+# Ghi file WAV debug (debug/audio_mic.wav, debug/audio_response_from_server.wav) trên thread nền
+DEBUG_AUDIO_RECORD = os.getenv("DEBUG_AUDIO_RECORD", "true").lower() == "true"  # Bật/tắt lúc chạy qua MCP/MQTT
+DEBUG_AUDIO_RETENTION = int(os.getenv("DEBUG_AUDIO_RETENTION", "0"))  # 0 = ghi đè 1 file, N = giữ N file mới nhất
+DEBUG_AUDIO_QUEUE = 8         # Số file tối đa chờ ghi, đầy thì bỏ file mới
+
+# VAD theo khung ngắn: "rms" (RMS cả chunk, mặc định cũ) hoặc "frame" (khung 20 ms + noise floor thích nghi)
+VAD_MODE = os.getenv("VAD_MODE", "rms")
+VAD_FRAME_MS = 20             # Độ dài khung phân tích (ms)
+VAD_CHUNK_MS = 100            # Chunk đọc từ mic ở chế độ "frame" (thay cho AUDIO_CHUNK_MS)
+VAD_SNR_DB = 9.0              # Khung phải vượt noise floor bao nhiêu dB để coi là tiếng nói
+VAD_HANGOVER_MS = 200         # Khoảng lặng ngắn giữa các từ vẫn coi là đang nói
+VAD_ENDPOINT_SILENCE = 0.6    # Im lặng bao lâu (giây) thì kết thúc câu ở chế độ "frame"
+
+# Tần số xử lý VAD/STT: mic thu ở AUDIO_SAMPLE_RATE rồi resample polyphase về tần số này (0 = giữ nguyên)
+STT_SAMPLE_RATE = int(os.getenv("STT_SAMPLE_RATE", "16000"))
+
+# Streaming STT: gửi audio lên server ngay từ lúc bắt đầu nói thay vì đợi hết câu
+STT_STREAMING = os.getenv("STT_STREAMING", "false").lower() == "true"
+STT_STREAM_CHUNK_MS = 250     # Gom bao nhiêu ms audio mỗi message streaming
+# Định dạng audio gửi STT (trường "format"): "pcm16le" (mặc định) hoặc "opus" (Ogg/Opus, nhỏ hơn ~10 lần)
+STT_UPLINK_FORMAT = os.getenv("STT_UPLINK_FORMAT", "pcm16le")
+STT_OPUS_RATE = 16000         # Tần số lấy mẫu của Opus gửi lên (đủ cho nhận dạng giọng nói)
+STT_OPUS_BITRATE = 24000      # Bitrate Opus (bit/s)
+# Payload audio STT gửi lên: "json" (JSON + base64, mặc định) hoặc "binary" (header nhị phân + audio thô,
+# xem mqtt/audio_protocol.py). Audio nhận từ server tự nhận diện theo magic bytes.
+AUDIO_PAYLOAD_FORMAT = os.getenv("AUDIO_PAYLOAD_FORMAT", "json")
+
+# Keyword spotting: chỉ gửi STT những câu có chứa cụm từ đánh thức (MFCC + DTW với các file WAV mẫu
+# ghi bằng chính mic của thiết bị, mỗi file một lần nói cụm từ)
+KWS_ENABLED = os.getenv("KWS_ENABLED", "false").lower() == "true"
+KWS_TEMPLATE_DIR = os.getenv("KWS_TEMPLATE_DIR", os.path.join(BASE_DIR, "audio", "keywords"))
+KWS_THRESHOLD = float(os.getenv("KWS_THRESHOLD", "0.35"))  # Khoảng cách DTW tối đa (cosine, 0..2)
+KWS_SEARCH_SECONDS = 0.0      # Chỉ tìm keyword trong N giây đầu câu (0 = cả câu)
+
+# Chống echo loa -> mic khi đang phát TTS/cảnh báo: "off", "gate" (bỏ qua mic khi loa phát)
+# hoặc "suppress" (so với đường bao audio loa, người dùng vẫn nói chen được)
+ECHO_MODE = os.getenv("ECHO_MODE", "suppress")
+ECHO_TAIL_MS = 300            # Echo còn kéo dài sau khi phát (độ trễ loa/mic + vang phòng)
+ECHO_BARGE_IN_DB = 10.0       # Mic vượt mức echo dự kiến bao nhiêu dB thì coi là người dùng nói chen
+ECHO_BARGE_IN_STOP = True     # Dừng audio đang phát khi người dùng nói chen
+
+# Phát TTS theo luồng: bắt đầu phát khi đã có đủ pre-roll thay vì đợi chunk cuối của server
+TTS_STREAM_PLAYBACK = os.getenv("TTS_STREAM_PLAYBACK", "false").lower() == "true"
+TTS_PREROLL_MS = 300          # Lượng audio liên tục cần có trước khi bắt đầu phát
+TTS_GAP_TIMEOUT_MS = 200      # Chunk thiếu: loa đã lặng (hết audio) bấy nhiêu ms thì bỏ qua chunk đó
+
+# Ghép chunk TTS (khi không phát theo luồng), xem mqtt/reassembly.py
+TTS_STREAM_TIMEOUT = 15       # Stream không có chunk mới bấy nhiêu giây thì phát phần đã có
+TTS_NACK_ENABLED = os.getenv("TTS_NACK_ENABLED", "false").lower() == "true"  # Gửi NACK xin server gửi lại chunk thiếu
+TTS_NACK_DELAY_MS = 150       # Chunk thiếu (đã có chunk sau nó) bấy nhiêu ms thì gửi NACK / xét lại
+TTS_NACK_RETRIES = 2          # Số lần NACK tối đa mỗi stream, hết lượt mà đã có chunk cuối thì phát phần đã có
+
+# Mixer phát: một stream loa luôn mở, các làn alert > call > tts > prompt (xem module/audio_mixer.py)
+MIXER_SAMPLE_RATE = 44100
+MIXER_BLOCK_MS = 20           # Block của callback phát (ms)
+MIXER_DUCK_GAIN = float(os.getenv("MIXER_DUCK_GAIN", "0.25"))  # Gain làn thấp khi làn ưu tiên cao hơn đang phát
+MIXER_STREAM_PREROLL_MS = 60  # Audio cuộc gọi cần có trước khi phát (và sau mỗi lần underrun)
+MIXER_STREAM_MAX_LATENCY_MS = 200  # Audio cuộc gọi chờ phát tối đa, quá thì bỏ frame mới
+
 # WebRTC Audio Settings
 MICROPHONE_GAIN = 1.1        # Audio gain for microphone (1.0 = no boost, 1.5 = 50% boost)
 MICROPHONE_NOISE_GATE = 40    # Noise gate threshold (filter noise < 100)
@@ -64,10 +172,23 @@ TOPICS = {
     'server_command': f"server/{DEVICE_ID}/command",
     'server_pong': f"server/{DEVICE_ID}/pong",
     'device_gps': f"device/{DEVICE_ID}/gps",
+    'device_audio_nack': f"device/{DEVICE_ID}/audio/nack",
     'mobile_offer': f"mobile/{MOBILE_ID}/webrtc/offer",
     'mobile_answer': f"mobile/{MOBILE_ID}/webrtc/answer",
     'mobile_candidate': f"mobile/{MOBILE_ID}/webrtc/candidate",
 }
+
+# MQTT v5 (mqtt/v5.py): topic alias, message expiry theo lớp topic (thời gian giữ của MQTT_OUTBOX_POLICIES),
+# content type. Broker không hỗ trợ v5 thì tự chuyển về 3.1.1
+MQTT_PROTOCOL = os.getenv("MQTT_PROTOCOL", "3.1.1")  # "3.1.1" | "5"
+MQTT_SESSION_EXPIRY_S = 24 * 3600  # v5: broker giữ session khi mất kết nối (như clean_session=False của 3.1.1)
+# Topic tần suất cao gửi QoS 0 dùng topic alias (alias 1, 2, ... theo thứ tự, tối đa TopicAliasMaximum
+# của broker). Message QoS>0 luôn gửi topic đầy đủ: paho có thể gửi lại chúng ở kết nối sau, khi alias
+# của kết nối cũ đã hết hiệu lực
+MQTT_TOPIC_ALIASES = [
+    f"device/{DEVICE_ID}/webrtc/candidate",
+    TOPICS['device_status'],
+]
 pprint({
     "BROKER_HOST": BROKER_HOST,
     "BROKER_PORT": BROKER_PORT,
@@ -79,11 +200,13 @@ pprint({
     "BROKER_WS_PATH": BROKER_WS_PATH,
     "AUDIO_SAMPLE_RATE": AUDIO_SAMPLE_RATE,
     "AUDIO_CHUNK_MS": AUDIO_CHUNK_MS,
+    "STT_SAMPLE_RATE": STT_SAMPLE_RATE,
     "SERVER_HTTP_BASE": SERVER_HTTP_BASE,
     "TOPICS": TOPICS,
     "SILENCE_THRESHOLD": SILENCE_THRESHOLD,
     "SILENCE_DURATION": SILENCE_DURATION,
     "MIN_SPEECH_DURATION": MIN_SPEECH_DURATION,
+    "VAD_MODE": VAD_MODE,
     "MAX_AMP": MAX_AMP,
     "MIC_NAME": MIC_NAME,
     "MICROPHONE_GAIN": MICROPHONE_GAIN,
@@ -7,7 +7,8 @@ import multiprocessing as mp
 from module.camera.camera_direct import CameraDirect
 from mqtt import MQTTClient, VoiceMQTT, GPSMQTT
 from log import setup_logger
-from module.voice_speaker import VoiceSpeaker
+from container import container
+from module.voice_speaker import get_speaker
 from mcp_server.server import mcp
 from config import TOPICS
 from module.gps_manager import GPSManager
@@ -23,7 +24,7 @@ def main():
     mqtt_client = MQTTClient()
     mqtt_client.connect()
     
-    speaker = VoiceSpeaker("USB Audio Device")
+    speaker = get_speaker("USB Audio Device")
 
     # Initialize services
     voice = VoiceMQTT(mqtt_client)
@@ -51,6 +52,10 @@ def main():
     # # MQTT GPS publisher
     # gps = GPSMQTT(mqtt_client)
     # gps.publish_gps(qos=1)
+
+    # GPS + pin + trạng thái thiết bị: một bản ghi trên device_status, gửi khi đổi hoặc tới hạn heartbeat
+    gps_manager = GPSManager(mqtt_client)
+    gps_manager.run()
     
     mcp.run(transport='sse')
     
@@ -61,9 +66,13 @@ def main():
         logger.error(f"Lỗi: {e}", exc_info=True)
         logger.info("Dừng hệ thống...")
     finally:
+        gps_manager.stop()
         obstacle_system.stop()
         camera.stop()
         voice.stop()
+        if container.has("mic_broker"):
+            container.get("mic_broker").close()
+        speaker.mixer.close()
         mqtt_client.disconnect()
         lane_segmentation.stop()
 
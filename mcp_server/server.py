@@ -14,6 +14,7 @@ from module.camera.camera_base import Camera
 from module.llm.open_ai import OpenAIAgent
 from module.lane_segmentation import LaneSegmentation
 from module.obstacle_detection import ObstacleDetectionSystem
+from module.debug_recorder import debug_recorder
 
 mcp = FastMCP(name="PBL6_MCP_IOT")
 
@@ -241,6 +242,65 @@ async def get_obstacle_detection_status() -> str:
         logger.error(f"Lỗi khi kiểm tra obstacle detection status: {e}", exc_info=True)
         return f"Lỗi: {str(e)}"
 
+# ============ DEBUG AUDIO TOOLS ============
+
+@mcp.tool()
+async def set_debug_audio_recording(enabled: bool) -> str:
+    """
+    Bật/tắt ghi file WAV debug (câu nói từ mic, audio phản hồi từ server).
+    Việc ghi chạy trên thread nền; khi tắt không tốn chi phí.
+    """
+    try:
+        debug_recorder.set_enabled(enabled)
+        status = debug_recorder.get_status()
+        return (f"✅ Ghi audio debug: {'BẬT' if enabled else 'TẮT'} "
+                f"(đã ghi {status['written']}, bỏ {status['dropped']})")
+    except Exception as e:
+        logger.error(f"Lỗi khi bật/tắt debug audio: {e}", exc_info=True)
+        return f"Lỗi: {str(e)}"
+
+# ============ MQTT TOOLS ============
+
+@mcp.tool()
+async def get_mqtt_dispatch_status() -> str:
+    """
+    Thống kê xử lý message MQTT theo lớp topic: độ sâu hàng đợi, message bị bỏ,
+    thời gian chờ trong hàng đợi và thời gian chạy handler; lưu lượng theo topic; outbox khi mất kết nối;
+    telemetry; ghép chunk TTS (chunk thiếu/trùng, NACK).
+    """
+    try:
+        client = container.get("mqtt_client")
+        stats = client.dispatcher.get_stats()
+        lines = ["📡 **MQTT dispatcher**"]
+        for name, s in stats.items():
+            lines.append(f"- {name}: hàng đợi {s['depth']} (max {s['max_depth']}), xử lý {s['processed']}, "
+                         f"bỏ {s['dropped']}, lỗi {s['errors']}, chờ {s['wait_ms_avg']:.1f}/{s['wait_ms_max']:.1f}ms, "
+                         f"handler {s['handle_ms_avg']:.1f}/{s['handle_ms_max']:.1f}ms (tb/max)")
+        traffic = client.traffic.get_stats()
+        lines.append(f"📦 **Lưu lượng theo topic** (MQTT {client.protocol}, serializer {client.serializer.name}"
+                     f"{f', topic alias tiết kiệm {client.aliases.saved_bytes} B' if client.v5 else ''}):")
+        for topic, t in sorted(traffic.items()):
+            lines.append(f"- {topic}: gửi {t['tx_messages']} msg/{t['tx_bytes']} B, "
+                         f"nhận {t['rx_messages']} msg/{t['rx_bytes']} B")
+        if client.outbox is not None:
+            o = client.outbox.get_stats()
+            lines.append(f"📮 **Outbox**: chờ gửi {o['pending']}, đã lưu {o['stored']}, gửi lại {o['sent']}, "
+                         f"quá hạn {o['expired']}, bỏ (đầy) {o['dropped']}, không lưu {o['skipped']}, "
+                         f"retain bị thay {o['superseded']}")
+        if container.has("telemetry"):
+            t = container.get("telemetry").get_stats()
+            lines.append(f"📡 **Telemetry**: lấy mẫu {t['samples']}, gửi {t['published']}, "
+                         f"không đổi nên bỏ qua {t['suppressed']} - bản ghi cuối {t['last']}")
+        r = container.get("message_handler").reassembler.get_stats()
+        lines.append(f"🧩 **Ghép chunk TTS**: {r['streams']} stream ({r['active']} đang ghép), "
+                     f"{r['complete']} đủ, {r['partial']} thiếu ({r['missing']} chunk), "
+                     f"{r['duplicates']} chunk trùng, {r['late']} đến trễ, "
+                     f"{r['nacks']} NACK ({r['repaired']} chunk được gửi lại)")
+        return "\n".join(lines)
+    except Exception as e:
+        logger.error(f"Lỗi khi lấy thống kê MQTT: {e}", exc_info=True)
+        return f"Lỗi: {str(e)}"
+
 # ============ SYSTEM STATUS TOOL ============
 
 @mcp.tool()
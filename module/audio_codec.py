@@ -0,0 +1,114 @@
+"""
+Audio Codec
+===========
+Nén audio câu nói thành Ogg/Opus (16 kHz mono) bằng PyAV trước khi gửi lên server STT.
+
+Encoder chạy theo luồng: mỗi lần `encode()` trả về các byte Ogg mới sinh ra, nối các
+phần lại theo thứ tự sẽ được một file .opus hợp lệ. Mỗi câu nói dùng một encoder riêng.
+"""
+import io
+from typing import Optional
+
+import av
+import numpy as np
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+OPUS_ENCODER = "libopus"
+
+
+def opus_available() -> bool:
+    """PyAV có encoder Opus hay không"""
+    return OPUS_ENCODER in av.codecs_available
+
+
+class _ByteSink(io.RawIOBase):
+    """File-like chỉ ghi, gom các byte mà muxer Ogg ghi ra để lấy dần"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class OpusStreamEncoder:
+    """Encode PCM16 mono thành Ogg/Opus theo từng đoạn, có resample sang output_rate"""
+
+    def __init__(self, input_rate: int, output_rate: int = 16000, bitrate: int = 24000,
+                 page_ms: int = 100):
+        """
+        Args:
+            input_rate: Tần số lấy mẫu của PCM đầu vào
+            output_rate: Tần số lấy mẫu của Opus (16000 cho STT)
+            bitrate: Bitrate Opus (bit/s)
+            page_ms: Độ dài tối đa một trang Ogg (ms) - trang ngắn thì byte ra đều hơn khi streaming
+
+        Raises:
+            ValueError: Nếu PyAV không có encoder Opus
+        """
+        if not opus_available():
+            raise ValueError(f"PyAV không có encoder '{OPUS_ENCODER}'")
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self._sink = _ByteSink()
+        self._container = av.open(self._sink, mode="w", format="ogg",
+                                  options={"page_duration": str(page_ms * 1000)})
+        self._stream = self._container.add_stream(OPUS_ENCODER, rate=output_rate)
+        self._stream.layout = "mono"
+        self._stream.bit_rate = bitrate
+        self._stream.codec_context.options = {"application": "voip", "frame_duration": "20"}
+        self._resampler = av.AudioResampler(format="s16", layout="mono", rate=output_rate)
+        self._closed = False
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    def _encode_frames(self, frames):
+        for frame in frames:
+            for packet in self._stream.encode(frame):
+                self._container.mux(packet)
+
+    def encode(self, pcm16: bytes) -> bytes:
+        """Encode thêm một đoạn PCM16 little-endian, trả về các byte Ogg mới (có thể rỗng)"""
+        samples = np.frombuffer(pcm16, dtype=np.int16)
+        if len(samples) == 0:
+            return b""
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = self.input_rate
+        self._encode_frames(self._resampler.resample(frame))
+        self.input_bytes += len(pcm16)
+        return self._drain()
+
+    def finish(self) -> bytes:
+        """Flush resampler/encoder, đóng stream Ogg và trả về các byte còn lại"""
+        if self._closed:
+            return b""
+        self._closed = True
+        self._encode_frames(self._resampler.resample(None))
+        self._encode_frames([None])
+        self._container.close()
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        data = self._sink.drain()
+        self.output_bytes += len(data)
+        return data
+
+
+def encode_opus(pcm16: bytes, input_rate: int, output_rate: int = 16000, bitrate: int = 24000) -> bytes:
+    """Encode cả câu nói PCM16 thành một file Ogg/Opus"""
+    encoder = OpusStreamEncoder(input_rate, output_rate, bitrate)
+    data = encoder.encode(pcm16) + encoder.finish()
+    logger.debug(f"🗜️ Opus: {encoder.input_bytes / 1024:.0f}KB PCM -> {len(data) / 1024:.1f}KB")
+    return data
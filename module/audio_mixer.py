@@ -0,0 +1,386 @@
+"""
+Audio Mixer
+===========
+Một stream phát (sounddevice.OutputStream) duy nhất, mở một lần và giữ suốt vòng đời chương trình.
+Mọi nguồn âm thanh đi qua các làn (lane) có độ ưu tiên và được trộn trong callback của thiết bị:
+
+    alert  (0) - cảnh báo vật cản
+    call   (1) - audio cuộc gọi WebRTC từ mobile
+    tts    (2) - câu trả lời TTS của server
+    prompt (3) - âm báo (processing.wav...)
+
+- Ducking: khi một làn đang có audio, các làn ưu tiên thấp hơn bị giảm âm lượng (duck_gain);
+  gain chuyển dần trong một block để không bị click
+- Preemption: phát trên một làn huỷ ngay audio của các làn trong `preempts` (cảnh báo cắt âm báo)
+- Mỗi làn đo thời gian đến mẫu đầu tiên. Underrun được đếm ở thiết bị (output_underflow của
+  PortAudio) và ở làn phát liên tục (write(): cuộc gọi hết dữ liệu giữa chừng, phát lại sau
+  khi đủ pre-roll)
+- Luồng liên tục đi qua SPSCRingBuffer float32 cấp phát sẵn (producer: thread WebRTC, consumer:
+  callback), đọc đúng số mẫu của block; ring đầy thì bỏ mẫu mới (overrun). Callback chỉ ghi vào
+  các buffer có sẵn, không tạo mảng numpy tạm
+"""
+import queue
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import sounddevice as sd
+
+from config import (MIXER_SAMPLE_RATE, MIXER_BLOCK_MS, MIXER_DUCK_GAIN, MIXER_STREAM_PREROLL_MS,
+                    MIXER_STREAM_MAX_LATENCY_MS)
+from log import setup_logger
+from module.audio_ring import SPSCRingBuffer
+from module.resampler import StreamingResampler
+
+logger = setup_logger(__name__)
+
+# (tên, làn bị huỷ khi làn này phát) theo thứ tự ưu tiên giảm dần
+LANES = (
+    ("alert", ("prompt",)),
+    ("call", ()),
+    ("tts", ()),
+    ("prompt", ()),
+)
+
+
+class PlaybackItem:
+    """Một buffer đang chờ/đang phát"""
+
+    def __init__(self, samples: np.ndarray):
+        self.samples = samples
+        self.position = 0
+        self.enqueued = time.perf_counter()
+        self.mark = 0  # _enqueued_samples của làn sau khi xếp buffer này (so với mốc stop())
+        self.first_sample_latency = None  # Giây, đo trong callback
+        self.done = threading.Event()
+
+
+class MixerLane:
+    """Một làn của mixer: hàng đợi buffer phát nối tiếp nhau (hoặc luồng liên tục qua write())"""
+
+    def __init__(self, mixer: "AudioMixer", name: str, priority: int, preempts=()):
+        self.mixer = mixer
+        self.name = name
+        self.priority = priority
+        self.preempts = tuple(preempts)
+        self.sample_rate = mixer.sample_rate
+        self.gain = 1.0            # Âm lượng riêng của làn
+        self._gain_applied = 1.0   # Gain callback đã dùng ở block trước (chỉ callback ghi)
+        self._lock = threading.Lock()  # Xếp hàng (nhiều thread phát), callback không dùng
+        self._queue: "queue.Queue[PlaybackItem]" = queue.Queue()
+        self._current: Optional[PlaybackItem] = None
+        self._stop_requested = False
+        self._stop_mark = 0       # Buffer có mark <= mốc này bị bỏ khi callback xử lý stop()
+        self._stop_ring = None    # Ring của luồng đang mở lúc stop()
+        # Producer chỉ tăng _enqueued_samples, callback chỉ tăng _played_samples
+        self._enqueued_samples = 0
+        self._played_samples = 0
+        # Phát liên tục (write): resampler phía producer, ring giữa producer và callback
+        self._resampler: Optional[StreamingResampler] = None
+        self._ring: Optional[SPSCRingBuffer] = None
+        self._streaming = False
+        self._stream_playing = False  # Đã đủ pre-roll (callback ghi)
+        self._preroll_samples = int(self.sample_rate * MIXER_STREAM_PREROLL_MS / 1000)
+        self._stats = {"plays": 0, "latency_last": 0.0, "latency_total": 0.0, "latency_max": 0.0,
+                       "underruns": 0, "underrun_samples": 0, "overrun_samples": 0}
+
+    @property
+    def queued_seconds(self) -> float:
+        """Thời lượng audio còn chờ phát trên làn này"""
+        queued = max(0, self._enqueued_samples - self._played_samples)
+        ring = self._ring
+        if self._streaming and ring is not None:
+            queued += ring.available
+        return queued / self.sample_rate
+
+    def play(self, samples: np.ndarray, wait: bool = True) -> PlaybackItem:
+        """
+        Xếp hàng một buffer để phát.
+
+        Args:
+            samples: Mẫu float32 mono ở self.sample_rate
+            wait: Chờ phát xong (như sd.play + sd.wait)
+
+        Returns:
+            PlaybackItem (first_sample_latency có giá trị khi mẫu đầu đã được phát)
+        """
+        self.mixer.open()
+        for name in self.preempts:
+            self.mixer.lanes[name].stop()
+        item = PlaybackItem(np.ascontiguousarray(samples, dtype=np.float32))
+        if len(item.samples) == 0:
+            item.done.set()
+            return item
+        with self._lock:
+            self._enqueued_samples += len(item.samples)
+            item.mark = self._enqueued_samples
+            self._queue.put(item)
+        if wait:
+            # Thời gian chờ tối đa: phần đang xếp hàng + buffer này + dự phòng
+            item.done.wait(self.queued_seconds + 2.0)
+            self._record(item)
+        return item
+
+    def stop(self):
+        """
+        Dừng phát ngay: bỏ buffer đang phát và các buffer đang chờ của làn. Chỉ bỏ những gì đã
+        xếp hàng tới lúc gọi - buffer play() hay luồng open_stream() ngay sau đó vẫn được phát.
+        """
+        if self.mixer.running:
+            with self._lock:
+                self._stop_mark = self._enqueued_samples
+                self._stop_ring = self._ring
+                self._stop_requested = True
+
+    # -------- Phát liên tục (cuộc gọi) ----------
+    @property
+    def stream_rate(self) -> Optional[int]:
+        """Tần số của luồng liên tục đang mở (None = không có luồng)"""
+        return self._resampler.input_rate if self._streaming else None
+
+    def open_stream(self, sample_rate: int):
+        """Bắt đầu một luồng audio liên tục ở `sample_rate` (resample theo luồng về tần số mixer)"""
+        with self._lock:
+            if self._resampler is None or self._resampler.input_rate != sample_rate:
+                self._resampler = StreamingResampler(sample_rate, self.sample_rate)
+            else:
+                self._resampler.reset()
+            self._retire_ring()
+            # Ring mới cho mỗi luồng (callback có thể vẫn đang đọc ring cũ, không clear() từ producer).
+            # Dung lượng = độ trễ tối đa: ring đầy thì bỏ mẫu mới để độ trễ cuộc gọi không tăng dần
+            self._ring = SPSCRingBuffer(int(self.sample_rate * MIXER_STREAM_MAX_LATENCY_MS / 1000),
+                                        dtype=np.float32)
+            self._stream_playing = False
+            self._streaming = True
+        logger.info(f"🔊 Làn {self.name}: mở luồng {sample_rate}Hz -> {self.sample_rate}Hz")
+
+    def write(self, samples: np.ndarray):
+        """
+        Thêm audio float32 mono của luồng liên tục (không chặn, chỉ một thread producer).
+        Audio đang chờ vượt MIXER_STREAM_MAX_LATENCY_MS thì phần dư bị bỏ (overrun).
+        """
+        ring = self._ring
+        if not self._streaming or ring is None:
+            return
+        self.mixer.open()
+        ring.write(self._resampler.process(samples))
+
+    def close_stream(self):
+        """Kết thúc luồng liên tục và bỏ phần audio còn chờ"""
+        with self._lock:
+            self._streaming = False
+            self._retire_ring()
+        logger.info(f"🔇 Làn {self.name}: đóng luồng")
+
+    def _retire_ring(self):
+        """Cộng dồn bộ đếm của ring đang dùng trước khi bỏ nó (giữ self._lock)"""
+        ring, self._ring = self._ring, None
+        if ring is not None:
+            self._stats["underrun_samples"] += ring.underruns
+            self._stats["overrun_samples"] += ring.overruns
+
+    # -------- Callback ----------
+    def _render(self, out: np.ndarray, frames: int, time_info) -> int:
+        """Callback: ghi tối đa `frames` mẫu của làn vào out[0:], trả về số mẫu đã ghi"""
+        if self._stop_requested:
+            self._stop_requested = False
+            self._drop_all()
+        ring = self._ring
+        if self._streaming and ring is not None:
+            return self._render_stream(ring, out, frames)
+        filled = 0
+        while filled < frames:
+            item = self._current
+            if item is None:
+                try:
+                    item = self._current = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item.position == 0:
+                try:
+                    dac_delay = max(0.0, time_info.outputBufferDacTime - time_info.currentTime)
+                except AttributeError:
+                    dac_delay = 0.0
+                item.first_sample_latency = (time.perf_counter() - item.enqueued + dac_delay
+                                             + filled / self.sample_rate)
+            n = min(frames - filled, len(item.samples) - item.position)
+            out[filled:filled + n] = item.samples[item.position:item.position + n]
+            item.position += n
+            filled += n
+            self._played_samples += n
+            if item.position >= len(item.samples):
+                self._current = None
+                item.done.set()
+        return filled
+
+    def _render_stream(self, ring: SPSCRingBuffer, out: np.ndarray, frames: int) -> int:
+        """Callback: đọc đúng `frames` mẫu của luồng liên tục từ ring"""
+        if not self._stream_playing:
+            # Chờ đủ pre-roll (lúc bắt đầu và sau mỗi lần underrun) để hấp thụ jitter mạng
+            if ring.available < self._preroll_samples:
+                return 0
+            self._stream_playing = True
+        filled = ring.read_into(out[:frames], fill=0.0)
+        if filled < frames:
+            self._stats["underruns"] += 1
+            self._stream_playing = False
+        return filled
+
+    def _drop_all(self):
+        """Callback: bỏ buffer đang phát và hàng đợi tới mốc stop() (buffer xếp sau đó giữ lại)"""
+        items = []
+        item, self._current = self._current, None
+        while True:
+            if item is None:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if item.mark > self._stop_mark:
+                # Hàng đợi theo thứ tự: từ buffer này trở đi là audio mới, phát tiếp
+                self._current = item
+                break
+            items.append(item)
+            item = None
+        for item in items:
+            self._played_samples += len(item.samples) - item.position
+            item.done.set()
+        ring, self._stop_ring = self._stop_ring, None
+        if ring is not None:
+            ring.clear()
+
+    def _record(self, item: PlaybackItem):
+        latency = item.first_sample_latency
+        if latency is None:
+            return
+        self._stats["plays"] += 1
+        self._stats["latency_last"] = latency
+        self._stats["latency_total"] += latency
+        self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+
+    def get_stats(self) -> dict:
+        plays = self._stats["plays"]
+        ring = self._ring
+        return {
+            "priority": self.priority,
+            "queued_seconds": round(self.queued_seconds, 3),
+            "plays": plays,
+            "first_sample_ms_last": self._stats["latency_last"] * 1000,
+            "first_sample_ms_avg": self._stats["latency_total"] / plays * 1000 if plays else 0.0,
+            "first_sample_ms_max": self._stats["latency_max"] * 1000,
+            "underruns": self._stats["underruns"],
+            "underrun_samples": self._stats["underrun_samples"] + (ring.underruns if ring else 0),
+            "overrun_samples": self._stats["overrun_samples"] + (ring.overruns if ring else 0),
+        }
+
+
+class AudioMixer:
+    """Stream phát mono float32 luôn mở, trộn các làn theo độ ưu tiên"""
+
+    def __init__(self, device: Optional[int], sample_rate: int = MIXER_SAMPLE_RATE,
+                 block_ms: int = MIXER_BLOCK_MS, duck_gain: float = MIXER_DUCK_GAIN):
+        """
+        Args:
+            device: Index thiết bị phát (None = mặc định)
+            sample_rate: Tần số của stream (buffer phải được resample về tần số này)
+            block_ms: Kích thước block của callback (ms)
+            duck_gain: Gain của các làn ưu tiên thấp khi có làn ưu tiên cao hơn đang phát
+        """
+        self.device = device
+        self.sample_rate = sample_rate
+        self.block_samples = int(sample_rate * block_ms / 1000)
+        self.duck_gain = duck_gain
+        self.lanes = {}
+        for priority, (name, preempts) in enumerate(LANES):
+            self.lanes[name] = MixerLane(self, name, priority, preempts)
+        self._ordered = sorted(self.lanes.values(), key=lambda lane: lane.priority)
+        self._stream = None
+        self._lock = threading.Lock()
+        # Buffer dùng lại trong callback (không cấp phát mỗi block)
+        self._resize_buffers(self.block_samples)
+        self.device_underflows = 0
+        self.callbacks = 0
+
+    @property
+    def running(self) -> bool:
+        return self._stream is not None
+
+    def lane(self, name: str) -> MixerLane:
+        return self.lanes[name]
+
+    def open(self):
+        """Mở stream phát (lần đầu), thử thiết bị đã chọn rồi thiết bị mặc định"""
+        if self._stream is not None:
+            return
+        with self._lock:
+            if self._stream is not None:
+                return
+            for device in (self.device, None):
+                try:
+                    stream = sd.OutputStream(device=device, samplerate=self.sample_rate, channels=1,
+                                             dtype='float32', blocksize=self.block_samples,
+                                             callback=self._callback)
+                    stream.start()
+                    self._stream = stream
+                    logger.info(f"🔊 AudioMixer mở stream: thiết bị {device}, {self.sample_rate}Hz, "
+                                f"block {self.block_samples}, làn {[lane.name for lane in self._ordered]}")
+                    return
+                except Exception as e:
+                    logger.warning(f"⚠️ Không mở được OutputStream trên thiết bị {device}: {e}")
+            raise RuntimeError("Không mở được thiết bị phát")
+
+    def _callback(self, outdata, frames, time_info, status):
+        self.callbacks += 1
+        if status and status.output_underflow:
+            self.device_underflows += 1
+        out = outdata[:, 0]
+        out.fill(0.0)
+        if frames != len(self._ramp):
+            # Block khác kích thước đã cấu hình (hiếm): cấp phát lại một lần cho kích thước mới
+            self._resize_buffers(frames)
+        scratch, gains = self._scratch, self._gains
+        ducked = False
+        for lane in self._ordered:
+            filled = lane._render(scratch, frames, time_info)
+            target = lane.gain * (self.duck_gain if ducked else 1.0)
+            if filled:
+                start = lane._gain_applied
+                if start != target:
+                    # Ramp gain start -> target trong block (không tạo mảng tạm)
+                    np.multiply(self._ramp, target - start, out=gains)
+                    gains += start
+                    scratch[:filled] *= gains[:filled]
+                elif target != 1.0:
+                    scratch[:filled] *= target
+                out[:filled] += scratch[:filled]
+                ducked = True
+            lane._gain_applied = target
+        np.clip(out, -1.0, 1.0, out=out)
+
+    def _resize_buffers(self, frames: int):
+        self._scratch = np.zeros(frames, dtype=np.float32)
+        self._gains = np.zeros(frames, dtype=np.float32)
+        self._ramp = np.arange(1, frames + 1, dtype=np.float32) / frames
+
+    def stop_all(self):
+        for lane in self._ordered:
+            lane.stop()
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self.running,
+            "callbacks": self.callbacks,
+            "device_underflows": self.device_underflows,
+            "lanes": {lane.name: lane.get_stats() for lane in self._ordered},
+        }
+
+    def close(self):
+        with self._lock:
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                stream.stop()
+                stream.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Lỗi khi đóng OutputStream: {e}")
@@ -0,0 +1,99 @@
+"""
+SPSC Audio Ring Buffer
+======================
+Ring buffer numpy một producer / một consumer, không dùng lock trên đường dữ liệu:
+producer chỉ tăng `_write_index`, consumer chỉ tăng `_read_index` (các chỉ số tăng
+đơn điệu, vị trí thực = chỉ số % capacity). Producer cập nhật chỉ số SAU khi copy xong
+nên consumer không bao giờ đọc phần đang ghi.
+
+Dùng cho callback audio (PortAudio) -> thread xử lý, nơi không được phép chặn callback.
+"""
+import threading
+
+import numpy as np
+
+
+class SPSCRingBuffer:
+    """Ring buffer một producer / một consumer cho mẫu audio mono"""
+
+    def __init__(self, capacity: int, dtype=np.int16):
+        """
+        Args:
+            capacity: Số mẫu tối đa
+            dtype: Kiểu mẫu (int16 cho capture, float32 cho playback)
+        """
+        self.capacity = max(1, int(capacity))
+        self._buffer = np.zeros(self.capacity, dtype=dtype)
+        self._write_index = 0  # Chỉ producer ghi
+        self._read_index = 0   # Chỉ consumer ghi
+        self._data_event = threading.Event()
+        self.overruns = 0      # Số mẫu producer phải bỏ vì ring đầy
+        self.underruns = 0     # Số mẫu consumer thiếu (read_into với fill)
+
+    @property
+    def available(self) -> int:
+        """Số mẫu đang chờ đọc"""
+        return self._write_index - self._read_index
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+    def write(self, samples: np.ndarray) -> int:
+        """
+        Producer: ghi mẫu, không chặn. Ring đầy thì bỏ phần dư (đếm vào overruns).
+
+        Returns:
+            Số mẫu đã ghi
+        """
+        n = min(len(samples), self.free)
+        if n < len(samples):
+            self.overruns += len(samples) - n
+        if n > 0:
+            start = self._write_index % self.capacity
+            first = min(n, self.capacity - start)
+            self._buffer[start:start + first] = samples[:first]
+            if first < n:
+                self._buffer[:n - first] = samples[first:n]
+            self._write_index += n
+        self._data_event.set()
+        return n
+
+    def read_into(self, out: np.ndarray, fill=None) -> int:
+        """
+        Consumer: đọc tối đa len(out) mẫu vào `out`, không chặn.
+
+        Args:
+            out: Mảng đích
+            fill: Nếu khác None, phần thiếu của `out` được điền giá trị này (đếm vào underruns)
+
+        Returns:
+            Số mẫu thực sự đọc được từ ring
+        """
+        n = min(len(out), self.available)
+        if n > 0:
+            start = self._read_index % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self._buffer[start:start + first]
+            if first < n:
+                out[first:n] = self._buffer[:n - first]
+            self._read_index += n
+        if fill is not None and n < len(out):
+            out[n:] = fill
+            self.underruns += len(out) - n
+        return n
+
+    def wait(self, min_samples: int = 1, timeout: float = None) -> bool:
+        """Consumer: chờ đến khi có ít nhất `min_samples` mẫu (hoặc hết timeout)"""
+        if self.available >= min_samples:
+            return True
+        # Clear rồi kiểm tra lại để không lỡ tín hiệu producer vừa set
+        self._data_event.clear()
+        if self.available >= min_samples:
+            return True
+        self._data_event.wait(timeout)
+        return self.available >= min_samples
+
+    def clear(self):
+        """Consumer: bỏ toàn bộ mẫu đang chờ"""
+        self._read_index = self._write_index
@@ -0,0 +1,146 @@
+"""
+Debug Audio Recorder
+====================
+Ghi file WAV debug (câu nói từ mic, audio phản hồi từ server) trên một thread nền,
+để ghi thẻ SD không chặn vòng lặp đọc mic / xử lý MQTT.
+
+- Hàng đợi có giới hạn: đầy thì bỏ file mới (không bao giờ chặn caller)
+- Bật/tắt lúc chạy (MCP tool / MQTT command); khi tắt `record()` trả về ngay
+- Retention: 0 = ghi đè một file cố định theo tên (như trước), N > 0 = giữ N file mới nhất mỗi tên
+"""
+import glob
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from config import BASE_DIR, DEBUG_AUDIO_RECORD, DEBUG_AUDIO_RETENTION, DEBUG_AUDIO_QUEUE
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class DebugAudioRecorder:
+    """Ghi audio debug bất đồng bộ với hàng đợi giới hạn"""
+
+    def __init__(self, directory: str, enabled: bool = False, retention: int = 0, max_queue: int = 8):
+        """
+        Args:
+            directory: Thư mục lưu file WAV
+            enabled: Bật ghi ngay từ đầu
+            retention: Số file giữ lại cho mỗi tên (0 = ghi đè một file)
+            max_queue: Số file tối đa chờ ghi
+        """
+        self.directory = directory
+        self.retention = max(0, retention)
+        self._enabled = enabled
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def set_enabled(self, enabled: bool):
+        """Bật/tắt ghi file debug lúc chạy"""
+        self._enabled = enabled
+        logger.info(f"💾 Debug audio recorder: {'BẬT' if enabled else 'TẮT'}")
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._worker, name="debug-recorder", daemon=True)
+                self._thread.start()
+
+    def record(self, name: str, audio, sample_rate: int) -> bool:
+        """
+        Xếp hàng một đoạn audio để ghi (không chặn).
+
+        Args:
+            name: Tên file (không có đuôi), vd. "audio_mic"
+            audio: numpy float32 [-1, 1] hoặc bytes PCM16 little-endian
+            sample_rate: Tần số lấy mẫu
+
+        Returns:
+            True nếu đã xếp hàng, False nếu đang tắt hoặc hàng đợi đầy
+        """
+        if not self._enabled:
+            return False
+        if isinstance(audio, np.ndarray):
+            # Caller có thể tái sử dụng buffer (view của VAD) - copy trước khi sang thread khác
+            audio = audio.copy()
+        else:
+            audio = bytes(audio)
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((name, audio, sample_rate, time.time()))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"⚠️ Hàng đợi ghi debug đầy - bỏ {name} (đã bỏ {self.dropped})")
+            return False
+
+    def _worker(self):
+        while True:
+            name, audio, sample_rate, timestamp = self._queue.get()
+            try:
+                self._write(name, audio, sample_rate, timestamp)
+            except Exception as e:
+                logger.error(f"❌ Lỗi khi lưu file âm thanh: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name: str, audio, sample_rate: int, timestamp: float):
+        if not isinstance(audio, np.ndarray):
+            audio = np.frombuffer(audio, dtype=np.int16)
+        if self.retention:
+            stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(timestamp))
+            file_path = os.path.join(self.directory, f"{name}_{stamp}_{int(timestamp * 1000) % 1000:03d}.wav")
+        else:
+            file_path = os.path.join(self.directory, f"{name}.wav")
+        sf.write(file_path, audio, sample_rate, subtype='PCM_16')
+        self.written += 1
+        logger.debug(f"💾 Đã lưu file âm thanh: {file_path}")
+        if self.retention:
+            self._prune(name)
+
+    def _prune(self, name: str):
+        """Xoá các file cũ nhất của `name`, chỉ giữ `retention` file"""
+        files = sorted(glob.glob(os.path.join(self.directory, f"{name}_*.wav")))
+        for old in files[:-self.retention]:
+            try:
+                os.remove(old)
+            except OSError as e:
+                logger.debug(f"Không xoá được {old}: {e}")
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Chờ ghi hết các file đang xếp hàng (dùng khi tắt chương trình)"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        return not self._queue.unfinished_tasks
+
+    def get_status(self) -> dict:
+        return {
+            "enabled": self._enabled,
+            "retention": self.retention,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+# Recorder dùng chung cho mic, handler MQTT và WebSocket
+debug_recorder = DebugAudioRecorder(
+    os.path.join(BASE_DIR, "debug"),
+    enabled=DEBUG_AUDIO_RECORD,
+    retention=DEBUG_AUDIO_RETENTION,
+    max_queue=DEBUG_AUDIO_QUEUE,
+)
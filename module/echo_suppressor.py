@@ -0,0 +1,187 @@
+"""
+Echo Suppressor
+===============
+Chống vòng lặp loa -> mic: trong lúc VoiceSpeaker phát TTS/cảnh báo, mic thu lại chính
+tiếng của thiết bị và VAD coi đó là câu nói mới.
+
+- PlaybackReference: loa ghi lại đường bao năng lượng (dBFS theo khung 20 ms) của mọi
+  audio đang phát, gắn với thời điểm bắt đầu phát.
+- EchoSuppressor: với mỗi chunk mic, so năng lượng từng khung với đường bao tham chiếu
+  (lấy max trong cửa sổ `tail` để bù độ trễ loa/mic và tiếng vang phòng) cộng hệ số
+  ghép loa->mic học dần. Khung vượt mức echo dự kiến `barge_in_db` là người dùng nói chen
+  (barge-in); chunk chỉ có echo thì không được mở câu nói mới.
+
+Không khử echo theo mẫu (NLMS) vì loa (sd.play) và mic (MicBroker) là hai stream độc lập,
+không có đồng hồ chung để căn chỉnh mẫu; so năng lượng theo khung không cần căn chính xác.
+"""
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+
+from config import ECHO_MODE, ECHO_TAIL_MS, ECHO_BARGE_IN_DB
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+_SILENCE_DB = -120.0
+
+
+def _frame_energy_db(samples: np.ndarray, frame_len: int) -> np.ndarray:
+    """Năng lượng (dBFS) của từng khung `frame_len` mẫu, bỏ phần dư cuối"""
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    energy = np.mean(frames * frames, axis=1)
+    return (10.0 * np.log10(energy + 1e-12)).astype(np.float32)
+
+
+class PlaybackReference:
+    """Đường bao năng lượng của audio loa đang phát (tham chiếu cho phía mic)"""
+
+    def __init__(self, frame_ms: int = 20, tail_ms: int = ECHO_TAIL_MS):
+        """
+        Args:
+            frame_ms: Độ dài khung đường bao (ms)
+            tail_ms: Echo còn kéo dài bao lâu sau khung phát (độ trễ loa/mic + vang phòng)
+        """
+        self.frame_s = frame_ms / 1000.0
+        self.tail_frames = max(0, int(round(tail_ms / frame_ms)))
+        self._segments = []  # (start_time, đường bao đã max-filter theo tail)
+        self._lock = threading.Lock()
+
+    def begin(self, audio: np.ndarray, sample_rate: int, start_time: Optional[float] = None):
+        """
+        Loa gọi ngay trước khi phát `audio` (float32/int16, mono hoặc (samples, channels)).
+        """
+        samples = np.asarray(audio)
+        if samples.dtype == np.int16:
+            samples = samples.astype(np.float32) / 32768.0
+        if samples.ndim == 2:
+            samples = samples.mean(axis=1)
+        samples = samples.astype(np.float32, copy=False)
+        frame_len = max(1, int(sample_rate * self.frame_s))
+        envelope = _frame_energy_db(samples, frame_len)
+        # Thêm `tail` khung im lặng để echo vẫn được tính sau khi phát xong
+        envelope = np.concatenate((envelope, np.full(self.tail_frames, _SILENCE_DB, dtype=np.float32)))
+        # filtered[j] = max(envelope[j - tail .. j])
+        filtered = maximum_filter1d(envelope, size=self.tail_frames + 1, origin=self.tail_frames // 2,
+                                    mode="constant", cval=_SILENCE_DB)
+        start_time = time.time() if start_time is None else start_time
+        with self._lock:
+            now = time.time()
+            self._segments = [s for s in self._segments if s[0] + len(s[1]) * self.frame_s > now]
+            self._segments.append((start_time, filtered))
+
+    def stop(self):
+        """Dừng phát giữa chừng: cắt các đoạn đang phát tại thời điểm hiện tại (giữ phần tail)"""
+        now = time.time()
+        with self._lock:
+            segments = []
+            for start, envelope in self._segments:
+                played = int((now - start) / self.frame_s)
+                if played < len(envelope):
+                    envelope = envelope[:max(0, played) + self.tail_frames]
+                segments.append((start, envelope))
+            self._segments = segments
+
+    def is_active(self, start_time: float, end_time: float) -> bool:
+        """Có audio loa (hoặc tail của nó) trong khoảng thời gian này hay không"""
+        with self._lock:
+            return any(start <= end_time and start + len(env) * self.frame_s >= start_time
+                       for start, env in self._segments)
+
+    def envelope(self, start_time: float, n_frames: int, frame_s: float) -> np.ndarray:
+        """Mức echo tham chiếu (dBFS) tại các thời điểm start_time + k * frame_s"""
+        times = start_time + np.arange(n_frames) * frame_s
+        result = np.full(n_frames, _SILENCE_DB, dtype=np.float32)
+        with self._lock:
+            segments = list(self._segments)
+        for start, env in segments:
+            idx = np.floor((times - start) / self.frame_s).astype(np.int64)
+            valid = (idx >= 0) & (idx < len(env))
+            if valid.any():
+                result[valid] = np.maximum(result[valid], env[idx[valid]])
+        return result
+
+
+class EchoSuppressor:
+    """Chặn echo của loa trước VAD, vẫn cho phép người dùng nói chen (barge-in)"""
+
+    def __init__(self, sample_rate: int, reference: PlaybackReference, mode: str = ECHO_MODE,
+                 barge_in_db: float = ECHO_BARGE_IN_DB, frame_ms: int = 20,
+                 min_barge_in_frames: int = 3, coupling_db: float = 0.0):
+        """
+        Args:
+            sample_rate: Tần số lấy mẫu của chunk mic
+            reference: Đường bao audio loa đang phát
+            mode: "off", "gate" (bỏ qua mic khi loa đang phát) hoặc "suppress" (cho phép barge-in)
+            barge_in_db: Khung mic phải vượt mức echo dự kiến bao nhiêu dB để coi là người dùng nói
+            frame_ms: Độ dài khung so sánh (ms)
+            min_barge_in_frames: Số khung vượt ngưỡng tối thiểu trong chunk để coi là barge-in
+            coupling_db: Hệ số ghép loa -> mic ban đầu (dB), tự học trong lúc phát
+        """
+        self.sample_rate = sample_rate
+        self.reference = reference
+        self.mode = mode
+        self.barge_in_db = barge_in_db
+        self.frame_len = max(1, int(sample_rate * frame_ms / 1000))
+        self.frame_s = self.frame_len / sample_rate
+        self.min_barge_in_frames = min_barge_in_frames
+        self.coupling_db = coupling_db
+        self.suppressed_chunks = 0
+        self.barge_ins = 0
+        self.playback_active = False  # Loa có đang phát trong khoảng thời gian của chunk vừa xử lý
+
+    def process(self, chunk: np.ndarray, capture_end: float):
+        """
+        Args:
+            chunk: Audio mic float32 (mono)
+            capture_end: Thời điểm (time.time()) thu mẫu cuối của chunk
+
+        Returns:
+            (echo_only, barge_in): echo_only = chunk chỉ có tiếng loa (không được mở câu nói mới),
+            barge_in = người dùng nói trong lúc loa đang phát
+        """
+        if self.mode == "off":
+            return False, False
+        capture_start = capture_end - len(chunk) / self.sample_rate
+        self.playback_active = self.reference.is_active(capture_start, capture_end)
+        if not self.playback_active:
+            return False, False
+        if self.mode == "gate":
+            self.suppressed_chunks += 1
+            return True, False
+
+        mic_db = _frame_energy_db(chunk, self.frame_len)
+        ref_db = self.reference.envelope(capture_start, len(mic_db), self.frame_s)
+        # Chỉ xét các khung nằm trong thời gian loa phát (khung ngoài là mic bình thường, để chunk sau xử lý)
+        playing = ref_db > _SILENCE_DB
+        excess = mic_db[playing] - (ref_db[playing] + self.coupling_db)
+        if np.count_nonzero(excess > self.barge_in_db) >= self.min_barge_in_frames:
+            self.barge_ins += 1
+            return False, True
+
+        # Chỉ có echo: học hệ số ghép loa -> mic trên các khung loa đủ to. Dùng phân vị 90
+        # (không phải trung vị) để mức echo dự kiến phủ cả các đỉnh echo, tránh barge-in giả
+        loud = ref_db > -50.0
+        if loud.any():
+            measured = float(np.percentile(mic_db[loud] - ref_db[loud], 90))
+            self.coupling_db = float(np.clip(self.coupling_db + 0.2 * (measured - self.coupling_db), -40.0, 20.0))
+        self.suppressed_chunks += 1
+        return True, False
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "coupling_db": round(self.coupling_db, 1),
+            "suppressed_chunks": self.suppressed_chunks,
+            "barge_ins": self.barge_ins,
+        }
+
+
+# Tham chiếu dùng chung: VoiceSpeaker ghi, VoiceStreamer đọc
+playback_reference = PlaybackReference()
@@ -0,0 +1,222 @@
+"""
+Keyword Spotter
+===============
+Lọc câu nói trước khi gửi STT: chỉ câu có chứa cụm từ đánh thức (wake phrase) mới được gửi.
+
+Mô hình rất nhỏ chạy trên CPU: MFCC (numpy, filterbank/DCT cache sẵn) + so khớp
+subsequence DTW với vài bản ghi mẫu của cụm từ (file WAV trong KWS_TEMPLATE_DIR).
+MFCC được tính dần theo từng chunk trong lúc người dùng nói, nên lúc kết thúc câu chỉ
+còn bước DTW. Thời gian CPU mỗi chunk được thống kê trong get_stats().
+"""
+import glob
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+from scipy.fft import dct
+
+from log import setup_logger
+from module.resampler import resample
+
+logger = setup_logger(__name__)
+
+
+@lru_cache(maxsize=4)
+def _mel_filterbank(sample_rate: int, n_fft: int, n_mels: int) -> np.ndarray:
+    """Ma trận mel filterbank (n_mels, n_fft // 2 + 1)"""
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+    mel_points = np.linspace(hz_to_mel(60.0), hz_to_mel(min(7600.0, sample_rate / 2)), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / sample_rate).astype(int)
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return bank
+
+
+@lru_cache(maxsize=4)
+def _dct_matrix(n_mels: int, n_mfcc: int) -> np.ndarray:
+    """Ma trận DCT-II (n_mels, n_mfcc), bỏ hệ số c0 (năng lượng)"""
+    return dct(np.eye(n_mels), type=2, norm="ortho", axis=0)[:, 1:n_mfcc + 1].astype(np.float32)
+
+
+class MfccExtractor:
+    """Tính MFCC theo luồng: giữ phần mẫu chưa đủ một khung cho chunk sau"""
+
+    def __init__(self, sample_rate: int, n_mfcc: int = 12, n_mels: int = 26,
+                 frame_ms: int = 25, hop_ms: int = 10):
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.hop = int(sample_rate * hop_ms / 1000)
+        self.n_fft = 1 << (self.frame_len - 1).bit_length()
+        self._window = np.hamming(self.frame_len).astype(np.float32)
+        self._mel = _mel_filterbank(sample_rate, self.n_fft, n_mels)
+        self._dct = _dct_matrix(n_mels, n_mfcc)
+        self._tail = np.empty(0, dtype=np.float32)
+
+    def reset(self):
+        self._tail = np.empty(0, dtype=np.float32)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Trả về MFCC (n_frames, n_mfcc) của các khung mới đủ mẫu"""
+        buffer = np.concatenate((self._tail, samples.astype(np.float32, copy=False)))
+        if len(buffer) < self.frame_len:
+            self._tail = buffer
+            return np.empty((0, self._dct.shape[1]), dtype=np.float32)
+        n_frames = 1 + (len(buffer) - self.frame_len) // self.hop
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, self.frame_len)[::self.hop][:n_frames]
+        self._tail = buffer[n_frames * self.hop:].copy()
+        # Pre-emphasis trong từng khung (không phụ thuộc biên chunk)
+        emphasized = np.empty_like(frames)
+        emphasized[:, 0] = frames[:, 0]
+        emphasized[:, 1:] = frames[:, 1:] - 0.97 * frames[:, :-1]
+        power = np.abs(np.fft.rfft(emphasized * self._window, n=self.n_fft, axis=1)) ** 2
+        log_mel = np.log(power @ self._mel.T + 1e-10)
+        return log_mel @ self._dct
+
+
+def _normalize(features: np.ndarray) -> np.ndarray:
+    """
+    Chuẩn hoá độ dài từng vector để dùng khoảng cách cosine. Không trừ trung bình theo câu (CMN):
+    câu có khoảng lặng/từ khác làm lệch trung bình so với mẫu, nên mẫu cần ghi bằng chính mic của thiết bị.
+    """
+    return features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-8)
+
+
+def subsequence_dtw(template: np.ndarray, utterance: np.ndarray) -> float:
+    """
+    Khoảng cách DTW nhỏ nhất của `template` so với một đoạn con bất kỳ của `utterance`
+    (cả hai đã chuẩn hoá), chia cho độ dài template. Bước đi: (1,0), (1,1), (1,2) nên
+    mỗi hàng template tính vector hoá trên toàn bộ utterance.
+    """
+    cost = 1.0 - template @ utterance.T  # Khoảng cách cosine (T_template, T_utt)
+    acc = cost[0].copy()  # Bắt đầu ở vị trí bất kỳ
+    for i in range(1, len(template)):
+        prev = acc
+        best = prev.copy()
+        best[1:] = np.minimum(best[1:], prev[:-1])
+        best[2:] = np.minimum(best[2:], prev[:-2])
+        best[:1] = prev[:1]
+        acc = cost[i] + best
+    return float(acc.min() / len(template))
+
+
+class KeywordSpotter:
+    """Phát hiện cụm từ đánh thức trong câu nói bằng MFCC + DTW với các bản ghi mẫu"""
+
+    def __init__(self, sample_rate: int, template_dir: str, threshold: float = 0.35,
+                 search_seconds: float = 0.0):
+        """
+        Args:
+            sample_rate: Tần số lấy mẫu của audio câu nói
+            template_dir: Thư mục chứa các file WAV mẫu của cụm từ đánh thức
+            threshold: Khoảng cách DTW tối đa để coi là khớp (càng nhỏ càng chặt)
+            search_seconds: Chỉ tìm trong N giây đầu câu (0 = cả câu)
+
+        Raises:
+            ValueError: Nếu không có file mẫu nào
+        """
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.search_frames = 0
+        self._extractor = MfccExtractor(sample_rate)
+        if search_seconds > 0:
+            self.search_frames = int(search_seconds * sample_rate / self._extractor.hop)
+
+        self.templates = {}
+        for path in sorted(glob.glob(os.path.join(template_dir, "*.wav"))):
+            self.templates[os.path.splitext(os.path.basename(path))[0]] = self._load_template(path)
+        if not self.templates:
+            raise ValueError(f"Không có file mẫu keyword (*.wav) trong {template_dir}")
+        self._min_template = min(len(t) for t in self.templates.values())
+        logger.info(f"🔑 Keyword spotter: {len(self.templates)} mẫu, ngưỡng {threshold}")
+
+        self._features = []
+        self._frame_count = 0
+        self._detected: Optional[tuple] = None
+        self._stats = {"chunks": 0, "chunk_ms_total": 0.0, "chunk_ms_max": 0.0,
+                       "utterances": 0, "accepted": 0}
+
+    def _load_template(self, path: str) -> np.ndarray:
+        audio, rate = sf.read(path, dtype="float32", always_2d=True)
+        audio = audio.mean(axis=1)
+        if rate != self.sample_rate:
+            audio = resample(audio, rate, self.sample_rate)
+        extractor = MfccExtractor(self.sample_rate)
+        return _normalize(extractor.process(audio))
+
+    def reset(self):
+        """Bắt đầu câu mới"""
+        self._extractor.reset()
+        self._features = []
+        self._frame_count = 0
+        self._detected = None
+
+    def process_chunk(self, samples: np.ndarray) -> bool:
+        """
+        Thêm audio mới của câu đang nói và thử so khớp.
+
+        Returns:
+            True nếu đã phát hiện cụm từ đánh thức trong câu
+        """
+        if self._detected is not None:
+            return True
+        if self.search_frames and self._frame_count >= self.search_frames:
+            return False
+        start = time.perf_counter()
+        features = self._extractor.process(samples)
+        if len(features):
+            self._features.append(features)
+            self._frame_count += len(features)
+            if self._frame_count >= self._min_template:
+                self._match()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats["chunks"] += 1
+        self._stats["chunk_ms_total"] += elapsed_ms
+        self._stats["chunk_ms_max"] = max(self._stats["chunk_ms_max"], elapsed_ms)
+        return self._detected is not None
+
+    def _match(self):
+        utterance = np.concatenate(self._features)
+        if self.search_frames:
+            utterance = utterance[:self.search_frames]
+        self._features = [utterance]
+        normalized = _normalize(utterance)
+        for name, template in self.templates.items():
+            if len(normalized) < len(template):
+                continue
+            distance = subsequence_dtw(template, normalized)
+            if distance <= self.threshold:
+                self._detected = (name, distance)
+                logger.info(f"🔑 Phát hiện keyword '{name}' (khoảng cách {distance:.3f})")
+                return
+
+    def finish(self) -> bool:
+        """Kết thúc câu: trả về có chứa cụm từ đánh thức hay không (và cập nhật thống kê)"""
+        detected = self._detected is not None
+        self._stats["utterances"] += 1
+        if detected:
+            self._stats["accepted"] += 1
+        return detected
+
+    def get_stats(self) -> dict:
+        chunks = self._stats["chunks"]
+        return {
+            "templates": list(self.templates),
+            "chunks": chunks,
+            "chunk_ms_avg": self._stats["chunk_ms_total"] / chunks if chunks else 0.0,
+            "chunk_ms_max": self._stats["chunk_ms_max"],
+            "utterances": self._stats["utterances"],
+            "accepted": self._stats["accepted"],
+        }
@@ -0,0 +1,169 @@
+"""
+Lane Clip Encoder
+=================
+Đóng gói các frames của một cửa sổ Lane Segmentation thành một clip video ngắn
+(H.264 GOP nhỏ hoặc MJPEG) trong bộ nhớ bằng PyAV.
+
+Các frames liên tiếp trong cửa sổ rất giống nhau nên clip H.264 nhỏ hơn nhiều lần
+so với k ảnh JPEG độc lập. Kèm theo là manifest chứa timestamp từng frame để server
+tách lại đúng thứ tự/thời điểm.
+"""
+import io
+import json
+import time
+from fractions import Fraction
+from typing import Optional
+
+import av
+import numpy as np
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+# codec -> (container format, encoder PyAV, MIME type, tên file)
+CLIP_FORMATS = {
+    "h264": ("mp4", "libx264", "video/mp4", "window.mp4"),
+    "mjpeg": ("avi", "mjpeg", "video/x-msvideo", "window.avi"),
+}
+
+
+class LaneClipEncoder:
+    """Encode từng frame vào clip ngay khi chụp, đóng clip khi kết thúc cửa sổ."""
+
+    def __init__(self, codec: str = "h264", gop: int = 5, crf: int = 28):
+        """
+        Args:
+            codec: "h264" (GOP nhỏ, inter-frame) hoặc "mjpeg" (intra-only)
+            gop: Số frames giữa 2 keyframe (1 = toàn bộ intra-coded)
+            crf: Chất lượng H.264 (càng cao càng nhỏ)
+
+        Raises:
+            ValueError: Nếu codec không được hỗ trợ hoặc PyAV không có encoder tương ứng
+        """
+        if codec not in CLIP_FORMATS:
+            raise ValueError(f"Codec clip không hỗ trợ: {codec}")
+        container_format, encoder, mime_type, filename = CLIP_FORMATS[codec]
+        if encoder not in av.codecs_available:
+            raise ValueError(f"PyAV không có encoder '{encoder}'")
+
+        self.codec = codec
+        self.gop = max(1, gop)
+        self.crf = crf
+        self.mime_type = mime_type
+        self.filename = filename
+        self._container_format = container_format
+        self._encoder = encoder
+
+        self._buffer: Optional[io.BytesIO] = None
+        self._container = None
+        self._stream = None
+        self._start_ms = None
+        self._timestamps = []
+        self._encode_time = 0.0
+
+    @property
+    def frame_count(self) -> int:
+        return len(self._timestamps)
+
+    @property
+    def encode_time(self) -> float:
+        """Tổng thời gian encode của cửa sổ hiện tại (giây)."""
+        return self._encode_time
+
+    def _open(self, width: int, height: int):
+        self._buffer = io.BytesIO()
+        self._container = av.open(self._buffer, mode="w", format=self._container_format)
+        # time_base mili-giây: pts = offset (ms) từ frame đầu tiên của cửa sổ
+        self._stream = self._container.add_stream(self._encoder, rate=1000)
+        self._stream.width = width
+        self._stream.height = height
+        self._stream.time_base = Fraction(1, 1000)
+        self._stream.codec_context.time_base = Fraction(1, 1000)
+        if self.codec == "h264":
+            self._stream.pix_fmt = "yuv420p"
+            self._stream.codec_context.gop_size = self.gop
+            self._stream.options = {
+                "preset": "ultrafast",
+                "tune": "zerolatency",
+                "crf": str(self.crf),
+            }
+        else:
+            self._stream.pix_fmt = "yuvj420p"
+
+    def add_frame(self, frame: np.ndarray, timestamp: Optional[float] = None):
+        """
+        Thêm một frame BGR (OpenCV) vào clip.
+
+        Args:
+            frame: Ảnh BGR uint8 (H, W, 3)
+            timestamp: Thời điểm chụp (epoch giây), mặc định time.time()
+        """
+        start = time.time()
+        timestamp = timestamp if timestamp is not None else start
+        ts_ms = int(timestamp * 1000)
+        if self._container is None:
+            height, width = frame.shape[:2]
+            self._open(width, height)
+            self._start_ms = ts_ms
+        # pts phải tăng nghiêm ngặt
+        pts = ts_ms - self._start_ms
+        if self._timestamps and pts <= self._timestamps[-1] - self._start_ms:
+            pts = self._timestamps[-1] - self._start_ms + 1
+            ts_ms = self._start_ms + pts
+
+        video_frame = av.VideoFrame.from_ndarray(frame, format="bgr24")
+        video_frame.pts = pts
+        for packet in self._stream.encode(video_frame):
+            self._container.mux(packet)
+        self._timestamps.append(ts_ms)
+        self._encode_time += time.time() - start
+
+    def finish(self) -> Optional[tuple]:
+        """
+        Flush encoder và đóng clip.
+
+        Returns:
+            (clip_bytes, manifest dict) hoặc None nếu cửa sổ không có frame
+        """
+        if self._container is None:
+            return None
+        start = time.time()
+        try:
+            for packet in self._stream.encode():
+                self._container.mux(packet)
+            self._container.close()
+            clip_bytes = self._buffer.getvalue()
+        finally:
+            self._encode_time += time.time() - start
+        manifest = {
+            "codec": self.codec,
+            "container": self._container_format,
+            "width": self._stream.width,
+            "height": self._stream.height,
+            "gop": self.gop,
+            "frame_count": len(self._timestamps),
+            "frame_timestamps": list(self._timestamps),
+        }
+        return clip_bytes, manifest
+
+    def reset(self):
+        """Huỷ clip hiện tại để bắt đầu cửa sổ mới."""
+        if self._container is not None:
+            try:
+                self._container.close()
+            except Exception:
+                pass
+        self._buffer = None
+        self._container = None
+        self._stream = None
+        self._start_ms = None
+        self._timestamps = []
+        self._encode_time = 0.0
+
+
+def build_clip_request(clip_bytes: bytes, manifest: dict, filename: str, mime_type: str):
+    """Tạo (files, data) cho requests.post multipart: clip + manifest JSON."""
+    files = [("clip", (filename, clip_bytes, mime_type))]
+    data = {"manifest": json.dumps(manifest)}
+    return files, data
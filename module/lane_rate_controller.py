@@ -0,0 +1,177 @@
+"""
+Lane Rate Controller
+====================
+Điều khiển nhịp gửi cửa sổ frames và số frames mỗi cửa sổ cho Lane Segmentation
+dựa trên tốc độ di chuyển (GPS), mức thay đổi cảnh trong cửa sổ và latency của server.
+
+Đứng yên + cảnh tĩnh  -> chu kỳ dài (SEND_INTERVAL_MAX), ít frames, có thể bỏ qua gửi.
+Đang đi / cảnh đổi    -> chu kỳ ngắn (SEND_INTERVAL_MIN), đủ frames.
+"""
+import multiprocessing as mp
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from config import (
+    SEND_INTERVAL_MIN, SEND_INTERVAL_MAX, LANE_SEGMENTATION_FRAME_COUNT,
+    LANE_RATE_MIN_FRAMES, LANE_RATE_STATIONARY_KMH, LANE_RATE_WALKING_KMH,
+    LANE_RATE_SCENE_CHANGE_FULL, LANE_RATE_SMOOTHING, LANE_RATE_LATENCY_MARGIN
+)
+
+# Thứ tự các trường trong mảng shared memory (mp.Array) để process chính đọc trạng thái
+RATE_STATE_FIELDS = (
+    "speed_kmh",        # -1 nếu chưa có dữ liệu GPS
+    "scene_change",     # Tổng khác biệt cảnh của cửa sổ gần nhất
+    "activity",         # 0.0 (đứng yên) -> 1.0 (di chuyển / cảnh đổi nhiều)
+    "interval",         # Chu kỳ giữa 2 lần bắt đầu cửa sổ (giây)
+    "frame_count",      # Số frames cho cửa sổ kế tiếp
+    "latency",          # Latency server (EWMA, giây)
+    "sent_windows",
+    "skipped_windows",
+)
+
+
+def create_rate_state() -> "mp.Array":
+    """Tạo mảng shared memory chứa trạng thái của rate controller."""
+    state = mp.Array('d', len(RATE_STATE_FIELDS))
+    state[RATE_STATE_FIELDS.index("speed_kmh")] = -1.0
+    state[RATE_STATE_FIELDS.index("interval")] = SEND_INTERVAL_MIN
+    state[RATE_STATE_FIELDS.index("frame_count")] = LANE_SEGMENTATION_FRAME_COUNT
+    return state
+
+
+def read_rate_state(state) -> dict:
+    """Đọc mảng shared memory thành dict."""
+    with state.get_lock():
+        values = list(state)
+    result = dict(zip(RATE_STATE_FIELDS, values))
+    result["frame_count"] = int(result["frame_count"])
+    result["sent_windows"] = int(result["sent_windows"])
+    result["skipped_windows"] = int(result["skipped_windows"])
+    if result["speed_kmh"] < 0:
+        result["speed_kmh"] = None
+    return result
+
+
+def scene_change_between(frame1: Optional[np.ndarray], frame2: Optional[np.ndarray]) -> float:
+    """Mức khác biệt trung bình giữa 2 frames (trên ảnh thu nhỏ 64x64)."""
+    if frame1 is None or frame2 is None:
+        return 0.0
+    small1 = cv2.resize(frame1, (64, 64))
+    small2 = cv2.resize(frame2, (64, 64))
+    return float(np.mean(cv2.absdiff(small1, small2)))
+
+
+class LaneRateController:
+    """Tính chu kỳ gửi và số frames cho từng cửa sổ."""
+
+    def __init__(self, max_frames: int = LANE_SEGMENTATION_FRAME_COUNT,
+                 diff_threshold: float = 25, shared_state=None):
+        """
+        Args:
+            max_frames: Số frames tối đa mỗi cửa sổ
+            diff_threshold: Ngưỡng khác biệt cảnh trung bình mỗi cặp frames liên tiếp để coi cửa sổ là "có thay đổi"
+            shared_state: mp.Array (từ create_rate_state) để công bố trạng thái, có thể None
+        """
+        self.max_frames = max(1, max_frames)
+        self.min_frames = max(1, min(LANE_RATE_MIN_FRAMES, self.max_frames))
+        self.diff_threshold = diff_threshold
+        self._shared_state = shared_state
+
+        self.speed_kmh: Optional[float] = None
+        self.scene_change = 0.0
+        self.activity = 1.0
+        self.interval = float(SEND_INTERVAL_MIN)
+        self.frame_count = self.max_frames
+        self.latency: Optional[float] = None
+        self.sent_windows = 0
+        self.skipped_windows = 0
+        self._publish()
+
+    def update_speed(self, speed_kmh: Optional[float]):
+        """Cập nhật tốc độ đi bộ hiện tại (None/âm = chưa có GPS)."""
+        self.speed_kmh = speed_kmh if speed_kmh is not None and speed_kmh >= 0 else None
+
+    def record_latency(self, seconds: float):
+        """Ghi nhận thời gian phản hồi của server cho 1 cửa sổ."""
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = 0.7 * self.latency + 0.3 * seconds
+        self._publish()
+
+    def is_stationary(self) -> bool:
+        return self.speed_kmh is not None and self.speed_kmh < LANE_RATE_STATIONARY_KMH
+
+    def _speed_score(self) -> float:
+        if self.speed_kmh is None:
+            # Chưa có GPS: không biết đang đi hay đứng -> mức trung bình
+            return 0.5
+        span = max(1e-3, LANE_RATE_WALKING_KMH - LANE_RATE_STATIONARY_KMH)
+        return float(np.clip((self.speed_kmh - LANE_RATE_STATIONARY_KMH) / span, 0.0, 1.0))
+
+    def should_send(self, scene_change: float, pairs: int = 1) -> bool:
+        """
+        Cửa sổ có đáng gửi không (bỏ qua khi cảnh tĩnh và người dùng không di chuyển).
+
+        Args:
+            scene_change: Tổng khác biệt cảnh giữa các frames liên tiếp trong cửa sổ
+            pairs: Số cặp frames đã cộng vào scene_change (ngưỡng tính cho một cặp)
+        """
+        if scene_change / max(1, pairs) > self.diff_threshold:
+            return True
+        # Đang đi: vẫn cần hướng dẫn dù cảnh ít thay đổi
+        return self.speed_kmh is not None and not self.is_stationary()
+
+    def close_window(self, scene_change: float, sent: bool):
+        """
+        Cập nhật controller khi kết thúc một cửa sổ.
+
+        Args:
+            scene_change: Tổng khác biệt cảnh giữa các frames liên tiếp trong cửa sổ
+            sent: Cửa sổ có được gửi lên server hay không
+        """
+        self.scene_change = scene_change
+        if sent:
+            self.sent_windows += 1
+        else:
+            self.skipped_windows += 1
+
+        scene_score = float(np.clip(scene_change / LANE_RATE_SCENE_CHANGE_FULL, 0.0, 1.0))
+        self.activity = max(self._speed_score(), scene_score)
+
+        target = SEND_INTERVAL_MAX - self.activity * (SEND_INTERVAL_MAX - SEND_INTERVAL_MIN)
+        # Không gửi nhanh hơn tốc độ server xử lý được
+        if self.latency is not None:
+            target = max(target, self.latency * LANE_RATE_LATENCY_MARGIN)
+        self.interval = LANE_RATE_SMOOTHING * self.interval + (1 - LANE_RATE_SMOOTHING) * target
+
+        self.frame_count = int(round(
+            self.min_frames + self.activity * (self.max_frames - self.min_frames)))
+        self._publish()
+
+    def get_state(self) -> dict:
+        """Trạng thái hiện tại của controller."""
+        return {
+            "speed_kmh": self.speed_kmh,
+            "scene_change": self.scene_change,
+            "activity": self.activity,
+            "interval": self.interval,
+            "frame_count": self.frame_count,
+            "latency": self.latency,
+            "sent_windows": self.sent_windows,
+            "skipped_windows": self.skipped_windows,
+        }
+
+    def _publish(self):
+        """Ghi trạng thái ra shared memory để process chính đọc được."""
+        if self._shared_state is None:
+            return
+        state = self.get_state()
+        with self._shared_state.get_lock():
+            for i, name in enumerate(RATE_STATE_FIELDS):
+                value = state[name]
+                if value is None:
+                    value = -1.0 if name == "speed_kmh" else 0.0
+                self._shared_state[i] = float(value)
@@ -5,12 +5,23 @@ import time
 import multiprocessing as mp
 from multiprocessing import shared_memory
 import numpy as np
-from config import BASE_DIR, SERVER_HTTP_BASE, DIFF_THRESHOLD, SEND_INTERVAL_MIN, SEND_INTERVAL_MAX, LANE_SEGMENTATION_FRAME_COUNT
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    BASE_DIR, SERVER_HTTP_BASE, DIFF_THRESHOLD, LANE_SEGMENTATION_FRAME_COUNT, LANE_ENCODE_WORKERS, LANE_JPEG_QUALITY,
+    LANE_UPLOAD_FORMAT, LANE_CLIP_GOP, LANE_CLIP_ENDPOINT, LANE_STREAM_ENDPOINT
+)
 from container import container
+from module.lane_rate_controller import LaneRateController, create_rate_state, read_rate_state, scene_change_between
+from module.lane_clip import LaneClipEncoder, build_clip_request
+from module.lane_stream import LaneStreamUploader
 from module.voice_speaker import VoiceSpeaker
 
 from log import setup_logger
 logger = setup_logger(__name__)
+
+# Server chưa hỗ trợ endpoint clip -> quay về gửi batch JPEG
+CLIP_UNSUPPORTED_STATUS = (404, 405, 415, 422)
 import cv2
 import numpy as np
 import requests
@@ -26,16 +37,21 @@ def _lane_segmentation_worker(
     collection_window: float,
     diff_threshold: float,
     server_url: str,
-    base_dir: str
+    base_dir: str,
+    speed_kmh: "mp.Value",
+    rate_state: "mp.Array"
 ):
     """
     Worker process cho Lane Segmentation.
     Đọc frames từ shared memory của camera và gửi đến API.
+    Nhịp gửi và số frames mỗi cửa sổ do LaneRateController quyết định.
     """
 
-    
-    frame_interval = collection_window / frame_count
-    adaptive_interval = SEND_INTERVAL_MIN
+    controller = LaneRateController(
+        max_frames=frame_count,
+        diff_threshold=diff_threshold,
+        shared_state=rate_state
+    )
     
     # Attach to camera shared memory
     try:
@@ -46,79 +62,244 @@ def _lane_segmentation_worker(
         logger.exception(f"[LaneSegmentation Worker] Không thể attach camera shared memory: {e}")
         return
     
-    def frames_are_different(frame1, frame2, threshold):
-        if frame1 is None or frame2 is None:
-            return True
-        small1 = cv2.resize(frame1, (64, 64))
-        small2 = cv2.resize(frame2, (64, 64))
-        diff = cv2.absdiff(small1, small2)
-        mean_diff = np.mean(diff)
-        return mean_diff > threshold
+    # cv2.imencode nhả GIL -> encode song song bằng thread pool ngay khi chụp frame,
+    # để khi đóng cửa sổ batch đã sẵn sàng và upload bắt đầu ngay
+    encode_pool = ThreadPoolExecutor(max_workers=LANE_ENCODE_WORKERS, thread_name_prefix="lane-encode")
+    
+    def encode_frame(frame):
+        """Encode JPEG một frame, trả về (bytes | None, thời gian encode)"""
+        start = time.time()
+        success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, LANE_JPEG_QUALITY])
+        return (buffer.tobytes() if success else None), time.time() - start
+    
+    # Chế độ upload clip video (tuỳ chọn): encoder có trạng thái nên chạy tuần tự trên 1 thread riêng
+    clip_encoder = None
+    clip_pool = None
+    if LANE_UPLOAD_FORMAT in ("h264", "mjpeg"):
+        try:
+            clip_encoder = LaneClipEncoder(codec=LANE_UPLOAD_FORMAT, gop=LANE_CLIP_GOP)
+            clip_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lane-clip")
+            logger.info(f"[LaneSegmentation Worker] Upload dạng clip: {LANE_UPLOAD_FORMAT} (GOP={LANE_CLIP_GOP})")
+        except Exception as e:
+            logger.warning(f"[LaneSegmentation Worker] Không dùng được clip {LANE_UPLOAD_FORMAT}, gửi JPEG: {e}")
+            clip_encoder = None
+    
+    # Chế độ streaming (tuỳ chọn): upload từng frame ngay khi chụp vào session trên server
+    streamer = None
+    if LANE_UPLOAD_FORMAT == "stream":
+        streamer = LaneStreamUploader(server_url, endpoint=LANE_STREAM_ENDPOINT)
+        logger.info("[LaneSegmentation Worker] Upload dạng streaming từng frame")
+    
+    def handle_navigation_result(data):
+        """Xử lý kết quả điều hướng từ server"""
+        # Xử lý audio (thông qua file thay vì container)
+        audio_file = data.get("final_result", {}).get("data", {}).get("audio_file")
+        if audio_file:
+            audio_path = os.path.join(base_dir, "audio", "warning", f"{audio_file}.wav")
+            if os.path.exists(audio_path):
+                # Gửi signal để main process phát audio
+                logger.info(f"[LaneSegmentation Worker] Audio file: {audio_path}")
+    
+    def send_clip_to_api(clip_bytes, manifest):
+        """
+        Gửi clip của cửa sổ (kèm manifest timestamp) đến API.
+
+        Returns:
+            (latency | None, accepted): accepted=False nếu server không hỗ trợ clip
+        """
+        request_start = time.time()
+        try:
+            files, form = build_clip_request(clip_bytes, manifest, clip_encoder.filename, clip_encoder.mime_type)
+            response = requests.post(
+                f"{server_url}{LANE_CLIP_ENDPOINT}",
+                files=files,
+                data=form,
+                timeout=15
+            )
+            latency = time.time() - request_start
+            
+            if response.status_code in CLIP_UNSUPPORTED_STATUS:
+                logger.warning(f"[LaneSegmentation Worker] Server không hỗ trợ clip (HTTP {response.status_code})")
+                return latency, False
+            if response.status_code != 200:
+                logger.error(f"[LaneSegmentation Worker] HTTP {response.status_code}")
+                return latency, True
+            
+            logger.info(f"[LaneSegmentation Worker] API response received ({latency:.2f}s)")
+            handle_navigation_result(response.json())
+            return latency, True
+        except requests.exceptions.Timeout:
+            logger.error("[LaneSegmentation Worker] Request timeout")
+            return time.time() - request_start, True
+        except Exception as e:
+            logger.exception(f"[LaneSegmentation Worker] Error: {e}")
+            return None, True
+    
+    def send_clip_window(jobs, capture_time):
+        """Đóng clip của cửa sổ và gửi, trả về (latency, accepted)"""
+        wait_start = time.time()
+        for job in jobs:
+            try:
+                job.result()
+            except Exception as e:
+                logger.error(f"[LaneSegmentation Worker] Lỗi encode clip: {e}")
+        try:
+            result = clip_pool.submit(clip_encoder.finish).result()
+            encode_time = clip_encoder.encode_time
+        except Exception as e:
+            # Lỗi mux/flush của encoder: không để worker chết, gửi cửa sổ bằng batch JPEG
+            logger.error(f"[LaneSegmentation Worker] Lỗi đóng clip: {e}", exc_info=True)
+            return None, False
+        finally:
+            clip_encoder.reset()
+        encode_wait = time.time() - wait_start
+        if result is None:
+            return None, True
+        
+        clip_bytes, manifest = result
+        logger.info(f"[LaneSegmentation Worker] Gửi clip {manifest['frame_count']} frames ({LANE_UPLOAD_FORMAT})")
+        upload_start = time.time()
+        latency, accepted = send_clip_to_api(clip_bytes, manifest)
+        logger.info(
+            f"[LaneSegmentation Worker] Timings: capture={capture_time:.2f}s, "
+            f"encode={encode_time * 1000:.0f}ms (chờ sau cửa sổ {encode_wait * 1000:.0f}ms), "
+            f"upload={time.time() - upload_start:.2f}s, "
+            f"size={len(clip_bytes) / 1024:.0f}KB"
+        )
+        return latency, accepted
     
-    def send_images_to_api(frames):
-        """Gửi frames đến API"""
-        if not frames or len(frames) == 0:
-            return
+    def finish_stream_window(jobs, capture_time, first_capture_time, last_capture_time):
+        """
+        Kết thúc session streaming (ngay khi frame cuối của cửa sổ được gửi đi).
+
+        Returns:
+            Latency tính từ lúc chụp frame đầu tới khi có kết quả, None nếu cần gửi lại bằng batch
+        """
+        finish_start = time.time()
+        result = streamer.finish().result()
+        if result is None:
+            return None
+        done = time.time()
+        latency = done - first_capture_time
+        _, encode_time, _ = collect_encoded(jobs)
+        logger.info(
+            f"[LaneSegmentation Worker] Timings (stream): capture={capture_time:.2f}s, "
+            f"encode={encode_time * 1000:.0f}ms, finish={done - finish_start:.2f}s, "
+            f"frame cuối -> kết quả={done - last_capture_time:.2f}s, "
+            f"frame đầu -> kết quả={latency:.2f}s"
+        )
+        handle_navigation_result(result)
+        return latency
+    
+    def send_images_to_api(encoded_frames):
+        """
+        Gửi frames (đã encode JPEG) đến API.
+
+        Returns:
+            Thời gian phản hồi của server (giây), None nếu không gửi được
+        """
+        if not encoded_frames or len(encoded_frames) == 0:
+            return None
             
+        request_start = None
         try:
             files = []
-            for i, frame in enumerate(frames):
-                if frame is None:
-                    continue
-                success, buffer = cv2.imencode('.jpg', frame)
-                if not success:
+            for i, jpeg_bytes in enumerate(encoded_frames):
+                if jpeg_bytes is None:
                     continue
-                files.append(("files", (f"frame_{i}.jpg", buffer.tobytes(), "image/jpeg")))
+                files.append(("files", (f"frame_{i}.jpg", jpeg_bytes, "image/jpeg")))
             
             if not files:
-                return
+                return None
             
             logger.info(f"[LaneSegmentation Worker] Gửi {len(files)} frames đến API")
             
+            request_start = time.time()
             response = requests.post(
                 f"{server_url}/navigate_batch10/", 
                 files=files,
                 timeout=15
             )
+            latency = time.time() - request_start
             
             if response.status_code != 200:
                 logger.error(f"[LaneSegmentation Worker] HTTP {response.status_code}")
-                return
+                return latency
             
             data = response.json()
-            logger.info(f"[LaneSegmentation Worker] API response received")
-            
-            # Xử lý audio (thông qua file thay vì container)
-            audio_file = data.get("final_result", {}).get("data", {}).get("audio_file")
-            if audio_file:
-                audio_path = os.path.join(base_dir, "audio", "warning", f"{audio_file}.wav")
-                if os.path.exists(audio_path):
-                    # Gửi signal để main process phát audio
-                    logger.info(f"[LaneSegmentation Worker] Audio file: {audio_path}")
+            logger.info(f"[LaneSegmentation Worker] API response received ({latency:.2f}s)")
+            handle_navigation_result(data)
+            return latency
                     
         except requests.exceptions.Timeout:
             logger.error("[LaneSegmentation Worker] Request timeout")
+            # Server quá tải: tính timeout như latency để controller giãn nhịp gửi
+            return time.time() - request_start if request_start else None
         except Exception as e:
             logger.exception(f"[LaneSegmentation Worker] Error: {e}")
+            return None
+    
+    def collect_encoded(jobs):
+        """Chờ các job encode của cửa sổ, trả về (list bytes, tổng thời gian encode, thời gian chờ)"""
+        wait_start = time.time()
+        encoded = []
+        encode_time = 0.0
+        for job in jobs:
+            try:
+                jpeg_bytes, elapsed = job.result()
+                encoded.append(jpeg_bytes)
+                encode_time += elapsed
+            except Exception as e:
+                logger.error(f"[LaneSegmentation Worker] Lỗi encode frame: {e}")
+        return encoded, encode_time, time.time() - wait_start
     
     # Main loop
-    current_window_frames = []
+    current_window_jobs = []  # Futures encode (JPEG hoặc clip) của cửa sổ hiện tại
+    current_window_frames = []  # Frames thô, chỉ giữ ở chế độ clip để fallback sang JPEG
+    last_window_frame = None  # Frame thô gần nhất, chỉ dùng để tính thay đổi cảnh
     window_start_time = None
+    first_frame_time = None
     last_frame_time = None
+    next_window_time = 0.0
+    window_frame_count = controller.frame_count
+    frame_interval = collection_window / window_frame_count
+    scene_change = 0.0
+    stream_window = False  # Cửa sổ hiện tại có đang stream lên server không
+    last_window_sent = True
     
     try:
         while not stop_event.is_set():
             now = time.time()
             
-            # Khởi tạo cửa sổ mới nếu chưa có
+            # Khởi tạo cửa sổ mới nếu chưa có (và đã đến nhịp gửi kế tiếp)
             if window_start_time is None:
+                if now < next_window_time:
+                    time.sleep(0.1)
+                    continue
+                controller.update_speed(speed_kmh.value)
                 window_start_time = now
+                first_frame_time = None
                 last_frame_time = None
+                current_window_jobs = []
                 current_window_frames = []
+                last_window_frame = None
+                scene_change = 0.0
+                window_frame_count = controller.frame_count
+                frame_interval = collection_window / window_frame_count
+                # Đứng yên và cửa sổ trước bị bỏ qua: khả năng cao cửa sổ này cũng bị bỏ qua,
+                # không stream để tránh tốn băng thông, quyết định gửi batch ở cuối cửa sổ
+                stream_window = (
+                    streamer is not None and streamer.supported
+                    and not (controller.is_stationary() and not last_window_sent)
+                )
+                if stream_window:
+                    streamer.open(window_frame_count, now)
             
             # Kiểm tra xem đã đến lúc lấy frame tiếp theo chưa
             should_capture = False
-            if last_frame_time is None:
+            if len(current_window_jobs) >= window_frame_count:
+                should_capture = False
+            elif last_frame_time is None:
                 should_capture = True
             elif (now - last_frame_time) >= frame_interval:
                 should_capture = True
@@ -127,34 +308,99 @@ def _lane_segmentation_worker(
             if should_capture:
                 frame = shared_frame.copy()  # Copy từ shared memory
                 if frame is not None and np.any(frame):  # Kiểm tra frame có data
-                    current_window_frames.append(frame)
+                    if last_window_frame is not None:
+                        # Cộng dồn mức thay đổi cảnh giữa các frames liên tiếp
+                        scene_change += scene_change_between(last_window_frame, frame)
+                    last_window_frame = frame
+                    if clip_encoder is not None:
+                        current_window_frames.append(frame)
+                        current_window_jobs.append(clip_pool.submit(clip_encoder.add_frame, frame, now))
+                    else:
+                        job = encode_pool.submit(encode_frame, frame)
+                        if stream_window:
+                            streamer.submit_frame(job, len(current_window_jobs), now)
+                        current_window_jobs.append(job)
+                    if first_frame_time is None:
+                        first_frame_time = now
                     last_frame_time = now
             
-            # Kiểm tra xem đã hết thời gian cửa sổ chưa
+            # Kiểm tra xem đã hết thời gian cửa sổ chưa (stream: kết thúc ngay khi đã gửi frame cuối,
+            # không chờ hết collection_window)
             elapsed_time = now - window_start_time
-            if elapsed_time >= collection_window:
-                if len(current_window_frames) > 0:
+            if elapsed_time >= collection_window or (
+                    stream_window and len(current_window_jobs) >= window_frame_count):
+                if len(current_window_jobs) > 0:
                     should_send = True
-                    if len(current_window_frames) >= 2:
-                        first_frame = current_window_frames[0]
-                        last_frame = current_window_frames[-1]
-                        if not frames_are_different(first_frame, last_frame, diff_threshold):
-                            should_send = False
-                            adaptive_interval = min(SEND_INTERVAL_MAX, adaptive_interval * 1.2)
+                    if len(current_window_jobs) >= 2:
+                        should_send = controller.should_send(scene_change, len(current_window_jobs) - 1)
+                    
+                    clip_accepted = False
+                    if should_send and clip_encoder is not None:
+                        capture_time = now - window_start_time
+                        latency, clip_accepted = send_clip_window(current_window_jobs, capture_time)
+                        if clip_accepted:
+                            if latency is not None:
+                                controller.record_latency(latency)
+                        else:
+                            # Fallback: server chưa hỗ trợ clip hoặc encoder clip lỗi -> gửi batch JPEG từ giờ trở đi
+                            logger.warning("[LaneSegmentation Worker] Chuyển về chế độ gửi batch JPEG")
+                            clip_encoder = None
+                            clip_pool.shutdown(wait=False)
+                            current_window_jobs = [encode_pool.submit(encode_frame, f) for f in current_window_frames]
                     
-                    if should_send:
-                        logger.info(f"[LaneSegmentation Worker] Gửi {len(current_window_frames)} frames")
-                        send_images_to_api(current_window_frames)
-                        adaptive_interval = max(SEND_INTERVAL_MIN, adaptive_interval * 0.8)
+                    stream_accepted = False
+                    if should_send and stream_window:
+                        latency = finish_stream_window(current_window_jobs, now - window_start_time,
+                                                       first_frame_time, last_frame_time)
+                        if latency is not None:
+                            stream_accepted = True
+                            controller.record_latency(latency)
+                        else:
+                            logger.warning("[LaneSegmentation Worker] Streaming lỗi, gửi lại cửa sổ bằng batch JPEG")
+                    
+                    if should_send and not clip_accepted and not stream_accepted:
+                        capture_time = now - window_start_time
+                        encoded, encode_time, encode_wait = collect_encoded(current_window_jobs)
+                        logger.info(f"[LaneSegmentation Worker] Gửi {len(encoded)} frames")
+                        upload_start = time.time()
+                        latency = send_images_to_api(encoded)
+                        upload_time = time.time() - upload_start
+                        if latency is not None:
+                            controller.record_latency(latency)
+                        logger.info(
+                            f"[LaneSegmentation Worker] Timings: capture={capture_time:.2f}s, "
+                            f"encode={encode_time * 1000:.0f}ms (chờ sau cửa sổ {encode_wait * 1000:.0f}ms), "
+                            f"upload={upload_time:.2f}s, "
+                            f"size={sum(len(b) for b in encoded if b) / 1024:.0f}KB"
+                        )
+                    if not should_send:
+                        if stream_window:
+                            streamer.abort()
+                        for job in current_window_jobs:
+                            job.cancel()
+                        if clip_encoder is not None:
+                            clip_pool.submit(clip_encoder.reset)
+                    controller.close_window(scene_change, sent=should_send)
+                    last_window_sent = should_send
+                    logger.debug(f"[LaneSegmentation Worker] Rate state: {controller.get_state()}")
                 
-                # Reset cửa sổ
+                # Reset cửa sổ, cửa sổ kế tiếp bắt đầu theo chu kỳ của controller
+                next_window_time = window_start_time + controller.interval
                 window_start_time = None
+                first_frame_time = None
                 last_frame_time = None
+                current_window_jobs = []
                 current_window_frames = []
+                last_window_frame = None
             
             time.sleep(0.1)
             
     finally:
+        encode_pool.shutdown(wait=False, cancel_futures=True)
+        if clip_pool is not None:
+            clip_pool.shutdown(wait=False, cancel_futures=True)
+        if streamer is not None:
+            streamer.close()
         camera_shm.close()
         logger.info("[LaneSegmentation Worker] Đã dừng")
 
@@ -174,7 +420,11 @@ class LaneSegmentation:
         
         self.frame_count = frame_count
         self.collection_window = collection_window
-        self.adaptive_interval = SEND_INTERVAL_MIN
+        
+        # Rate controller: tốc độ GPS được đẩy sang worker, trạng thái đọc ngược lại qua shared memory
+        self._speed_kmh = mp.Value('d', -1.0)
+        self._rate_state = create_rate_state()
+        self._speed_thread = None
         
         # Camera shared memory info - sẽ được lấy khi run()
         self._camera_shm_name = None
@@ -214,11 +464,16 @@ class LaneSegmentation:
                 self.collection_window,
                 DIFF_THRESHOLD,
                 SERVER_HTTP_BASE,
-                BASE_DIR
+                BASE_DIR,
+                self._speed_kmh,
+                self._rate_state
             ),
             daemon=True
         )
         self._process.start()
+        
+        self._speed_thread = threading.Thread(target=self._speed_feed_loop, daemon=True)
+        self._speed_thread.start()
         logger.info(f"[LaneSegmentation] Đã khởi động (PID: {self._process.pid})")
         return True
     
@@ -239,9 +494,34 @@ class LaneSegmentation:
                 self._process.terminate()
                 self._process.join(timeout=1.0)
         
+        if self._speed_thread and self._speed_thread.is_alive():
+            self._speed_thread.join(timeout=1.5)
+        
         logger.info("[LaneSegmentation] Đã dừng")
         return True
     
+    def _speed_feed_loop(self):
+        """Đẩy tốc độ từ GPSService (process chính) sang worker mỗi giây."""
+        while self.running:
+            speed = None
+            if container.has("gps"):
+                try:
+                    speed = container.get("gps").get_speed_kmh()
+                except Exception as e:
+                    logger.debug(f"[LaneSegmentation] Không đọc được tốc độ GPS: {e}")
+            self._speed_kmh.value = float(speed) if speed is not None else -1.0
+            time.sleep(1.0)
+    
+    def get_rate_state(self) -> dict:
+        """
+        Trạng thái hiện tại của rate controller.
+        
+        Returns:
+            Dict gồm speed_kmh, scene_change, activity, interval, frame_count,
+            latency, sent_windows, skipped_windows
+        """
+        return read_rate_state(self._rate_state)
+    
     def is_running(self) -> bool:
         """Kiểm tra trạng thái hoạt động."""
         return self.running and self._process is not None and self._process.is_alive()
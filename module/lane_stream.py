@@ -0,0 +1,155 @@
+"""
+Lane Stream Uploader
+====================
+Upload từng frame của cửa sổ Lane Segmentation ngay khi chụp vào một session trên server,
+để server bắt đầu suy luận frame 1 trong khi frame 2..k còn đang được chụp.
+
+Giao thức (HTTP keep-alive, các request của một session gửi tuần tự theo thứ tự frame):
+    POST   {server}/navigate_session/                 -> {"session_id": "..."}
+    POST   {server}/navigate_session/{id}/frame       (multipart: file + index + timestamp)
+    POST   {server}/navigate_session/{id}/finish      -> kết quả giống /navigate_batch10/
+    DELETE {server}/navigate_session/{id}             (huỷ cửa sổ không cần kết quả)
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Server chưa có endpoint session -> caller quay về gửi batch
+SESSION_UNSUPPORTED_STATUS = (404, 405, 415, 422, 501)
+
+
+class LaneStreamUploader:
+    """Quản lý một session upload cho mỗi cửa sổ, upload tuần tự trên 1 thread riêng."""
+
+    def __init__(self, server_url: str, endpoint: str = "/navigate_session/", timeout: float = 15):
+        """
+        Args:
+            server_url: Địa chỉ HTTP của server
+            endpoint: Đường dẫn gốc của API session
+            timeout: Timeout cho mỗi request (giây)
+        """
+        self.base_url = f"{server_url}{endpoint}"
+        self.timeout = timeout
+        self.supported = True  # False khi server trả về endpoint không tồn tại
+
+        self._http = requests.Session()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lane-stream")
+        self._session_id: Optional[str] = None
+        self._failed = False
+        self._frames_sent = 0
+        self._bytes_sent = 0
+
+    def open(self, frame_count: int, window_start: float) -> Future:
+        """Mở session cho cửa sổ mới (chạy bất đồng bộ trên thread upload)."""
+        return self._pool.submit(self._open, frame_count, window_start)
+
+    def _open(self, frame_count: int, window_start: float):
+        self._session_id = None
+        self._failed = False
+        self._frames_sent = 0
+        self._bytes_sent = 0
+        try:
+            response = self._http.post(
+                self.base_url,
+                json={"frame_count": frame_count, "window_start": int(window_start * 1000)},
+                timeout=self.timeout
+            )
+            if response.status_code in SESSION_UNSUPPORTED_STATUS:
+                logger.warning(f"[LaneStream] Server không hỗ trợ streaming (HTTP {response.status_code})")
+                self.supported = False
+                self._failed = True
+                return
+            response.raise_for_status()
+            self._session_id = response.json().get("session_id")
+            if not self._session_id:
+                raise ValueError("Response không có session_id")
+        except Exception as e:
+            logger.error(f"[LaneStream] Lỗi mở session: {e}")
+            self._failed = True
+
+    def submit_frame(self, encode_job: Future, index: int, timestamp: float) -> Future:
+        """
+        Upload một frame khi encode xong (giữ đúng thứ tự frame).
+
+        Args:
+            encode_job: Future trả về (jpeg_bytes, encode_time)
+            index: Thứ tự frame trong cửa sổ
+            timestamp: Thời điểm chụp (epoch giây)
+        """
+        return self._pool.submit(self._upload_frame, encode_job, index, timestamp)
+
+    def _upload_frame(self, encode_job: Future, index: int, timestamp: float):
+        if self._failed or self._session_id is None:
+            return
+        jpeg_bytes, _ = encode_job.result()
+        if jpeg_bytes is None:
+            return
+        try:
+            response = self._http.post(
+                f"{self.base_url}{self._session_id}/frame",
+                files=[("file", (f"frame_{index}.jpg", jpeg_bytes, "image/jpeg"))],
+                data={"index": index, "timestamp": int(timestamp * 1000)},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            self._frames_sent += 1
+            self._bytes_sent += len(jpeg_bytes)
+        except Exception as e:
+            logger.error(f"[LaneStream] Lỗi upload frame {index}: {e}")
+            self._failed = True
+
+    def finish(self) -> Future:
+        """
+        Kết thúc cửa sổ và chờ kết quả điều hướng.
+
+        Returns:
+            Future trả về dict kết quả, hoặc None nếu session lỗi (caller gửi lại bằng batch)
+        """
+        return self._pool.submit(self._finish)
+
+    def _finish(self) -> Optional[dict]:
+        if self._failed or self._session_id is None:
+            self._abort()
+            return None
+        try:
+            response = self._http.post(
+                f"{self.base_url}{self._session_id}/finish",
+                json={"frame_count": self._frames_sent},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            logger.debug(f"[LaneStream] Session {self._session_id}: {self._frames_sent} frames, "
+                         f"{self._bytes_sent / 1024:.0f}KB")
+            return response.json()
+        except Exception as e:
+            logger.error(f"[LaneStream] Lỗi kết thúc session: {e}")
+            return None
+        finally:
+            self._session_id = None
+
+    def abort(self):
+        """Huỷ session của cửa sổ hiện tại (cửa sổ không cần gửi)."""
+        self._pool.submit(self._abort)
+
+    def _abort(self):
+        if self._session_id is None:
+            return
+        try:
+            self._http.delete(f"{self.base_url}{self._session_id}", timeout=self.timeout)
+        except Exception as e:
+            logger.debug(f"[LaneStream] Lỗi huỷ session: {e}")
+        finally:
+            self._session_id = None
+
+    def close(self):
+        """Dừng thread upload và đóng kết nối HTTP."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            self._http.close()
+        except Exception:
+            pass
@@ -0,0 +1,212 @@
+"""
+Mic Broker
+==========
+Một service duy nhất giữ thiết bị microphone (một sounddevice.InputStream) và phát
+các block audio tới nhiều subscriber (VAD/STT, WebRTC, WebSocket) qua ring buffer SPSC.
+
+Callback PortAudio chỉ copy block vào ring của từng subscriber; việc resample/đổi
+định dạng chạy trên thread của subscriber. Thiết bị mở một lần và giữ suốt vòng đời
+chương trình, nên chuyển giữa VAD và cuộc gọi không phải đóng/mở lại mic.
+"""
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import sounddevice as sd
+
+from config import MIC_NAME, AUDIO_SAMPLE_RATE, MIC_BLOCK_MS, MIC_RING_SECONDS
+from container import container
+from log import setup_logger
+from module.audio_ring import SPSCRingBuffer
+from module.resampler import StreamingResampler
+
+logger = setup_logger(__name__)
+
+
+def find_device_index_by_name(keyword, kind='input'):
+    devices = sd.query_devices()
+    for i, dev in enumerate(devices):
+        if keyword.lower() in dev['name'].lower():
+            if kind == 'input' and dev['max_input_channels'] > 0:
+                return i
+    return None
+
+
+class MicSubscription:
+    """Một consumer của MicBroker: ring riêng ở tần số gốc, resample khi đọc"""
+
+    def __init__(self, broker: "MicBroker", name: str, rate: int, capacity: int):
+        self.broker = broker
+        self.name = name
+        self.rate = rate
+        self.ring = SPSCRingBuffer(capacity, dtype=np.int16)
+        self._resampler = StreamingResampler(broker.sample_rate, rate)
+        self._scratch = np.empty(capacity, dtype=np.int16)
+        self._pending = np.empty(0, dtype=np.float32)  # Mẫu đã resample chưa trả về
+
+    @property
+    def overruns(self) -> int:
+        return self.ring.overruns
+
+    @property
+    def backlog_seconds(self) -> float:
+        """Audio đã thu nhưng chưa đọc (giây) - mẫu cuối của lần read() tiếp theo cũ hơn hiện tại bấy nhiêu"""
+        return self.ring.available / self.broker.sample_rate + len(self._pending) / self.rate
+
+    def reset(self):
+        """Bỏ audio cũ đang chờ và trạng thái resampler (khi bắt đầu lại)"""
+        self.ring.clear()
+        self._resampler.reset()
+        self._pending = np.empty(0, dtype=np.float32)
+
+    def read(self, frames: int, timeout: Optional[float] = 1.0, dtype=np.float32) -> Optional[np.ndarray]:
+        """
+        Đọc đúng `frames` mẫu ở tần số của subscriber (chặn đến khi đủ).
+
+        Args:
+            frames: Số mẫu cần
+            timeout: Thời gian chờ tối đa (giây), None = chờ mãi
+            dtype: np.float32 ([-1, 1]) hoặc np.int16
+
+        Returns:
+            Mảng mẫu, hoặc None nếu hết timeout (phần đã đọc được giữ lại cho lần sau)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self._pending) < frames:
+            n = self.ring.read_into(self._scratch)
+            if n:
+                converted = self._resampler.process(self._scratch[:n].astype(np.float32) / 32768.0)
+                self._pending = np.concatenate((self._pending, converted))
+                continue
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.ring.wait(1, remaining)
+        out, self._pending = self._pending[:frames], self._pending[frames:]
+        if dtype == np.int16:
+            return np.clip(out * 32768.0, -32768, 32767).astype(np.int16)
+        return out
+
+
+class MicBroker:
+    """Giữ thiết bị mic và phát block audio tới các subscriber"""
+
+    def __init__(self, mic_name: str = MIC_NAME, sample_rate: int = AUDIO_SAMPLE_RATE,
+                 block_ms: int = MIC_BLOCK_MS, ring_seconds: float = MIC_RING_SECONDS):
+        """
+        Args:
+            mic_name: Tên (một phần) của microphone
+            sample_rate: Tần số thu gốc của thiết bị
+            block_ms: Kích thước block của callback (ms)
+            ring_seconds: Dung lượng ring của mỗi subscriber (giây audio)
+        """
+        self.mic_index = find_device_index_by_name(mic_name, kind='input')
+        if self.mic_index is None:
+            raise ValueError(f"Không tìm thấy microphone nào chứa '{mic_name}'!")
+        self.sample_rate = sample_rate
+        self.block_samples = int(sample_rate * block_ms / 1000)
+        self.ring_samples = int(sample_rate * ring_seconds)
+        self._subscribers = ()  # Tuple thay mới khi subscribe/unsubscribe (callback đọc không cần lock)
+        self._lock = threading.Lock()
+        self._stream = None
+        self.overflows = 0
+        logger.info(f"🎤 MicBroker - Microphone index (sounddevice): {self.mic_index}")
+
+    def _callback(self, indata, frames, time_info, status):
+        if status.input_overflow:
+            self.overflows += 1
+        samples = indata[:, 0]
+        for subscriber in self._subscribers:
+            subscriber.ring.write(samples)
+
+    def _open_stream(self):
+        try:
+            return sd.InputStream(device=self.mic_index, channels=1, samplerate=self.sample_rate,
+                                  dtype='int16', blocksize=self.block_samples, callback=self._callback)
+        except Exception as e:
+            logger.warning(f"⚠️ Cannot open mic device index {self.mic_index}: {e}")
+        # Fallback: thiết bị mặc định rồi các index USB đã biết
+        for idx in [None, 12, 13]:
+            if idx == self.mic_index:
+                continue
+            try:
+                logger.info(f"🔁 Trying fallback mic device: {idx}")
+                stream = sd.InputStream(device=idx, channels=1, samplerate=self.sample_rate,
+                                        dtype='int16', blocksize=self.block_samples, callback=self._callback)
+                self.mic_index = idx if idx is not None else self.mic_index
+                return stream
+            except Exception as e:
+                logger.warning(f"⏭️ Fallback device {idx} failed: {e}")
+        try:
+            devices = sd.query_devices()
+            logger.error("=== Available audio devices (sounddevice) ===")
+            for i, d in enumerate(devices):
+                logger.error(f"{i}: {d.get('name', 'unknown')} - IN:{d.get('max_input_channels', 0)} "
+                             f"OUT:{d.get('max_output_channels', 0)}")
+        except Exception:
+            pass
+        raise RuntimeError("Không mở được microphone")
+
+    def start(self):
+        """Mở thiết bị (một lần), các lần gọi sau không làm gì"""
+        with self._lock:
+            if self._stream is not None:
+                return
+            self._stream = self._open_stream()
+            self._stream.start()
+            logger.info(f"🎧 MicBroker started ({self.sample_rate} Hz, block {self.block_samples})")
+
+    def subscribe(self, name: str, rate: Optional[int] = None) -> MicSubscription:
+        """
+        Đăng ký nhận audio (tự mở thiết bị nếu chưa mở).
+
+        Args:
+            name: Tên subscriber (log/thống kê)
+            rate: Tần số mong muốn, mặc định tần số gốc
+        """
+        subscription = MicSubscription(self, name, rate or self.sample_rate, self.ring_samples)
+        with self._lock:
+            self._subscribers = self._subscribers + (subscription,)
+        self.start()
+        logger.info(f"➕ Mic subscriber '{name}' ({subscription.rate} Hz)")
+        return subscription
+
+    def unsubscribe(self, subscription: MicSubscription):
+        """Huỷ đăng ký; thiết bị vẫn mở cho lần dùng sau"""
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+        logger.info(f"➖ Mic subscriber '{subscription.name}' (overruns: {subscription.overruns})")
+
+    def get_status(self) -> dict:
+        return {
+            "running": self._stream is not None,
+            "sample_rate": self.sample_rate,
+            "overflows": self.overflows,
+            "subscribers": {s.name: {"rate": s.rate, "buffered": s.ring.available, "overruns": s.overruns}
+                            for s in self._subscribers},
+        }
+
+    def close(self):
+        """Đóng thiết bị (khi tắt chương trình)"""
+        with self._lock:
+            stream, self._stream = self._stream, None
+            self._subscribers = ()
+        if stream is not None:
+            try:
+                stream.stop()
+                stream.close()
+                logger.info("🔒 MicBroker closed and device released")
+            except Exception as e:
+                logger.warning(f"⚠️ Error closing mic stream: {e}")
+
+
+_broker_lock = threading.Lock()
+
+
+def get_mic_broker(mic_name: str = MIC_NAME, sample_rate: int = AUDIO_SAMPLE_RATE) -> MicBroker:
+    """MicBroker dùng chung (tạo và đăng ký vào container ở lần gọi đầu)"""
+    with _broker_lock:
+        if not container.has("mic_broker"):
+            container.register("mic_broker", MicBroker(mic_name, sample_rate))
+        return container.get("mic_broker")
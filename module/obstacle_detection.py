@@ -3,6 +3,8 @@ import cv2
 import zmq
 import pickle
 import multiprocessing as mp
+import queue
+import threading
 from multiprocessing import shared_memory
 import time
 import busio
@@ -19,7 +21,6 @@ logger = setup_logger(__name__)
 import board
 import busio
 import httpx
-import simpleaudio as sa
 WARNING_SOUND_FILE = os.path.join(BASE_DIR, "audio", "stop.wav")
 
 BASE_AUDIO_PATH = os.path.join(BASE_DIR, "audio", "warning")
@@ -74,6 +75,10 @@ class ObstacleDetectionSystem:
         self._stop_event = mp.Event()
         self._detection_enabled = mp.Value('b', False)
         self._process = None
+        # Worker process không dùng được mixer loa của process chính: yêu cầu phát cảnh báo
+        # được gửi qua queue, thread trong process chính phát trên làn "alert"
+        self._alert_queue = mp.Queue(maxsize=4)
+        self._alert_thread = None
         
         # Camera shared memory info - sẽ được lấy khi run()
         self._camera_shm_name = None
@@ -154,12 +159,8 @@ class ObstacleDetectionSystem:
                 res.raise_for_status()
                 audio_bytes = res.content
                 
-                # Phát âm thanh
-                speaker: VoiceSpeaker = container.get("speaker")
-                if speaker:
-                    speaker.play_audio_data(audio_bytes, sample_rate=24000)
-                else:
-                    logger.warning("[API] Speaker không khả dụng")
+                # Phát âm thanh (qua process chính)
+                self._request_alert("audio", audio_bytes, 24000)
                 
                 # Thành công, thoát khỏi retry loop
                 return
@@ -219,12 +220,8 @@ class ObstacleDetectionSystem:
                 self.last_alert_time = now
                 logger.info("[ObstacleDetection] Phát hiện vật cản trong phạm vi 1–1.5m!")
                 
-                # Phát âm thanh cảnh báo trực tiếp (không qua container)
-                try:
-                    wave_obj = sa.WaveObject.from_wave_file(WARNING_SOUND_FILE)
-                    wave_obj.play()
-                except Exception as e:
-                    logger.error(f"[ObstacleDetection] Lỗi phát âm thanh: {e}")
+                # Phát âm thanh cảnh báo (qua process chính, làn "alert" của mixer)
+                self._request_alert("file", WARNING_SOUND_FILE)
                 
                 # Lấy ảnh từ shared memory
                 frame = None
@@ -245,6 +242,31 @@ class ObstacleDetectionSystem:
                 else:
                     logger.warning("[ObstacleDetection] Không có ảnh từ camera.")
                     
+    def _request_alert(self, kind: str, *args):
+        """Worker: gửi yêu cầu phát cảnh báo cho process chính (không chặn)"""
+        try:
+            self._alert_queue.put_nowait((kind,) + args)
+        except queue.Full:
+            logger.warning("[ObstacleDetection] Hàng đợi cảnh báo đầy, bỏ qua")
+
+    def _alert_player_loop(self):
+        """Process chính: phát các cảnh báo worker gửi về trên làn "alert" của loa"""
+        while not self._stop_event.is_set():
+            try:
+                request = self._alert_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            try:
+                speaker: VoiceSpeaker = container.get("speaker")
+                if request[0] == "file":
+                    speaker.play_file(request[1], lane="alert")
+                else:
+                    speaker.play_audio_data(request[1], sample_rate=request[2], lane="alert")
+            except Exception as e:
+                logger.error(f"[ObstacleDetection] Lỗi phát âm thanh: {e}")
+
     def _run_loop(self, camera_shm_name, frame_shape, frame_dtype):
         """Main loop chạy trong worker process"""
         # Attach to camera shared memory
@@ -302,6 +324,10 @@ class ObstacleDetectionSystem:
             daemon=True
         )
         self._process.start()
+        if self._alert_thread is None or not self._alert_thread.is_alive():
+            self._alert_thread = threading.Thread(target=self._alert_player_loop,
+                                                  name="obstacle-alert", daemon=True)
+            self._alert_thread.start()
         logger.info(f"[ObstacleDetection] Worker đã khởi động (PID: {self._process.pid}) - Detection: {'BẬT' if self._detection_enabled.value else 'TẮT'}")
         return True
     
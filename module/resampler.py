@@ -0,0 +1,149 @@
+"""
+Polyphase Resampler
+===================
+Dịch vụ resample dùng chung cho mọi đường audio (mic -> VAD/STT/WebRTC, TTS/file/cuộc gọi -> loa).
+Bộ lọc polyphase được thiết kế một lần cho mỗi cặp tần số (cache).
+
+- StreamingResampler: resample theo luồng (chunk nối chunk), giữ trạng thái (các mẫu cuối của
+  chunk trước) nên không có gián đoạn ở biên chunk; process_int16() cho PCM16
+- resample(): resample cả một đoạn audio (file, câu TTS) bằng cùng bộ lọc đã cache, thay cho
+  scipy.signal.resample (FFT trên cả đoạn, bộ nhớ tạm lớn)
+
+Với PCM16, hai hàm đều nhận/trả int16 trực tiếp (bộ lọc tuyến tính nên không cần chuẩn hoá về
+[-1, 1]) và trả lại nguyên mảng khi hai tần số bằng nhau.
+"""
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@lru_cache(maxsize=16)
+def lowpass_filter(up: int, down: int, half_len: int = 10) -> np.ndarray:
+    """Bộ lọc thông thấp FIR cho tỉ lệ up/down (cùng cách với scipy.signal.resample_poly, chưa nhân `up`)"""
+    max_rate = max(up, down)
+    h = firwin(2 * half_len * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(np.float32)
+    h.setflags(write=False)
+    return h
+
+
+@lru_cache(maxsize=16)
+def polyphase_filter(up: int, down: int, half_len: int = 10):
+    """
+    Tách bộ lọc thông thấp thành `up` pha.
+    Trả về (bank float32 shape (up, taps_per_phase), độ trễ nhóm ở tần số up).
+    """
+    h = lowpass_filter(up, down, half_len).astype(np.float64) * up
+    num_taps = len(h)
+    taps_per_phase = -(-num_taps // up)
+    padded = np.zeros(taps_per_phase * up)
+    padded[:num_taps] = h
+    # bank[p, k] = h[p + k*up]
+    bank = padded.reshape(taps_per_phase, up).T.astype(np.float32)
+    return np.ascontiguousarray(bank), (num_taps - 1) // 2
+
+
+class StreamingResampler:
+    """Resample float32 mono theo từng chunk, giữ trạng thái giữa các chunk"""
+
+    def __init__(self, input_rate: int, output_rate: int):
+        """
+        Args:
+            input_rate: Tần số lấy mẫu đầu vào (tần số gốc của thiết bị)
+            output_rate: Tần số lấy mẫu đầu ra
+        """
+        self.input_rate = int(input_rate)
+        self.output_rate = int(output_rate)
+        g = gcd(self.input_rate, self.output_rate)
+        self.up = self.output_rate // g
+        self.down = self.input_rate // g
+        self.passthrough = self.up == self.down
+        if self.passthrough:
+            return
+        self._bank, self._delay = polyphase_filter(self.up, self.down)
+        self._taps = self._bank.shape[1]
+        # Lịch sử K-1 mẫu đầu vào trước chunk hiện tại (ban đầu là 0)
+        self._history = np.zeros(self._taps - 1, dtype=np.float32)
+        self._k = np.arange(self._taps)
+        self.reset()
+        logger.debug(f"🎛️ Resampler {input_rate} -> {output_rate} Hz "
+                     f"(up {self.up}/down {self.down}, {self._taps} taps/pha)")
+
+    def reset(self):
+        """Bắt đầu luồng mới (xoá trạng thái)"""
+        if self.passthrough:
+            return
+        self._history[:] = 0
+        self._in_count = 0   # Số mẫu đầu vào đã nhận
+        self._out_count = 0  # Chỉ số mẫu đầu ra kế tiếp
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Resample một chunk.
+
+        Args:
+            samples: Mẫu float32 mono
+
+        Returns:
+            Mẫu float32 ở output_rate (số mẫu có thể dao động ±1 giữa các chunk)
+        """
+        samples = samples.reshape(-1)
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float32)
+        if self.passthrough:
+            return samples
+
+        buffer = np.concatenate((self._history, samples))
+        base = self._in_count - (self._taps - 1)  # Chỉ số toàn cục của buffer[0]
+        total = self._in_count + len(samples)
+        # Mẫu ra n dùng x[(n*down + delay) // up - k]; chỉ tính các mẫu đã đủ đầu vào
+        last = (total * self.up - 1 - self._delay) // self.down
+        n = np.arange(self._out_count, last + 1, dtype=np.int64)
+        self._in_count = total
+        self._history[:] = buffer[len(buffer) - (self._taps - 1):]
+        if len(n) == 0:
+            return np.empty(0, dtype=np.float32)
+        self._out_count = int(last) + 1
+
+        t = n * self.down + self._delay
+        newest = t // self.up - base
+        phase = t % self.up
+        windows = buffer[newest[:, None] - self._k]
+        return np.einsum("ij,ij->i", windows, self._bank[phase]).astype(np.float32, copy=False)
+
+    def process_int16(self, samples: np.ndarray) -> np.ndarray:
+        """Như process() cho PCM16: int16 vào, int16 ra (cùng tần số thì trả lại nguyên mảng)"""
+        if self.passthrough:
+            return samples.reshape(-1)
+        return _to_int16(self.process(samples.astype(np.float32)))
+
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+def resample(samples: np.ndarray, input_rate: int, output_rate: int) -> np.ndarray:
+    """
+    Resample cả một đoạn audio bằng bộ lọc polyphase đã cache.
+
+    Args:
+        samples: Mẫu mono hoặc (samples, channels); int16 hoặc float
+        input_rate: Tần số gốc
+        output_rate: Tần số đích
+
+    Returns:
+        Mẫu ở output_rate, cùng kiểu với đầu vào (int16 giữ int16, còn lại float32)
+    """
+    input_rate, output_rate = int(input_rate), int(output_rate)
+    if input_rate == output_rate:
+        return samples
+    g = gcd(input_rate, output_rate)
+    up, down = output_rate // g, input_rate // g
+    x = samples.astype(np.float32, copy=False)
+    y = resample_poly(x, up, down, axis=0, window=lowpass_filter(up, down)).astype(np.float32, copy=False)
+    return _to_int16(y) if samples.dtype == np.int16 else y
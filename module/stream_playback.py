@@ -0,0 +1,183 @@
+"""
+Stream Playback
+===============
+Phát audio TTS từ server ngay khi các chunk tới (không đợi chunk cuối).
+
+- Thread MQTT chỉ gọi add_chunk(): lưu chunk vào jitter buffer rồi trả về ngay
+- Thread phát chờ đủ pre-roll (hoặc đã có chunk cuối) rồi đưa các chunk theo thứ tự
+  chunkIndex vào làn "tts" của AudioMixer (resample theo luồng, không gián đoạn ở biên chunk)
+- Chunk đến trễ: cứ chờ, khi audio đã xếp hàng hết thì loa phát khoảng lặng (underrun) thay
+  cho phần thiếu; chunk đã có chunk sau nó mà loa đã lặng quá `gap_timeout` thì coi là mất,
+  phát tiếp chunk sau, chunk đó tới sau thì bị bỏ
+"""
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from config import TTS_PREROLL_MS, TTS_GAP_TIMEOUT_MS
+from log import setup_logger
+from module.audio_mixer import MixerLane
+from module.debug_recorder import debug_recorder
+from module.echo_suppressor import playback_reference
+from module.resampler import StreamingResampler
+
+logger = setup_logger(__name__)
+
+
+class StreamingPlayback:
+    """Jitter buffer + thread phát cho một stream audio PCM16 từ server"""
+
+    def __init__(self, output: MixerLane, stream_id: str, sample_rate: int,
+                 preroll_ms: int = TTS_PREROLL_MS, gap_timeout_ms: int = TTS_GAP_TIMEOUT_MS,
+                 idle_timeout: float = 15.0):
+        """
+        Args:
+            output: Làn phát của mixer dùng chung
+            stream_id: Id stream của server (log)
+            sample_rate: Tần số lấy mẫu của audio server gửi
+            preroll_ms: Lượng audio liên tục cần có trước khi bắt đầu phát
+            gap_timeout_ms: Loa đã lặng (hết audio xếp hàng) bấy nhiêu mà chunk vẫn thiếu thì bỏ qua nó
+            idle_timeout: Không có chunk mới trong bấy nhiêu giây thì kết thúc stream
+        """
+        self.output = output
+        self.stream_id = stream_id
+        self.sample_rate = sample_rate
+        self.preroll_bytes = int(sample_rate * preroll_ms / 1000) * 2
+        self.gap_timeout = gap_timeout_ms / 1000.0
+        self.idle_timeout = idle_timeout
+        self._resampler = StreamingResampler(sample_rate, output.sample_rate)
+
+        self._cond = threading.Condition()
+        self._chunks = {}
+        self._next_index = 0
+        self._end_index: Optional[int] = None
+        self._last_arrival = time.time()
+        self._first_arrival = None  # perf_counter (cùng đồng hồ với PlaybackItem)
+        self._carry = b""  # Byte lẻ của chunk trước (PCM16 bị cắt giữa mẫu)
+        self._played = []  # Audio đã phát (cho file debug)
+        self._first_item = None
+        self.cancelled = False
+        self.finished = False
+        self.finished_at = None
+        self.gaps = 0
+        self.late = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"tts-{stream_id}", daemon=True)
+        self._thread.start()
+
+    def add_chunk(self, index: int, data, is_last: bool = False, total_chunks: int = 0):
+        """Thêm một chunk (gọi từ thread MQTT, không chặn)"""
+        with self._cond:
+            if self.finished or index < self._next_index or index in self._chunks:
+                self.late += 1
+                logger.debug(f"⏭️ Bỏ chunk {index} đến trễ/trùng của stream {self.stream_id}")
+                return
+            self._chunks[index] = bytes(data)
+            now = time.time()
+            self._last_arrival = now
+            if self._first_arrival is None:
+                self._first_arrival = time.perf_counter()
+            if is_last:
+                self._end_index = max(index + 1, total_chunks or 0)
+            self._cond.notify()
+
+    def cancel(self):
+        """Dừng phát stream (vd. người dùng nói chen)"""
+        with self._cond:
+            self.cancelled = True
+            self._cond.notify()
+
+    def _ended(self) -> bool:
+        return self.cancelled or (self._end_index is not None and self._next_index >= self._end_index)
+
+    def _contiguous_bytes(self) -> int:
+        total, index = 0, self._next_index
+        while index in self._chunks:
+            total += len(self._chunks[index])
+            index += 1
+        return total
+
+    def _wait_preroll(self):
+        with self._cond:
+            while (not self.cancelled and self._end_index is None
+                   and self._contiguous_bytes() < self.preroll_bytes):
+                if time.time() - self._last_arrival > self.idle_timeout:
+                    return
+                self._cond.wait(0.05)
+
+    def _next_chunk(self) -> Optional[bytes]:
+        """Chunk kế tiếp theo thứ tự (bỏ qua chunk mất); None = hết stream"""
+        with self._cond:
+            drained_since = None  # Lúc audio đã xếp hàng phát hết khi đang chờ chunk này
+            while True:
+                if self._ended():
+                    return None
+                if self._next_index in self._chunks:
+                    self._next_index += 1
+                    return self._chunks.pop(self._next_index - 1)
+                now = time.time()
+                if now - self._last_arrival > self.idle_timeout:
+                    logger.warning(f"⏰ Stream {self.stream_id} không có chunk mới - kết thúc")
+                    return None
+                if self.output.queued_seconds > 0:
+                    drained_since = None
+                elif drained_since is None:
+                    drained_since = now
+                later = any(i > self._next_index for i in self._chunks) or self._end_index is not None
+                if later and drained_since is not None and now - drained_since >= self.gap_timeout:
+                    # Đã có chunk sau, loa đã lặng đủ lâu thay cho chunk này - coi như mất
+                    logger.warning(f"⚠️ Thiếu chunk {self._next_index} của stream {self.stream_id} - bỏ qua")
+                    self._next_index += 1
+                    self.gaps += 1
+                    drained_since = None
+                    continue
+                self._cond.wait(0.02)
+
+    def _run(self):
+        try:
+            self._wait_preroll()
+            while True:
+                data = self._next_chunk()
+                if data is None:
+                    break
+                data = self._carry + data
+                usable = len(data) - len(data) % 2
+                self._carry = data[usable:]
+                pcm = np.frombuffer(data[:usable], dtype=np.int16)
+                self._played.append(pcm)
+                self._enqueue(self._resampler.process(pcm.astype(np.float32) / 32768.0))
+        except Exception as e:
+            logger.error(f"❌ Lỗi phát stream {self.stream_id}: {e}", exc_info=True)
+        finally:
+            self._finish()
+
+    def _enqueue(self, samples: np.ndarray):
+        if self.cancelled or len(samples) == 0:
+            return
+        playback_reference.begin(samples, self.output.sample_rate,
+                                 start_time=time.time() + self.output.queued_seconds)
+        item = self.output.play(samples, wait=False)
+        if self._first_item is None:
+            self._first_item = item
+
+    def _finish(self):
+        with self._cond:
+            self.finished = True
+            self.finished_at = time.time()
+            self._chunks.clear()
+        first_sample = "n/a"
+        if self._first_item is not None:
+            # Chờ mẫu đầu được phát để đo: từ lúc chunk đầu tới đến lúc mẫu đầu ra loa
+            self._first_item.done.wait(self.output.queued_seconds + 1.0)
+            if self._first_item.first_sample_latency is not None:
+                latency = self._first_item.enqueued - self._first_arrival + \
+                    self._first_item.first_sample_latency
+                first_sample = f"{latency * 1000:.0f}ms"
+        logger.info(f"🔊 Stream {self.stream_id}: {self._next_index} chunk, {self.gaps} mất, "
+                    f"{self.late} bỏ (trễ), mẫu đầu sau {first_sample}"
+                    f"{' - đã huỷ' if self.cancelled else ''}")
+        if self._played:
+            debug_recorder.record("audio_response_from_server", np.concatenate(self._played), self.sample_rate)
+
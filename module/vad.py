@@ -1,8 +1,111 @@
 import time
+from collections import deque
+
 import numpy as np
 from typing import Dict, Any
 
-from config import MAX_AMP
+from config import MAX_AMP, MAX_SPEECH_DURATION
+
+
+class AudioRingBuffer:
+    """Ring buffer float32 kích thước cố định, giữ N mẫu gần nhất (dùng cho pre-roll)"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self._buffer = np.zeros(self.capacity, dtype=np.float32)
+        self._write_pos = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, samples: np.ndarray):
+        """Ghi mẫu vào ring, ghi đè dữ liệu cũ nhất khi đầy"""
+        n = len(samples)
+        if n >= self.capacity:
+            # Chỉ cần giữ phần cuối
+            self._buffer[:] = samples[-self.capacity:]
+            self._write_pos = 0
+            self._size = self.capacity
+            return
+        first = min(n, self.capacity - self._write_pos)
+        self._buffer[self._write_pos:self._write_pos + first] = samples[:first]
+        if first < n:
+            self._buffer[:n - first] = samples[first:]
+        self._write_pos = (self._write_pos + n) % self.capacity
+        self._size = min(self.capacity, self._size + n)
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Copy toàn bộ nội dung (theo thứ tự thời gian) vào đầu `out`, trả về số mẫu"""
+        start = (self._write_pos - self._size) % self.capacity
+        first = min(self._size, self.capacity - start)
+        out[:first] = self._buffer[start:start + first]
+        if first < self._size:
+            out[first:self._size] = self._buffer[:self._size - first]
+        return self._size
+
+    def clear(self):
+        self._write_pos = 0
+        self._size = 0
+
+
+class UtteranceBuffer:
+    """
+    Buffer liên tục (contiguous) cho một câu nói, tăng kích thước theo cấp số nhân
+    đến giới hạn max_samples. Dùng 2 vùng nhớ luân phiên để view trả về cho câu trước
+    vẫn hợp lệ trong khi câu sau đang được ghi.
+    """
+
+    def __init__(self, initial_samples: int, max_samples: int):
+        self.max_samples = max(1, int(max_samples))
+        initial = max(1, min(int(initial_samples), self.max_samples))
+        self._buffers = [np.empty(initial, dtype=np.float32), np.empty(initial, dtype=np.float32)]
+        self._active = 0
+        self.length = 0
+
+    @property
+    def remaining(self) -> int:
+        """Số mẫu còn có thể ghi trước khi chạm giới hạn"""
+        return self.max_samples - self.length
+
+    def _ensure_capacity(self, needed: int):
+        buf = self._buffers[self._active]
+        if needed <= len(buf):
+            return
+        new_size = min(self.max_samples, max(needed, len(buf) * 2))
+        grown = np.empty(new_size, dtype=np.float32)
+        grown[:self.length] = buf[:self.length]
+        self._buffers[self._active] = grown
+
+    def append(self, samples: np.ndarray) -> int:
+        """Ghi thêm mẫu (cắt bớt nếu vượt giới hạn), trả về số mẫu đã ghi"""
+        n = min(len(samples), self.remaining)
+        if n <= 0:
+            return 0
+        self._ensure_capacity(self.length + n)
+        self._buffers[self._active][self.length:self.length + n] = samples[:n]
+        self.length += n
+        return n
+
+    def prefill_from(self, ring: AudioRingBuffer):
+        """Bắt đầu câu mới với nội dung pre-roll"""
+        self.length = 0
+        self._ensure_capacity(min(len(ring), self.max_samples))
+        self.length = ring.read_into(self._buffers[self._active])
+
+    def view(self, start: int, end: int) -> np.ndarray:
+        """View (không copy) đoạn [start, end) của câu đang ghi"""
+        return self._buffers[self._active][start:min(end, self.length)]
+
+    def take(self, length: int) -> np.ndarray:
+        """Trả về view (không copy) `length` mẫu đầu của câu và chuyển sang vùng nhớ còn lại"""
+        view = self._buffers[self._active][:length]
+        self._active ^= 1
+        self.length = 0
+        return view
+
+    def reset(self):
+        self.length = 0
 
 
 class VoiceActivityDetector:
@@ -10,7 +113,8 @@ class VoiceActivityDetector:
 
     def __init__(self, sample_rate: int = 48000, silence_threshold: float = 0.02,
                  silence_duration: float = 5.0, min_speech_duration: float = 0.5,
-                 pre_buffer_duration: float = 0.2, post_buffer_duration: float = 0.2):
+                 pre_buffer_duration: float = 0.2, post_buffer_duration: float = 0.2,
+                 max_speech_duration: float = MAX_SPEECH_DURATION):
         """
         Args:
             sample_rate: Tần số lấy mẫu
@@ -19,6 +123,7 @@ class VoiceActivityDetector:
             min_speech_duration: Thời gian nói tối thiểu để bắt đầu thu âm (giây)
             pre_buffer_duration: Thời gian giữ âm thanh trước khi phát hiện giọng nói (giây)
             post_buffer_duration: Thời gian giữ âm thanh sau khi im lặng (giây)
+            max_speech_duration: Độ dài tối đa một câu (giây), vượt quá sẽ tự kết thúc câu
         """
         self.sample_rate = sample_rate
         self.silence_threshold = silence_threshold
@@ -26,111 +131,339 @@ class VoiceActivityDetector:
         self.min_speech_duration = min_speech_duration
         self.pre_buffer_duration = pre_buffer_duration
         self.post_buffer_duration = post_buffer_duration
+        self.max_speech_duration = max_speech_duration
 
         # Trạng thái
         self.is_speaking = False
         self.speech_start_time = None
         self.silence_start_time = None
-        self.audio_buffer = []
-        self.pre_buffer = []  # Buffer để giữ âm thanh trước khi phát hiện giọng nói
-        self.post_buffer = []  # Buffer để giữ âm thanh sau khi im lặng
 
-    def process_audio_chunk(self, audio_chunk: np.ndarray) -> Dict[str, Any]:
+        # Buffer cấp phát sẵn: ring cho pre-roll, buffer liên tục cho câu nói (bộ nhớ có giới hạn)
+        self._post_samples = int(post_buffer_duration * sample_rate)
+        self.pre_buffer = AudioRingBuffer(int(pre_buffer_duration * sample_rate))
+        self.audio_buffer = UtteranceBuffer(
+            initial_samples=int(min(10.0, max_speech_duration) * sample_rate),
+            max_samples=int((pre_buffer_duration + max_speech_duration + silence_duration) * sample_rate)
+        )
+        self._speech_end = 0  # Vị trí (mẫu) kết thúc đoạn có tiếng nói gần nhất trong audio_buffer
+        self._dropped = False  # Chunk đang xử lý đã bỏ một câu quá ngắn
+
+    @property
+    def committed_length(self) -> int:
+        """Số mẫu đầu của câu đang nói chắc chắn nằm trong audio trả về khi câu kết thúc"""
+        if not self.is_speaking:
+            return 0
+        return min(self.audio_buffer.length, self._speech_end + self._post_samples)
+
+    def _reset_utterance(self):
+        self.is_speaking = False
+        self.speech_start_time = None
+        self.silence_start_time = None
+        self._speech_end = 0
+
+    def _drop_utterance(self):
+        """Bỏ câu đang ghi (quá ngắn); kết quả của chunk hiện tại mang 'dropped': True"""
+        self.audio_buffer.reset()
+        self._reset_utterance()
+        self._dropped = True
+
+    def _complete(self, current_time: float, rms: float) -> Dict[str, Any]:
+        """Kết thúc câu: trả về view của câu nói, chỉ giữ post_buffer_duration sau tiếng nói cuối"""
+        speech_duration = current_time - self.speech_start_time
+        length = min(self.audio_buffer.length, self._speech_end + self._post_samples)
+        audio_data = self.audio_buffer.take(length)
+        self._reset_utterance()
+        print(f"✅ Hoàn tất thu âm ({speech_duration:.1f}s) - {length / self.sample_rate:.1f}s audio")
+        return {
+            'action': 'speech_complete',
+            'audio_data': audio_data,
+            'duration': speech_duration,
+            'rms': rms
+        }
+
+    def process_audio_chunk(self, audio_chunk: np.ndarray, echo_only: bool = False) -> Dict[str, Any]:
         """
         Xử lý chunk âm thanh để phát hiện giọng nói
 
         Args:
             audio_chunk: Chunk âm thanh (numpy array)
+            echo_only: Chunk chỉ có tiếng loa (echo suppressor) - vẫn ghi vào câu đang nói nhưng
+                tính như im lặng: không kéo dài câu, được tính vào thời gian im lặng để kết thúc câu
 
         Returns:
-            Dict với thông tin trạng thái
+            Dict với thông tin trạng thái. Với 'speech_complete', 'audio_data' là view
+            (không copy) còn hợp lệ cho tới khi câu nói kế tiếp hoàn tất. 'dropped' = chunk này
+            đã bỏ một câu quá ngắn (câu mới có thể đã bắt đầu ngay trong cùng chunk).
         """
+        self._dropped = False
+        samples = audio_chunk.reshape(-1)
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float32)
+
         # Tính RMS (Root Mean Square) để đo âm lượng
-        rms = np.sqrt(np.mean(audio_chunk.astype(np.float32) ** 2))
+        rms = float(np.sqrt(np.dot(samples, samples) / max(1, len(samples))))
 
         current_time = time.time()
 
         # Phát hiện giọng nói
-        if rms > self.silence_threshold:
+        if rms > self.silence_threshold and not echo_only:
             if not self.is_speaking:
-                # Bắt đầu nói - thêm pre_buffer vào đầu
+                # Bắt đầu nói - bắt đầu câu với pre-roll + chunk hiện tại
                 self.is_speaking = True
                 self.speech_start_time = current_time
                 self.silence_start_time = None
-                # Bắt đầu với pre_buffer (âm thanh trước khi phát hiện) + chunk hiện tại
-                self.audio_buffer = self.pre_buffer.copy() + [audio_chunk]
-                self.post_buffer = []  # Reset post buffer
-                print(f"🗣️ Bắt đầu phát hiện giọng nói (RMS: {rms:.4f}) - Pre-buffer: {len(self.pre_buffer)} chunks")
+                pre_len = len(self.pre_buffer)
+                self.audio_buffer.prefill_from(self.pre_buffer)
+                self.pre_buffer.clear()
+                print(f"🗣️ Bắt đầu phát hiện giọng nói (RMS: {rms:.4f}) - Pre-buffer: {pre_len / self.sample_rate:.2f}s")
             else:
-                # Đang nói - thêm vào buffer
-                self.audio_buffer.append(audio_chunk)
                 self.silence_start_time = None
-                self.post_buffer = []  # Reset post buffer khi còn đang nói
+            self.audio_buffer.append(samples)
+            self._speech_end = self.audio_buffer.length
+
+            # Câu quá dài: kết thúc luôn để giới hạn bộ nhớ
+            if self.audio_buffer.remaining <= 0:
+                print(f"⚠️ Câu nói vượt quá {self.max_speech_duration:.0f}s - tự kết thúc")
+                return self._complete(current_time, rms)
         else:
             # Im lặng
             if self.is_speaking:
-                # Thêm vào post_buffer trong thời gian im lặng
-                self.post_buffer.append(audio_chunk)
-                
+                # Giữ phần im lặng sau câu nói (sẽ cắt còn post_buffer_duration khi kết thúc)
+                self.audio_buffer.append(samples)
+
                 if self.silence_start_time is None:
                     self.silence_start_time = current_time
                 elif current_time - self.silence_start_time >= self.silence_duration:
-                    # Kết thúc nói - thêm post_buffer vào cuối
                     speech_duration = current_time - self.speech_start_time
                     if speech_duration >= self.min_speech_duration:
                         # Có đủ thời gian nói
-                        # Thêm post_buffer vào cuối (nhưng chỉ lấy post_buffer_duration)
-                        all_audio = self.audio_buffer + self.post_buffer
-                        
-                        # Chuẩn hóa biên độ âm thanh trước khi nối
-                        normalized_buffers = []
-                        for chunk in all_audio:
-                            normalized_buffers.append(chunk)
-
-                        audio_data = np.concatenate(normalized_buffers)
-
-                        # Đảm bảo audio_data là mảng 1 chiều
-                        if len(audio_data.shape) > 1:
-                            audio_data = audio_data.flatten()
-
-                        self.is_speaking = False
-                        self.speech_start_time = None
-                        self.silence_start_time = None
-                        self.audio_buffer = []
-                        self.post_buffer = []
-
-                        print(f"✅ Hoàn tất thu âm ({speech_duration:.1f}s) - Tổng chunks: {len(all_audio)}")
-                        return {
-                            'action': 'speech_complete',
-                            'audio_data': audio_data,
-                            'duration': speech_duration,
-                            'rms': rms
-                        }
+                        return self._complete(current_time, rms)
                     else:
                         # Thời gian nói quá ngắn - bỏ qua
                         print(
                             f"⚠️ Thời gian nói quá ngắn ({speech_duration:.1f}s) - bỏ qua")
-                        self.is_speaking = False
-                        self.speech_start_time = None
-                        self.silence_start_time = None
-                        self.audio_buffer = []
-                        self.post_buffer = []
+                        self._drop_utterance()
             else:
-                # Đang im lặng và chưa phát hiện giọng nói - giữ trong pre_buffer
-                # Tính số chunks cần giữ dựa trên pre_buffer_duration
-                # Tính thời gian của mỗi chunk (giây)
-                chunk_duration = len(audio_chunk) / self.sample_rate
-                # Tính số chunks cần giữ (làm tròn lên để đảm bảo đủ thời gian)
-                import math
-                max_pre_chunks = max(1, math.ceil(self.pre_buffer_duration / chunk_duration))
-                self.pre_buffer.append(audio_chunk)
-                # Giữ pre_buffer trong giới hạn
-                if len(self.pre_buffer) > max_pre_chunks:
-                    self.pre_buffer = self.pre_buffer[-max_pre_chunks:]
+                # Đang im lặng và chưa phát hiện giọng nói - giữ trong pre-roll ring
+                self.pre_buffer.write(samples)
 
         return {
             'action': 'listening' if not self.is_speaking else 'speaking',
             'is_speaking': self.is_speaking,
             'rms': rms,
+            'dropped': self._dropped,
             'speech_duration': current_time - self.speech_start_time if self.is_speaking else 0
         }
+
+
+class FrameVoiceActivityDetector(VoiceActivityDetector):
+    """
+    VAD theo khung ngắn (20-30 ms): năng lượng, zero-crossing rate và tỉ lệ năng lượng
+    dải tần tiếng nói được tính vector hoá cho mọi khung trong chunk. Ngưỡng bám theo
+    noise floor thích nghi, có onset/hangover để làm mượt quyết định.
+    Kết thúc câu sau `endpoint_silence` giây im lặng thay vì cả chunk 1 giây.
+    """
+
+    def __init__(self, sample_rate: int = 48000, frame_ms: int = 20,
+                 snr_db: float = 9.0, min_energy_db: float = -60.0,
+                 onset_frames: int = 3, hangover_ms: int = 200,
+                 endpoint_silence: float = 0.6, noise_adapt: float = 0.05, noise_window: float = 3.0,
+                 speech_band=(100.0, 4000.0), min_band_ratio: float = 0.5,
+                 max_zcr: float = 0.4, **kwargs):
+        """
+        Args:
+            sample_rate: Tần số lấy mẫu
+            frame_ms: Độ dài khung phân tích (ms)
+            snr_db: Năng lượng khung phải vượt noise floor bao nhiêu dB để coi là tiếng nói
+            min_energy_db: Năng lượng tối thiểu tuyệt đối (dBFS)
+            onset_frames: Số khung tiếng nói liên tiếp để xác nhận bắt đầu nói
+            hangover_ms: Khoảng lặng ngắn (ms) vẫn coi là đang nói
+            endpoint_silence: Thời gian im lặng để kết thúc câu (giây)
+            noise_adapt: Tốc độ cập nhật noise floor (0-1) trên các khung không có tiếng nói
+            noise_window: Cửa sổ minimum-statistics (giây): khung thấp nhất trong cửa sổ vẫn cao hơn
+                noise floor thì floor được nâng dần lên kể cả khi đang "nói" (nền nhiễu tăng đột ngột)
+            speech_band: Dải tần tiếng nói (Hz) để tính tỉ lệ năng lượng
+            min_band_ratio: Tỉ lệ năng lượng trong dải tiếng nói tối thiểu
+            max_zcr: ZCR tối đa cho khung năng lượng thấp (loại nhiễu băng rộng/xì)
+            **kwargs: Các tham số của VoiceActivityDetector
+        """
+        kwargs.setdefault('silence_duration', endpoint_silence)
+        super().__init__(sample_rate=sample_rate, **kwargs)
+        self.frame_len = max(1, int(sample_rate * frame_ms / 1000))
+        self.snr_db = snr_db
+        self.min_energy_db = min_energy_db
+        self.onset_frames = max(1, onset_frames)
+        self.hangover_frames = max(0, int(hangover_ms / frame_ms))
+        self.endpoint_frames = max(1, int(endpoint_silence * 1000 / frame_ms))
+        self.min_speech_frames = int(self.min_speech_duration * 1000 / frame_ms)
+        self.noise_adapt = noise_adapt
+        # Minimum-statistics: min năng lượng theo từng khối ~0.25 s, giữ các khối trong noise_window
+        self._min_block_frames = max(1, int(250 / frame_ms))
+        self._min_blocks = deque(maxlen=max(2, int(noise_window * 1000 / frame_ms) // self._min_block_frames))
+        self._block_min_db = None
+        self._block_count = 0
+        self.min_band_ratio = min_band_ratio
+        self.max_zcr = max_zcr
+
+        # Precompute cửa sổ Hann và mask dải tần cho FFT theo khung
+        self._window = np.hanning(self.frame_len).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.frame_len, d=1.0 / sample_rate)
+        self._band_mask = (freqs >= speech_band[0]) & (freqs <= speech_band[1])
+
+        # Mẫu dư chưa đủ một khung, ghép vào chunk sau
+        self._remainder = np.empty(self.frame_len, dtype=np.float32)
+        self._remainder_len = 0
+
+        self.noise_floor_db = None
+        self._onset_count = 0
+        self._silent_frames = 0
+        self._speech_frames = 0
+        self._utterance_frames = 0
+
+    def _frame_features(self, frames: np.ndarray):
+        """Đặc trưng vector hoá cho mảng khung (n, frame_len)"""
+        energy = np.mean(frames * frames, axis=1)
+        energy_db = 10.0 * np.log10(energy + 1e-12)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        spectrum = np.abs(np.fft.rfft(frames * self._window, axis=1)) ** 2
+        total = np.sum(spectrum, axis=1) + 1e-12
+        band_ratio = np.sum(spectrum[:, self._band_mask], axis=1) / total
+        return energy_db, zcr, band_ratio
+
+    def _classify(self, energy_db: float, zcr: float, band_ratio: float) -> bool:
+        """Quyết định tiếng nói cho một khung và cập nhật noise floor"""
+        if self.noise_floor_db is None:
+            self.noise_floor_db = energy_db
+        snr = energy_db - self.noise_floor_db
+        is_speech = (
+            energy_db > self.min_energy_db
+            and snr > self.snr_db
+            and band_ratio >= self.min_band_ratio
+            and not (zcr > self.max_zcr and snr < self.snr_db + 6.0)
+        )
+        if not is_speech:
+            # Bám theo nền nhiễu (xuống nhanh, lên chậm)
+            rate = self.noise_adapt if energy_db > self.noise_floor_db else 4 * self.noise_adapt
+            self.noise_floor_db += min(1.0, rate) * (energy_db - self.noise_floor_db)
+        self._track_minimum(energy_db)
+        return is_speech
+
+    def _track_minimum(self, energy_db: float):
+        """
+        Nền nhiễu tăng bậc (xe buýt, quạt) hơn snr_db thì mọi khung đều là "tiếng nói" và floor
+        không bao giờ được cập nhật. Tiếng nói thật luôn có khoảng ngắt xuống gần nền nhiễu trong
+        vài giây, nên khi cả cửa sổ không có khung nào thấp tới floor thì nâng floor lên dần.
+        """
+        if self._block_min_db is None or energy_db < self._block_min_db:
+            self._block_min_db = energy_db
+        self._block_count += 1
+        if self._block_count < self._min_block_frames:
+            return
+        self._min_blocks.append(self._block_min_db)
+        self._block_min_db = None
+        self._block_count = 0
+        if len(self._min_blocks) < self._min_blocks.maxlen:
+            return
+        window_min = min(self._min_blocks)
+        if window_min > self.noise_floor_db:
+            # Mỗi khối nâng một phần khoảng cách (tương đương noise_adapt mỗi khung)
+            rate = min(1.0, self.noise_adapt * self._min_block_frames)
+            self.noise_floor_db += rate * (window_min - self.noise_floor_db)
+
+    def _end_utterance(self, rms: float):
+        if self._speech_frames >= self.min_speech_frames:
+            duration = self._utterance_frames * self.frame_len / self.sample_rate
+            result = self._complete(time.time(), rms)
+            result['duration'] = duration
+            return result
+        print(f"⚠️ Thời gian nói quá ngắn ({self._speech_frames * self.frame_len / self.sample_rate:.2f}s) - bỏ qua")
+        self._drop_utterance()
+        return None
+
+    def _reset_utterance(self):
+        super()._reset_utterance()
+        self._silent_frames = 0
+        self._speech_frames = 0
+        self._utterance_frames = 0
+
+    def process_audio_chunk(self, audio_chunk: np.ndarray, echo_only: bool = False) -> Dict[str, Any]:
+        self._dropped = False
+        samples = audio_chunk.reshape(-1)
+        if samples.dtype != np.float32:
+            samples = samples.astype(np.float32)
+        rms = float(np.sqrt(np.dot(samples, samples) / max(1, len(samples))))
+
+        # Ghép mẫu dư của chunk trước
+        if self._remainder_len:
+            samples = np.concatenate((self._remainder[:self._remainder_len], samples))
+        n_frames = len(samples) // self.frame_len
+        used = n_frames * self.frame_len
+        self._remainder_len = len(samples) - used
+        self._remainder[:self._remainder_len] = samples[used:]
+        if n_frames == 0:
+            return self._status(rms)
+
+        frames = samples[:used].reshape(n_frames, self.frame_len)
+        energy_db, zcr, band_ratio = self._frame_features(frames)
+        completed = None
+
+        for i in range(n_frames):
+            frame = frames[i]
+            # Echo của loa: không phải tiếng nói, cũng không dùng để học noise floor
+            is_speech = not echo_only and self._classify(float(energy_db[i]), float(zcr[i]), float(band_ratio[i]))
+
+            if not self.is_speaking:
+                self.pre_buffer.write(frame)
+                self._onset_count = self._onset_count + 1 if is_speech else 0
+                if self._onset_count >= self.onset_frames:
+                    # Bắt đầu nói - pre-roll đã chứa cả các khung onset
+                    self.is_speaking = True
+                    self.speech_start_time = time.time()
+                    self.audio_buffer.prefill_from(self.pre_buffer)
+                    self.pre_buffer.clear()
+                    self._speech_end = self.audio_buffer.length
+                    self._speech_frames = self._onset_count
+                    self._utterance_frames = self._onset_count
+                    self._onset_count = 0
+                    print(f"🗣️ Bắt đầu phát hiện giọng nói ({energy_db[i]:.1f} dB, floor {self.noise_floor_db:.1f} dB)")
+                continue
+
+            self.audio_buffer.append(frame)
+            self._utterance_frames += 1
+            if is_speech:
+                self._silent_frames = 0
+                self._speech_frames += 1
+                self._speech_end = self.audio_buffer.length
+            else:
+                self._silent_frames += 1
+                if self._silent_frames <= self.hangover_frames:
+                    # Hangover: khoảng lặng ngắn giữa các từ vẫn thuộc câu nói
+                    self._speech_end = self.audio_buffer.length
+                elif self._silent_frames >= self.endpoint_frames:
+                    completed = self._end_utterance(rms)
+                    if completed is not None:
+                        break
+
+            if self.is_speaking and self.audio_buffer.remaining <= 0:
+                print(f"⚠️ Câu nói vượt quá {self.max_speech_duration:.0f}s - tự kết thúc")
+                completed = self._end_utterance(rms)
+                if completed is not None:
+                    break
+
+        if completed is not None:
+            # Các khung còn lại của chunk đưa vào pre-roll cho câu kế tiếp
+            for frame in frames[i + 1:]:
+                self.pre_buffer.write(frame)
+            return completed
+        return self._status(rms)
+
+    def _status(self, rms: float) -> Dict[str, Any]:
+        return {
+            'action': 'listening' if not self.is_speaking else 'speaking',
+            'is_speaking': self.is_speaking,
+            'rms': rms,
+            'noise_floor_db': self.noise_floor_db,
+            'dropped': self._dropped,
+            'speech_duration': self._utterance_frames * self.frame_len / self.sample_rate if self.is_speaking else 0
+        }
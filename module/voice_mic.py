@@ -12,21 +12,21 @@ import os
 import soundfile as sf
 import numpy as np
 
-from module.vad import VoiceActivityDetector
+from module.vad import VoiceActivityDetector, FrameVoiceActivityDetector
+from module.mic_broker import get_mic_broker
+from module.debug_recorder import debug_recorder
+from module.keyword_spotter import KeywordSpotter
+from module.echo_suppressor import EchoSuppressor, playback_reference
 from module.voice_speaker import VoiceSpeaker
 from config import SILENCE_THRESHOLD, SILENCE_DURATION, MIN_SPEECH_DURATION
+from config import STT_STREAM_CHUNK_MS, STT_SAMPLE_RATE
+from config import ECHO_MODE
+from config import KWS_ENABLED, KWS_TEMPLATE_DIR, KWS_THRESHOLD, KWS_SEARCH_SECONDS
+from config import VAD_MODE, VAD_FRAME_MS, VAD_CHUNK_MS, VAD_SNR_DB, VAD_HANGOVER_MS, VAD_ENDPOINT_SILENCE
 from log import setup_logger
 from config import BASE_DIR, MAX_AMP
 logger = setup_logger(__name__)
 
-def find_device_index_by_name(keyword, kind='input'):
-    devices = sd.query_devices()
-    for i, dev in enumerate(devices):
-        if keyword.lower() in dev['name'].lower():
-            if kind == 'input' and dev['max_input_channels'] > 0:
-                return i
-    return None
-
 class VoiceStreamer:
     """Class để ghi âm và gửi âm thanh qua MQTT hoặc HTTP"""
 
@@ -37,47 +37,102 @@ class VoiceStreamer:
             sample_rate: Tần số lấy mẫu âm thanh
             chunk_duration_ms: Thời gian mỗi chunk (ms) cho real-time streaming
         """
-        self.mic_index = find_device_index_by_name(mic_name, kind='input')
-        if self.mic_index is None:
-            raise ValueError(f"Không tìm thấy microphone nào chứa '{mic_name}'!")
-        logger.info(f"🎤 Microphone index (sounddevice): {self.mic_index}")
+        # Mic do MicBroker giữ (dùng chung với WebRTC/WebSocket), VoiceStreamer chỉ là một subscriber
+        self.broker = get_mic_broker(mic_name, sample_rate)
+        self.mic_index = self.broker.mic_index
+        sample_rate = self.broker.sample_rate
         self.sample_rate = sample_rate
+        if VAD_MODE == "frame":
+            # VAD theo khung không cần chunk lớn - đọc mic theo chunk ngắn để giảm độ trễ
+            chunk_duration_ms = min(chunk_duration_ms, VAD_CHUNK_MS)
         self.chunk_duration_ms = chunk_duration_ms
-        self.chunk_samples = int(sample_rate * chunk_duration_ms / 1000.0)
         self.is_listening = False
         self.listening_thread = None
 
+        # Thu âm ở tần số gốc của thiết bị, VAD và uplink chạy ở STT_SAMPLE_RATE (0 = giữ nguyên);
+        # subscription của broker resample khi đọc
+        self.process_rate = STT_SAMPLE_RATE if 0 < STT_SAMPLE_RATE < sample_rate else sample_rate
+        self.chunk_samples = int(self.process_rate * chunk_duration_ms / 1000.0)
+
         # Voice Activity Detector
-        self.vad = VoiceActivityDetector(
-            sample_rate=sample_rate,
-            silence_threshold=SILENCE_THRESHOLD,  # Điều chỉnh theo môi trường
-            silence_duration=SILENCE_DURATION,
-            min_speech_duration=MIN_SPEECH_DURATION,
-            pre_buffer_duration=0.5,  # Giữ 0.5s âm thanh trước khi phát hiện
-            post_buffer_duration=0.3  # Giữ 0.3s âm thanh sau khi im lặng
-        )
+        if VAD_MODE == "frame":
+            self.vad = FrameVoiceActivityDetector(
+                sample_rate=self.process_rate,
+                frame_ms=VAD_FRAME_MS,
+                snr_db=VAD_SNR_DB,
+                hangover_ms=VAD_HANGOVER_MS,
+                endpoint_silence=VAD_ENDPOINT_SILENCE,
+                min_speech_duration=MIN_SPEECH_DURATION,
+                pre_buffer_duration=0.5,
+                post_buffer_duration=0.3
+            )
+        else:
+            self.vad = VoiceActivityDetector(
+                sample_rate=self.process_rate,
+                silence_threshold=SILENCE_THRESHOLD,  # Điều chỉnh theo môi trường
+                silence_duration=SILENCE_DURATION,
+                min_speech_duration=MIN_SPEECH_DURATION,
+                pre_buffer_duration=0.5,  # Giữ 0.5s âm thanh trước khi phát hiện
+                post_buffer_duration=0.3  # Giữ 0.3s âm thanh sau khi im lặng
+            )
+        logger.info(f"🎚️ VAD mode: {VAD_MODE} - chunk {self.chunk_duration_ms}ms - "
+                    f"{sample_rate} -> {self.process_rate} Hz")
+
+        # Streaming câu nói: số mẫu đã đẩy ra on_speech_audio của câu hiện tại
+        self.stream_chunk_samples = int(self.process_rate * STT_STREAM_CHUNK_MS / 1000.0)
+        self._streamed_samples = 0
+
+        # Keyword spotting: chỉ câu có cụm từ đánh thức mới được stream/gửi đi
+        self.keyword_spotter = None
+        self._kws_fed_samples = 0  # Số mẫu của câu hiện tại đã đưa vào keyword spotter
+        if KWS_ENABLED:
+            try:
+                self.keyword_spotter = KeywordSpotter(self.process_rate, KWS_TEMPLATE_DIR,
+                                                      threshold=KWS_THRESHOLD,
+                                                      search_seconds=KWS_SEARCH_SECONDS)
+            except Exception as e:
+                logger.warning(f"⚠️ Tắt keyword spotting: {e}")
+
+        # Chống echo: tiếng loa của chính thiết bị không được mở câu nói mới
+        self.echo_suppressor = None
+        if ECHO_MODE != "off":
+            self.echo_suppressor = EchoSuppressor(self.process_rate, playback_reference, mode=ECHO_MODE)
 
         # Callback functions
         self.on_speech_start = None
         self.on_speech_complete = None
         self.on_speech_data = None
+        self.on_speech_audio = None
+        self.on_speech_cancel = None
+        self.on_barge_in = None
+        self._barge_in_pending = False  # Echo suppressor báo nói chen, chờ VAD xác nhận bắt đầu nói
 
         print(f"🎤 VoiceStreamer initialized - Mic index: {self.mic_index}")
 
     def set_callbacks(self, on_speech_start: Callable = None,
                       on_speech_complete: Callable = None,
-                      on_speech_data: Callable = None):
+                      on_speech_data: Callable = None,
+                      on_speech_audio: Callable = None,
+                      on_speech_cancel: Callable = None,
+                      on_barge_in: Callable = None):
         """
         Thiết lập callback functions
 
         Args:
             on_speech_start: Gọi khi bắt đầu phát hiện giọng nói
-            on_speech_complete: Gọi khi hoàn tất thu âm (audio_data, duration)
+            on_speech_complete: Gọi khi hoàn tất thu âm (audio_data, duration), audio ở process_rate
             on_speech_data: Gọi mỗi chunk âm thanh (audio_chunk, timestamp, status)
+            on_speech_audio: Gọi với từng đoạn PCM16 mới của câu đang nói (audio_bytes),
+                phần còn lại được đẩy ra ngay trước on_speech_complete
+            on_speech_cancel: Gọi khi câu đang nói bị huỷ (quá ngắn)
+            on_barge_in: Gọi khi người dùng bắt đầu nói trong lúc loa đang phát
         """
         self.on_speech_start = on_speech_start
         self.on_speech_complete = on_speech_complete
         self.on_speech_data = on_speech_data
+        self.on_speech_audio = on_speech_audio
+        self.on_speech_cancel = on_speech_cancel
+        self.on_barge_in = on_barge_in
 
     def start_listening(self):
         """Bắt đầu lắng nghe liên tục"""
@@ -91,7 +146,7 @@ class VoiceStreamer:
         print("👂 Bắt đầu lắng nghe liên tục...")
 
     def stop_listening(self):
-        """Dừng lắng nghe và đảm bảo device được giải phóng"""
+        """Dừng lắng nghe (mic vẫn do MicBroker giữ, không cần chờ OS giải phóng thiết bị)"""
         self.is_listening = False
         if self.listening_thread:
             self.listening_thread.join(timeout=3.0)  # Đợi tối đa 3 giây
@@ -99,119 +154,132 @@ class VoiceStreamer:
                 print("⚠️ Listening thread did not stop in time")
             else:
                 print("⏹️ Dừng lắng nghe")
-                # Đợi thêm một chút để đảm bảo OS release device
-                import time
-                time.sleep(0.5)
         else:
             print("⏹️ Dừng lắng nghe")
 
     def _listening_loop(self):
         """Vòng lặp lắng nghe liên tục"""
-        stream = None
+        subscription = None
         try:
-            # Try to open configured device first
-            try:
-                stream = sd.InputStream(
-                    device=self.mic_index,
-                    channels=1,
-                    samplerate=self.sample_rate,
-                    dtype='int16',
-                    blocksize=self.chunk_samples
-                )
-            except Exception as e:
-                print(f"⚠️ Cannot open mic device index {self.mic_index}: {e}")
-                # Fallback strategy: try default device, then known USB indices
-                try_indices = [None, 12, 13]
-                for idx in try_indices:
-                    if idx == self.mic_index:
-                        continue
-                    try:
-                        print(f"🔁 Trying fallback mic device: {idx}")
-                        stream = sd.InputStream(
-                            device=idx,
-                            channels=1,
-                            samplerate=self.sample_rate,
-                            dtype='int16',
-                            blocksize=self.chunk_samples
-                        )
-                        # Update current mic index if successful
-                        self.mic_index = idx if idx is not None else self.mic_index
-                        break
-                    except Exception as e2:
-                        print(f"⏭️ Fallback device {idx} failed: {e2}")
-                        stream = None
-                if stream is None:
-                    # As last resort, list devices to help debugging
-                    try:
-                        devices = sd.query_devices()
-                        print("=== Available audio devices (sounddevice) ===")
-                        for i, d in enumerate(devices):
-                            ins = d.get('max_input_channels') or d.get('maxInputChannels') or d.get('max_input_channels', 0)
-                            outs = d.get('max_output_channels') or d.get('maxOutputChannels') or d.get('max_output_channels', 0)
-                            name = d.get('name', 'unknown')
-                            print(f"{i}: {name} - IN:{ins} OUT:{outs}")
-                    except Exception:
-                        pass
-                    raise
-            stream.start()
+            subscription = self.broker.subscribe("vad", rate=self.process_rate)
             print("🎧 Đang lắng nghe... (nói gì đó để bắt đầu thu âm)")
+            last_overruns = 0
 
             while self.is_listening:
-                audio_chunk, overflowed = stream.read(self.chunk_samples)
-                if overflowed:
+                audio_float = subscription.read(self.chunk_samples, timeout=0.5)
+                if audio_float is None:
+                    continue
+                if subscription.overruns != last_overruns:
+                    last_overruns = subscription.overruns
                     print("⚠️ Audio buffer overflow!")
 
-                if len(audio_chunk) > 0:
-                    # Chuyển đổi sang float32 cho VAD và áp dụng chuẩn hóa biên độ
-                    audio_float = audio_chunk.astype(np.float32) / 32768.0
-
-                    # Xử lý VAD
-                    vad_result = self.vad.process_audio_chunk(audio_float)
-
-                    # Gọi callbacks
-                    if self.on_speech_data:
-                        self.on_speech_data(audio_chunk, int(
-                            time.time() * 1000), vad_result)
-
-                    if vad_result['action'] == 'speech_complete':
-                        if self.on_speech_complete:
-                            # Chuyển đổi từ float32 về int16 để đảm bảo định dạng nhất quán với record_audio
-                            audio_data = vad_result['audio_data']
-                            int16_audio = (
-                                audio_data * 32768.0).astype(np.int16).tobytes()
-                            self.on_speech_complete(
-                                int16_audio, vad_result['duration'])
-                            save_dir = "debug"
-                            os.makedirs(save_dir, exist_ok=True)
-                            file_path = os.path.join(
-                                BASE_DIR, save_dir, f"audio_mic.wav")
-                            try:
-                                sf.write(
-                                    file_path, vad_result['audio_data'], self.sample_rate, subtype='PCM_16')
-                                logger.debug(
-                                    f"💾 Đã lưu file âm thanh: {file_path}")
-                            except Exception as e:
-                                logger.error(
-                                    f"❌ Lỗi khi lưu file âm thanh: {e}")
-                    elif vad_result['action'] == 'speaking' and not self.vad.is_speaking:
-                        if self.on_speech_start:
-                            self.on_speech_start()
+                echo_only = barge_in = False
+                if self.echo_suppressor is not None:
+                    capture_end = time.time() - subscription.backlog_seconds
+                    echo_only, barge_in = self.echo_suppressor.process(audio_float, capture_end)
+                if barge_in:
+                    # Giữ tới lần bắt đầu nói kế tiếp (onset có thể rơi vào chunk sau)
+                    self._barge_in_pending = True
+                elif self.echo_suppressor is None or not self.echo_suppressor.playback_active:
+                    # Loa đã ngừng phát: tiếng động lúc trước không mở câu nào thì không còn là nói chen
+                    self._barge_in_pending = False
+                if echo_only and not self.vad.is_speaking:
+                    # Chỉ có tiếng loa: không đưa vào VAD (không mở câu mới, không kéo noise floor lên)
+                    continue
+
+                # Xử lý VAD (đang nói: chunk chỉ có tiếng loa tính như im lặng, không kéo dài câu)
+                was_speaking = self.vad.is_speaking
+                vad_result = self.vad.process_audio_chunk(audio_float, echo_only=echo_only)
+
+                # Gọi callbacks
+                if self.on_speech_data:
+                    audio_chunk = (audio_float * 32768.0).astype(np.int16)
+                    self.on_speech_data(audio_chunk, int(
+                        time.time() * 1000), vad_result)
+
+                if vad_result.get('dropped'):
+                    # Câu nói bị VAD bỏ qua (quá ngắn) - câu mới có thể đã bắt đầu ngay trong chunk này
+                    if self._streamed_samples and self.on_speech_cancel:
+                        self.on_speech_cancel()
+                    self._streamed_samples = 0
+                    self._kws_fed_samples = 0
+                    was_speaking = False
+
+                if not was_speaking and self.vad.is_speaking:
+                    self._streamed_samples = 0
+                    self._kws_fed_samples = 0
+                    if self.keyword_spotter:
+                        self.keyword_spotter.reset()
+                    if self._barge_in_pending:
+                        self._barge_in_pending = False
+                        logger.info(f"🛑 Người dùng nói chen khi loa đang phát - {self.echo_suppressor.get_stats()}")
+                        if self.on_barge_in:
+                            self.on_barge_in()
+                    if self.on_speech_start:
+                        self.on_speech_start()
+
+                if vad_result['action'] == 'speech_complete':
+                    if not self._keyword_gate(vad_result['audio_data'], final=True):
+                        self._streamed_samples = 0
+                        continue
+                    # Đẩy nốt phần chưa stream của câu trước khi báo hoàn tất
+                    self._stream_speech_audio(vad_result['audio_data'])
+                    self._streamed_samples = 0
+                    if self.on_speech_complete:
+                        # Chuyển đổi từ float32 về int16 để đảm bảo định dạng nhất quán với record_audio
+                        audio_data = vad_result['audio_data']
+                        int16_audio = (
+                            audio_data * 32768.0).astype(np.int16).tobytes()
+                        self.on_speech_complete(
+                            int16_audio, vad_result['duration'])
+                        # Ghi file debug trên thread nền (không chặn vòng đọc mic)
+                        debug_recorder.record("audio_mic", vad_result['audio_data'], self.process_rate)
+                elif self.vad.is_speaking:
+                    # Stream phần câu nói đã chắc chắn giữ lại (không gửi khoảng lặng cuối sẽ bị cắt)
+                    committed = self.vad.committed_length
+                    if not self._keyword_gate(self.vad.audio_buffer.view(0, self.vad.audio_buffer.length)):
+                        continue
+                    if committed - self._streamed_samples >= self.stream_chunk_samples:
+                        self._stream_speech_audio(self.vad.audio_buffer.view(0, committed))
 
         except Exception as e:
             print(f"❌ Lỗi lắng nghe: {e}")
             import traceback
             traceback.print_exc()
         finally:
-            # ✅ Đảm bảo close stream để giải phóng USB mic device
-            if stream is not None:
-                try:
-                    stream.stop()
-                    stream.close()
-                    print("🔒 Audio stream closed and device released")
-                except Exception as e:
-                    print(f"⚠️ Error closing stream: {e}")
+            if subscription is not None:
+                self.broker.unsubscribe(subscription)
             self.is_listening = False
 
+    def _keyword_gate(self, utterance: np.ndarray, final: bool = False) -> bool:
+        """
+        Đưa phần mới của câu (float32 từ đầu câu) vào keyword spotter.
+
+        Returns:
+            True nếu câu được phép gửi đi (không bật KWS hoặc đã nghe thấy cụm từ đánh thức)
+        """
+        spotter = self.keyword_spotter
+        if spotter is None:
+            return True
+        detected = spotter.process_chunk(utterance[self._kws_fed_samples:])
+        self._kws_fed_samples = len(utterance)
+        if final:
+            detected = spotter.finish()
+            stats = spotter.get_stats()
+            logger.info(f"🔑 KWS: {'có' if detected else 'không có'} keyword - "
+                        f"CPU {stats['chunk_ms_avg']:.2f}ms/chunk (max {stats['chunk_ms_max']:.2f}ms), "
+                        f"đã gửi {stats['accepted']}/{stats['utterances']} câu")
+            self._kws_fed_samples = 0
+        return detected
+
+    def _stream_speech_audio(self, utterance: np.ndarray):
+        """Chuyển phần chưa gửi của câu (float32 từ đầu câu) sang PCM16 và đẩy ra on_speech_audio"""
+        if not self.on_speech_audio or len(utterance) <= self._streamed_samples:
+            return
+        pending = utterance[self._streamed_samples:]
+        self._streamed_samples = len(utterance)
+        self.on_speech_audio((pending * 32768.0).astype(np.int16).tobytes())
+
     def __del__(self):
         self.stop_listening()
 
@@ -227,19 +295,16 @@ class VoiceStreamer:
         """
         print(f"🎙️ Đang ghi âm {duration_sec}s...")
 
-        total_samples = int(self.sample_rate * duration_sec)
-        recording = sd.rec(
-            total_samples,
-            samplerate=self.sample_rate,
-            channels=1,
-            dtype='int16',
-            device=self.mic_index
-        )
-        sd.wait()
-
-        audio_data = recording.reshape(-1).tobytes()
+        subscription = self.broker.subscribe("record")
+        try:
+            recording = subscription.read(int(self.sample_rate * duration_sec),
+                                          timeout=duration_sec + 2.0, dtype=np.int16)
+        finally:
+            self.broker.unsubscribe(subscription)
+        if recording is None:
+            print("❌ Ghi âm thất bại - không nhận đủ audio từ mic")
+            return b""
+
+        audio_data = recording.tobytes()
         print(f"✅ Ghi âm hoàn thành - {len(audio_data)} bytes")
         return audio_data
-
-
-
@@ -2,14 +2,17 @@ import soundfile as sf
 import os
 import sounddevice as sd
 import numpy as np
-import tempfile
-from scipy import signal
+import time
 from container import container
+from module.audio_mixer import AudioMixer
+from module.echo_suppressor import playback_reference
+from module.resampler import resample
+from module.stream_playback import StreamingPlayback
 from log import setup_logger
-import queue
 import threading
 
 logger = setup_logger(__name__)
+_speaker_lock = threading.Lock()
 devices = sd.query_devices()
 logger.debug(devices)
 
@@ -30,95 +33,69 @@ class VoiceSpeaker:
             raise ValueError(f"Không tìm thấy loa nào chứa '{speaker_name}'!")
         logger.info(f"🔊 Speaker index (PulseAudio): {self.speaker_index}")
         container.register("speaker", self)
-        # Streaming state
-        self._out_stream = None
-        self._out_queue: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=100)
-        self._stream_rate = None
-        self._stream_channels = None
-        self._stream_blocksize = None
-        self._stream_lock = threading.Lock()
+        # Stream phát duy nhất, luôn mở (ở lần phát đầu tiên), trộn các làn alert/call/tts/prompt
+        self.mixer = AudioMixer(self.speaker_index)
+        self._stream_players = []  # Các StreamingPlayback đang phát (TTS theo luồng)
 
-    def play_file(self, file_path: str):
-        """Phát âm thanh từ file (wav, flac, ogg, mp3 nếu có soundfile hỗ trợ)."""
+    def play_file(self, file_path: str, lane: str = "prompt"):
+        """Phát âm thanh từ file (wav, flac, ogg, mp3 nếu có soundfile hỗ trợ) trên làn `lane`."""
         if not os.path.exists(file_path):
             logger.error(f"❌ File không tồn tại: {file_path}", exc_info=True)
             return
 
         try:
             data, samplerate = sf.read(file_path, dtype='float32')
-            # Đảm bảo samplerate phù hợp với thiết bị
-            if samplerate != 44100:
-                logger.info(f"Chuyển đổi sample rate từ {samplerate} sang 44100Hz")
-                # Nếu sample rate khác 44100, thực hiện resampling
-                samples = len(data)
-                new_samples = int(samples * 44100 / samplerate)
-                data = signal.resample(data, new_samples)
-                samplerate = 44100
-            
-            # Kiểm tra thiết bị có khả dụng không
-            try:
-                devices = sd.query_devices()
-                if self.speaker_index >= len(devices):
-                    raise ValueError(f"Device index {self.speaker_index} không tồn tại")
-                device_info = devices[self.speaker_index]
-                if device_info['max_output_channels'] == 0:
-                    raise ValueError(f"Device {self.speaker_index} không hỗ trợ output")
-            except Exception as dev_check_error:
-                logger.warning(f"⚠️ Thiết bị audio không khả dụng, thử thiết bị mặc định: {dev_check_error}")
-                # Fallback: thử với thiết bị mặc định (None)
-                try:
-                    sd.play(data, device=None, samplerate=samplerate)
-                    sd.wait()
-                    logger.info("✅ Phát thành công với thiết bị mặc định")
-                    return
-                except Exception as fallback_error:
-                    logger.error(f"❌ Lỗi khi phát với thiết bị mặc định: {fallback_error}")
-                    return
-                
-            # Thử phát với thiết bị đã chọn
-            try:
-                sd.play(data, device=self.speaker_index, samplerate=samplerate)
-                sd.wait()  # Chờ phát xong
-            except Exception as play_error:
-                # Nếu lỗi, thử lại với thiết bị mặc định
-                logger.warning(f"⚠️ Lỗi khi phát với thiết bị {self.speaker_index}, thử thiết bị mặc định: {play_error}")
-                try:
-                    sd.play(data, device=None, samplerate=samplerate)
-                    sd.wait()
-                    logger.info("✅ Phát thành công với thiết bị mặc định (fallback)")
-                except Exception as fallback_error:
-                    logger.error(f"❌ Lỗi khi phát với thiết bị mặc định: {fallback_error}")
+            self._play_buffer(data, samplerate, lane=lane)
         except Exception as e:
             logger.error(f"⚠️ Lỗi khi phát file: {e}", exc_info=True)
 
-    def play_audio_data(self, audio_data: bytes, sample_rate: int = 44100):
+    def play_audio_data(self, audio_data: bytes, sample_rate: int = 44100, lane: str = "tts",
+                        wait: bool = True):
         """
-        Phát âm thanh từ dữ liệu raw
+        Phát âm thanh từ dữ liệu raw (PCM16 bytes/memoryview hoặc numpy) thẳng vào làn `lane` của mixer,
+        không qua file tạm (wait=False: chỉ xếp hàng rồi trả về)
         """
         try:
-            if type(audio_data) == bytes:
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
+            if isinstance(audio_data, (bytes, bytearray, memoryview)):
+                audio_array = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
             else:
                 audio_array = audio_data
+                if audio_array.dtype == np.int16:
+                    audio_array = audio_array.astype(np.float32) / 32768.0
 
-            # Tạo file WAV tạm với soundfile
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-                # Lưu với soundfile để có header WAV đúng
-                sf.write(temp_file.name, audio_array,
-                        sample_rate, subtype='PCM_16')
-                temp_file.flush()
-
-                self.play_file(temp_file.name)
-
-                # Cleanup
-                os.unlink(temp_file.name)
-
+            item = self._play_buffer(audio_array, sample_rate, wait=wait, lane=lane)
+            latency = f"{item.first_sample_latency * 1000:.0f}ms" if item and item.first_sample_latency else "n/a"
             logger.info(
-                f"🔊 Phát âm thanh thành công - {len(audio_data)} bytes với sample rate {sample_rate}")
+                f"🔊 Phát âm thanh thành công - {len(audio_data)} bytes với sample rate {sample_rate} "
+                f"(mẫu đầu sau {latency})")
         except Exception as e:
             logger.error(f"❌ Lỗi phát âm thanh: {e}", exc_info=True)
-    
-    def play_audio_array(self, audio_array: np.ndarray, sample_rate: int = 44100, channels: int = 1):
+
+    def _play_buffer(self, data: np.ndarray, samplerate: int, wait: bool = True, lane: str = "tts"):
+        """Downmix, resample về tần số của mixer rồi xếp hàng phát trên làn `lane` (chờ xong nếu wait)"""
+        output = self.mixer.lane(lane)
+        if data.ndim == 2:
+            data = data.mean(axis=1)
+        # Đảm bảo samplerate phù hợp với thiết bị
+        if samplerate != output.sample_rate:
+            logger.info(f"Chuyển đổi sample rate từ {samplerate} sang {output.sample_rate}Hz")
+            data = resample(data, samplerate, output.sample_rate)
+            samplerate = output.sample_rate
+
+        # Báo cho phía mic biết loa sắp phát gì (chống echo khi VAD đang nghe)
+        playback_reference.begin(data, samplerate, start_time=time.time() + output.queued_seconds)
+        try:
+            return output.play(data, wait=wait)
+        except Exception as e:
+            # Không mở được stream phát: phát kiểu cũ với thiết bị mặc định
+            logger.warning(f"⚠️ Lỗi stream phát, thử sd.play với thiết bị mặc định: {e}")
+            sd.play(data, device=None, samplerate=samplerate)
+            if wait:
+                sd.wait()
+            return None
+
+    def play_audio_array(self, audio_array: np.ndarray, sample_rate: int = 44100, channels: int = 1,
+                         lane: str = "tts"):
         """
         Phát âm thanh từ numpy array (real-time streaming)
         
@@ -141,174 +118,71 @@ class VoiceSpeaker:
                     # Mono -> Stereo: duplicate
                     audio_array = np.repeat(audio_array, 2, axis=1)
             
-            # Resample nếu sample rate khác 44100
-            if sample_rate != 44100:
-                # Resample từng channel
-                if audio_array.shape[1] == 1:
-                    # Mono
-                    samples = len(audio_array)
-                    new_samples = int(samples * 44100 / sample_rate)
-                    audio_array = signal.resample(audio_array, new_samples)
-                else:
-                    # Stereo: resample từng channel riêng
-                    left = signal.resample(audio_array[:, 0], int(len(audio_array) * 44100 / sample_rate))
-                    right = signal.resample(audio_array[:, 1], int(len(audio_array) * 44100 / sample_rate))
-                    audio_array = np.column_stack([left, right])
-                sample_rate = 44100
-            
-            # Convert về float32 nếu cần (sd.play yêu cầu float32)
+            # Convert về float32 nếu cần
             if audio_array.dtype == np.int16:
                 audio_array = audio_array.astype(np.float32) / 32767.0
             elif audio_array.dtype == np.int32:
                 audio_array = audio_array.astype(np.float32) / 2147483647.0
             elif audio_array.dtype != np.float32:
                 audio_array = audio_array.astype(np.float32)
-            
+
             # Phát audio (non-blocking)
-            sd.play(audio_array, samplerate=sample_rate, device=self.speaker_index)
-            
+            self._play_buffer(audio_array, sample_rate, wait=False, lane=lane)
+
         except Exception as e:
             logger.error(f"❌ Lỗi phát audio array: {e}", exc_info=True)
 
-    # -------- Streaming API dành cho WebRTC ----------
-    def _ensure_output_stream(self, sample_rate: int, channels: int, block_ms: int = 20):
-        with self._stream_lock:
-            desired_blocksize = max(128, int(sample_rate * block_ms / 1000))
-            if (self._out_stream is not None and
-                self._stream_rate == sample_rate and
-                self._stream_channels == channels and
-                self._stream_blocksize == desired_blocksize):
-                return
-            # Recreate stream if params changed
-            if self._out_stream is not None:
-                try:
-                    self._out_stream.stop()
-                    self._out_stream.close()
-                except Exception:
-                    pass
-                self._out_stream = None
-                # Clear queue
-                while not self._out_queue.empty():
-                    try:
-                        self._out_queue.get_nowait()
-                    except Exception:
-                        break
-            def callback(outdata, frames, time_info, status):
-                if status:
-                    logger.debug(f"OutputStream status: {status}")
-                needed = frames
-                channels_local = channels
-                # Gather from queue
-                chunks = []
-                remaining = needed
-                try:
-                    while remaining > 0:
-                        chunk = self._out_queue.get_nowait()
-                        if chunk.ndim == 1:
-                            chunk = chunk.reshape(-1, channels_local)
-                        take = min(remaining, len(chunk))
-                        chunks.append(chunk[:take])
-                        # If chunk longer than needed, push remainder back
-                        if take < len(chunk):
-                            rest = chunk[take:]
-                            try:
-                                self._out_queue.put_nowait(rest)
-                            except Exception:
-                                pass
-                        remaining -= take
-                except queue.Empty:
-                    pass
-                if chunks:
-                    data = np.vstack(chunks)
-                else:
-                    data = np.zeros((needed, channels_local), dtype=np.float32)
-                # Pad if still short
-                if len(data) < needed:
-                    pad = np.zeros((needed - len(data), channels_local), dtype=np.float32)
-                    data = np.vstack([data, pad])
-                outdata[:] = data
-            try:
-                self._out_stream = sd.OutputStream(
-                    device=self.speaker_index,
-                    samplerate=sample_rate,
-                    channels=channels,
-                    dtype='float32',
-                    blocksize=desired_blocksize,
-                    callback=callback
-                )
-                self._out_stream.start()
-                self._stream_rate = sample_rate
-                self._stream_channels = channels
-                self._stream_blocksize = desired_blocksize
-                logger.info(f"🔊 OutputStream started: {sample_rate}Hz, ch={channels}, block={desired_blocksize}")
-            except Exception as e:
-                logger.error(f"❌ Không mở được OutputStream: {e}", exc_info=True)
-
+    def open_stream_playback(self, stream_id: str, sample_rate: int, idle_timeout: float = 15.0) -> StreamingPlayback:
+        """Bắt đầu phát một stream audio PCM16 theo từng chunk (xem module/stream_playback.py)"""
+        player = StreamingPlayback(self.mixer.lane("tts"), stream_id, sample_rate, idle_timeout=idle_timeout)
+        self._stream_players = [p for p in self._stream_players if not p.finished] + [player]
+        return player
+
+    def stop_playback(self):
+        """Dừng TTS (kể cả stream TTS) và âm báo đang phát (vd. khi người dùng nói chen).
+        Cảnh báo và audio cuộc gọi không bị dừng."""
+        for player in self._stream_players:
+            player.cancel()
+        self.mixer.lane("tts").stop()
+        self.mixer.lane("prompt").stop()
+        playback_reference.stop()
+
+    # -------- Streaming API dành cho WebRTC (làn "call" của mixer) ----------
     def start_stream(self, sample_rate: int = 48000, channels: int = 1):
-        """Chuẩn bị stream phát liên tục."""
-        self._ensure_output_stream(sample_rate, channels)
+        """Chuẩn bị phát liên tục audio cuộc gọi ở `sample_rate`."""
+        self.mixer.lane("call").open_stream(sample_rate)
 
     def stop_stream(self):
-        """Dừng stream phát liên tục."""
-        with self._stream_lock:
-            if self._out_stream is not None:
-                try:
-                    self._out_stream.stop()
-                    self._out_stream.close()
-                except Exception:
-                    pass
-                self._out_stream = None
-                self._stream_rate = None
-                self._stream_channels = None
-                self._stream_blocksize = None
-            # Xoá hàng đợi
-            while not self._out_queue.empty():
-                try:
-                    self._out_queue.get_nowait()
-                except Exception:
-                    break
-            logger.info("🔇 OutputStream stopped")
+        """Dừng phát liên tục (bỏ audio cuộc gọi còn chờ)."""
+        self.mixer.lane("call").close_stream()
 
     def play_stream_frame(self, audio_array: np.ndarray, sample_rate: int, channels: int):
-        """Đưa một frame audio vào hàng đợi để phát liên tục."""
+        """Đưa một frame audio cuộc gọi vào làn "call" (downmix mono, resample theo luồng)."""
         try:
-            # Chuẩn hoá shape: (samples, channels)
-            if audio_array.ndim == 1:
-                audio_array = audio_array.reshape(-1, 1)
-            elif audio_array.ndim == 2:
-                # Nhiều trường hợp audio từ PyAV là (channels, samples)
-                if audio_array.shape[0] in (1, 2) and audio_array.shape[0] <= audio_array.shape[1]:
-                    # (ch, samples) -> (samples, ch)
-                    audio_array = audio_array.T
-            # Bảo toàn số kênh mong muốn
-            if channels == 1 and audio_array.shape[1] == 2:
-                audio_array = audio_array[:, 0:1]
-            elif channels == 2 and audio_array.shape[1] == 1:
-                audio_array = np.repeat(audio_array, 2, axis=1)
-
-            target_rate = sample_rate  # Giữ nguyên theo nguồn để tránh resample nhiều lần
-            # Convert dtype -> float32 [-1,1]
+            lane = self.mixer.lane("call")
+            # Convert dtype -> float32 [-1,1] trước khi downmix (mean() của int16 ra float64 chưa chuẩn hoá)
             if audio_array.dtype == np.int16:
                 audio_array = audio_array.astype(np.float32) / 32767.0
             elif audio_array.dtype == np.int32:
                 audio_array = audio_array.astype(np.float32) / 2147483647.0
             elif audio_array.dtype != np.float32:
                 audio_array = audio_array.astype(np.float32)
+            if audio_array.ndim == 2:
+                # Nhiều trường hợp audio từ PyAV là (channels, samples)
+                if audio_array.shape[0] in (1, 2) and audio_array.shape[0] <= audio_array.shape[1]:
+                    audio_array = audio_array.T
+                audio_array = audio_array.mean(axis=1, dtype=np.float32) if audio_array.shape[1] > 1 else audio_array[:, 0]
 
-            # Đảm bảo stream mở đúng tham số
-            self._ensure_output_stream(target_rate, channels)
-
-            # Đưa vào hàng đợi, nếu đầy thì bỏ bớt để không lag
-            try:
-                self._out_queue.put_nowait(audio_array)
-            except queue.Full:
-                try:
-                    _ = self._out_queue.get_nowait()
-                except Exception:
-                    pass
-                try:
-                    self._out_queue.put_nowait(audio_array)
-                except Exception:
-                    pass
+            if lane.stream_rate != sample_rate:
+                lane.open_stream(sample_rate)
+            lane.write(audio_array)
         except Exception as e:
-            logger.error(f"❌ Lỗi enqueue frame phát audio: {e}", exc_info=True)
\ No newline at end of file
+            logger.error(f"❌ Lỗi enqueue frame phát audio: {e}", exc_info=True)
+
+
+def get_speaker(speaker_name: str = "USB Audio Device") -> VoiceSpeaker:
+    """VoiceSpeaker dùng chung (tạo và đăng ký vào container ở lần gọi đầu)"""
+    with _speaker_lock:
+        if not container.has("speaker"):
+            VoiceSpeaker(speaker_name)
+        return container.get("speaker")
@@ -0,0 +1,86 @@
+"""
+Audio Payload Protocol
+======================
+Định dạng nhị phân cho các topic audio (thay cho JSON + base64): header cố định,
+tiếp theo là stream id (ASCII) và dữ liệu audio thô.
+
+    magic      2s   b"AU"
+    version    B    1
+    flags      B    bit0 = chunk cuối, bit1 = huỷ stream, bit2 = streaming (chưa biết tổng số chunk)
+    format     B    mã định dạng audio (AUDIO_FORMATS)
+    id_len     B    độ dài stream id
+    sampleRate I
+    chunkIndex I
+    totalChunks I
+    timestamp  Q    mili-giây
+    streamId   id_len byte
+    data       phần còn lại
+
+Các topic điều khiển vẫn dùng JSON; payload audio nhận diện được bằng magic bytes
+(JSON luôn bắt đầu bằng '{'). Gói giải mã ra dict cùng khoá với payload JSON cũ, riêng
+"data" là memoryview của audio thô thay vì chuỗi base64.
+"""
+import struct
+
+MAGIC = b"AU"
+VERSION = 1
+
+FLAG_LAST = 0x01
+FLAG_CANCELLED = 0x02
+FLAG_STREAMING = 0x04
+
+AUDIO_FORMATS = {"pcm16le": 0, "opus": 1}
+AUDIO_FORMAT_NAMES = {code: name for name, code in AUDIO_FORMATS.items()}
+
+_HEADER = struct.Struct("!2sBBBBIIIQ")
+HEADER_SIZE = _HEADER.size
+
+
+def is_audio_packet(payload) -> bool:
+    """Payload có phải gói audio nhị phân hay không"""
+    return len(payload) >= HEADER_SIZE and payload[:2] == MAGIC
+
+
+def pack_audio(stream_id: str, chunk_index: int, total_chunks: int, data: bytes,
+               format: str = "pcm16le", sample_rate: int = 16000, timestamp: int = 0,
+               is_last: bool = False, cancelled: bool = False, streaming: bool = False) -> bytes:
+    """Đóng gói một chunk audio thành payload nhị phân"""
+    stream_id_bytes = stream_id.encode("ascii")
+    flags = (FLAG_LAST if is_last else 0) | (FLAG_CANCELLED if cancelled else 0) | \
+        (FLAG_STREAMING if streaming else 0)
+    header = _HEADER.pack(MAGIC, VERSION, flags, AUDIO_FORMATS[format], len(stream_id_bytes),
+                          sample_rate, chunk_index, total_chunks, timestamp)
+    return b"".join((header, stream_id_bytes, data))
+
+
+def unpack_audio(payload) -> dict:
+    """
+    Tách header của payload audio nhị phân.
+
+    Returns:
+        Dict giống payload JSON (streamId, chunkIndex, totalChunks, isLast, format, sampleRate,
+        timestamp, streaming, cancelled), "data" là memoryview trỏ vào payload gốc (không copy)
+
+    Raises:
+        ValueError: Nếu payload không đúng định dạng hoặc version không hỗ trợ
+    """
+    if not is_audio_packet(payload):
+        raise ValueError("Payload không phải gói audio nhị phân")
+    _, version, flags, format_code, id_len, sample_rate, chunk_index, total_chunks, timestamp = \
+        _HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Version gói audio không hỗ trợ: {version}")
+    view = memoryview(payload)
+    id_end = HEADER_SIZE + id_len
+    return {
+        "streamId": bytes(view[HEADER_SIZE:id_end]).decode("ascii"),
+        "chunkIndex": chunk_index,
+        "totalChunks": total_chunks,
+        "isLast": bool(flags & FLAG_LAST),
+        "cancelled": bool(flags & FLAG_CANCELLED),
+        "streaming": bool(flags & FLAG_STREAMING),
+        "format": AUDIO_FORMAT_NAMES.get(format_code, f"unknown_{format_code}"),
+        "sampleRate": sample_rate,
+        "timestamp": timestamp,
+        "data": view[id_end:],
+    }
@@ -3,10 +3,19 @@ MQTT Client
 ===========
 """
 
-import json
+import threading
+import time
 import paho.mqtt.client as mqtt
-from config import DEVICE_ID, BROKER_TRANSPORT, BROKER_HOST, BROKER_PORT, BROKER_USE_TLS, BROKER_WS_PATH, MQTT_USER, MQTT_PASS, TOPICS
+from config import DEVICE_ID, BROKER_TRANSPORT, BROKER_HOST, BROKER_PORT, BROKER_USE_TLS, BROKER_WS_PATH, MQTT_USER, MQTT_PASS, TOPICS, MQTT_LOG_PAYLOAD_MAX
+from config import MQTT_OUTBOX_ENABLED, MQTT_OUTBOX_BATCH, MQTT_MAX_QUEUED_MESSAGES
+from config import MQTT_PROTOCOL, MQTT_SESSION_EXPIRY_S, MQTT_TOPIC_ALIASES
 from .handlers import MessageHandler
+from .dispatcher import MessageDispatcher
+from .serializer import get_serializer, TrafficStats
+from .outbox import Outbox
+from .v5 import (CONTENT_BINARY, CONTENT_JSON, UNSUPPORTED_PROTOCOL_VERSION, TopicAliases, connect_properties,
+                 message_expiry, publish_properties)
+from .audio_protocol import is_audio_packet, unpack_audio
 from container import container
 from log import setup_logger
 logger = setup_logger(__name__)
@@ -17,29 +26,58 @@ class MQTTClient:
 
     def __init__(self):
         self.client = None
+        self.protocol = MQTT_PROTOCOL
+        self.aliases = TopicAliases(MQTT_TOPIC_ALIASES)
+        self.serializer = get_serializer()
+        self.traffic = TrafficStats()
+        logger.info(f"📦 MQTT serializer: {self.serializer.name}")
+        # Mất kết nối broker: message publish vào outbox trên đĩa, kết nối lại thì gửi theo lô
+        self.outbox = Outbox() if MQTT_OUTBOX_ENABLED else None
+        self._connected = threading.Event()
+        self._drain_wake = threading.Event()
+        if self.outbox is not None:
+            threading.Thread(target=self._drain_loop, name="mqtt-outbox", daemon=True).start()
         self._setup_client()
         # Pass MQTT client to handler for WebRTC signaling
         self.handler = MessageHandler(mqtt_client=self)
+        # Xử lý message trên worker theo lớp topic, thread mạng của paho chỉ xếp hàng
+        self.dispatcher = MessageDispatcher(self._process_message)
         container.register("mqtt_client", self)
         container.register("message_handler", self.handler)
 
+    @property
+    def v5(self) -> bool:
+        return self.protocol == "5"
+
     def _setup_client(self):
         """Setup MQTT client with configuration"""
-        self.client = mqtt.Client(
-            client_id=f"device-{DEVICE_ID}",
-            clean_session=False,
-            protocol=mqtt.MQTTv311,
-            transport=BROKER_TRANSPORT
-        )
+        if self.v5:
+            # v5 không có clean_session: session bền đặt khi connect (clean_start=False + SessionExpiryInterval)
+            self.client = mqtt.Client(
+                client_id=f"device-{DEVICE_ID}",
+                protocol=mqtt.MQTTv5,
+                transport=BROKER_TRANSPORT
+            )
+        else:
+            self.client = mqtt.Client(
+                client_id=f"device-{DEVICE_ID}",
+                clean_session=False,
+                protocol=mqtt.MQTTv311,
+                transport=BROKER_TRANSPORT
+            )
         
         # Tăng giới hạn kích thước tin nhắn và buffer
         self.client._max_inflight_messages = 100  # Tăng số lượng tin nhắn đang chờ xử lý
-        self.client._max_queued_messages = 0      # Không giới hạn hàng đợi
+        # Hàng đợi RAM của paho có giới hạn, phần vượt (và mọi thứ khi mất kết nối) vào outbox
+        self.client.max_queued_messages_set(MQTT_MAX_QUEUED_MESSAGES if self.outbox is not None else 0)
         self.client.max_inflight_messages_set(100)  # Tăng giới hạn tin nhắn đang bay
 
         # Set callbacks
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        if self.v5:
+            self.client.on_publish = self._on_publish
 
         # Authentication
         if MQTT_USER and MQTT_PASS:
@@ -54,7 +92,13 @@ class MQTTClient:
 
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback when MQTT connection is established"""
-        logger.info(f"✅ Connected to MQTT broker with result code: {rc}")
+        if self.v5 and rc == UNSUPPORTED_PROTOCOL_VERSION:
+            logger.warning("⚠️ Broker không hỗ trợ MQTT v5 - chuyển về MQTT 3.1.1")
+            threading.Thread(target=self._fallback_v311, name="mqtt-fallback", daemon=True).start()
+            return
+        logger.info(f"✅ Connected to MQTT broker with result code: {rc} (MQTT {self.protocol})")
+        if self.v5:
+            self.aliases.reset(getattr(properties, "TopicAliasMaximum", 0) if properties is not None else 0)
 
         # Subscribe to server topics
         client.subscribe(TOPICS['server_tts'], qos=1)
@@ -68,28 +112,53 @@ class MQTTClient:
         
         logger.info("📡 Subscribed to all topics including WebRTC signaling")
 
+        if rc == 0:
+            self._connected.set()
+            self._drain_wake.set()
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        """Callback when MQTT connection is lost (publish từ giờ vào outbox)"""
+        self._connected.clear()
+        if self.v5:
+            self.aliases.reset(0)
+        logger.warning(f"⚠️ Mất kết nối MQTT broker (rc={rc})"
+                       f"{f' - outbox đang giữ {len(self.outbox)} message' if self.outbox is not None else ''}")
+
     def _on_message(self, client, userdata, msg):
-        """Callback when MQTT message is received"""
+        """Callback when MQTT message is received (thread mạng của paho: chỉ xếp hàng)"""
+        content_type = getattr(msg.properties, "ContentType", None) if msg.properties is not None else None
+        self.dispatcher.dispatch(msg.topic, msg.payload, content_type)
+
+    def _on_publish(self, client, userdata, mid):
+        """v5: message đăng ký topic alias đã ghi ra kết nối thì các message sau chỉ gửi alias"""
+        self.aliases.on_publish(mid)
+
+    def _process_message(self, topic: str, raw: bytes, content_type: str = None):
+        """Giải mã và xử lý một message (chạy trên worker của dispatcher)"""
+        self.traffic.count("rx", topic, len(raw))
         try:
+            # Audio nhị phân: chỉ tách header, không decode UTF-8/JSON/base64
+            # (v5: content type cho biết luôn, không phải dò header)
+            if topic.endswith("/audio") and (content_type == CONTENT_BINARY if content_type
+                                             else is_audio_packet(raw)):
+                self.handler.handle_message(topic, unpack_audio(raw))
+                return
+
             # Xử lý an toàn khi giải mã payload
             try:
-                payload_str = msg.payload.decode('utf-8')
-                payload = json.loads(payload_str)
-                if msg.topic.endswith("/audio"):
-                    logger.info(f"Received message on {msg.topic}")
-                else:
-                    logger.info(f"Received message on {msg.topic}: {payload}")
-            except UnicodeDecodeError:
-                # Xử lý trường hợp dữ liệu nhị phân không phải UTF-8
-                print(f"Warning: Received binary data on topic {msg.topic}, skipping JSON parsing")
+                payload = self.serializer.loads(raw)
+            except ValueError as je:
+                # Không phải JSON hợp lệ (orjson.JSONDecodeError/json.JSONDecodeError/UnicodeDecodeError
+                # đều là ValueError)
+                logger.warning(f"⚠️ Payload không phải JSON trên {topic} ({len(raw)} bytes): {je}")
                 return
-            except json.JSONDecodeError as je:
-                # Xử lý trường hợp chuỗi không phải JSON hợp lệ
-                print(f"Error decoding JSON: {je}, payload length: {len(msg.payload)}")
-                print(f"Payload: {msg.payload}")
-                
+            if topic.endswith("/audio") or len(raw) > MQTT_LOG_PAYLOAD_MAX:
+                logger.info(f"Received message on {topic} ({len(raw)} bytes)")
+            else:
+                logger.info(f"Received message on {topic}: {raw.decode('utf-8', 'replace')}")
+
             # Xử lý message
-            self.handler.handle_message(msg.topic, payload)
+            self.handler.handle_message(topic, payload)
         except Exception as e:
             import traceback
             print(f"Error processing message: {e}")
@@ -97,17 +166,96 @@ class MQTTClient:
 
     def connect(self):
         """Connect to MQTT broker"""
-        self.client.connect(BROKER_HOST, BROKER_PORT, keepalive=120)
+        if self.v5:
+            self.client.connect(BROKER_HOST, BROKER_PORT, keepalive=120, clean_start=False,
+                                properties=connect_properties(MQTT_SESSION_EXPIRY_S))
+        else:
+            self.client.connect(BROKER_HOST, BROKER_PORT, keepalive=120)
         self.client.loop_start()
 
+    def _fallback_v311(self):
+        """Broker từ chối v5: dựng lại client paho với MQTT 3.1.1 và kết nối lại"""
+        old = self.client
+        old.loop_stop()
+        try:
+            old.disconnect()
+        except Exception:
+            pass
+        self.protocol = "3.1.1"
+        self._setup_client()
+        try:
+            self.connect()
+        except Exception as e:
+            logger.error(f"❌ Lỗi kết nối lại với MQTT 3.1.1: {e}")
+
     def disconnect(self):
         """Disconnect from MQTT broker"""
         self.client.loop_stop()
         self.client.disconnect()
+        self._connected.clear()
+        self.dispatcher.stop()
+        if self.outbox is not None:
+            self.outbox.close()
 
-    def publish(self, topic: str, payload: dict, qos: int = 0, retain: bool = False):
-        """Publish message to MQTT topic"""
-        self.client.publish(topic, json.dumps(payload), qos=qos, retain=retain)
+    def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
+        """Publish message to MQTT topic (dict -> JSON, bytes -> gửi nguyên, vd. gói audio nhị phân)"""
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = self.serializer.dumps(payload)
+        self.traffic.count("tx", topic, len(payload))
+        if self.outbox is None:
+            self._send(topic, payload, qos, retain)
+            return
+        if self._connected.is_set():
+            rc = self._send(topic, payload, qos, retain)
+            # NO_CONN với QoS>0: paho đã giữ message, gửi lại khi kết nối lại
+            if rc == mqtt.MQTT_ERR_SUCCESS or (rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+                if retain and len(self.outbox):
+                    # Bản retain cũ trong outbox không được gửi sau bản mới này
+                    self.outbox.supersede(topic)
+                return
+        if not self.outbox.put(topic, payload, qos, retain):
+            logger.debug(f"Bỏ message {topic} khi mất kết nối (không lưu outbox)")
+        elif self._connected.is_set():
+            # Gửi lỗi khi đang kết nối (QoS 0, hàng đợi paho đầy): thread drain có thể đang ngủ
+            # không hẹn giờ vì outbox trống - đánh thức để không phải chờ tới lần kết nối lại
+            self._drain_wake.set()
+
+    def _send(self, topic: str, payload: bytes, qos: int, retain: bool, expiry: float = None):
+        """client.publish; v5 thêm content type, message expiry (mặc định theo lớp topic) và topic alias"""
+        if not self.v5:
+            return self.client.publish(topic, payload, qos=qos, retain=retain).rc
+        # Alias chỉ cho QoS 0: message QoS>0 có thể được paho gửi lại ở kết nối sau (alias đã hết hiệu lực)
+        send_topic, alias = self.aliases.lookup(topic) if qos == 0 else (topic, None)
+        props = publish_properties(CONTENT_BINARY if is_audio_packet(payload) else CONTENT_JSON,
+                                   message_expiry(topic) if expiry is None else expiry, alias)
+        info = self.client.publish(send_topic, payload, qos=qos, retain=retain, properties=props)
+        if alias is not None and send_topic and info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.aliases.registering(topic, info.mid)
+        return info.rc
+
+    def _drain_send(self, topic: str, payload: bytes, qos: int, retain: bool, expires: float) -> bool:
+        """Gửi một message của outbox (v5: expiry là thời gian giữ còn lại); False = dừng lô"""
+        if not self._connected.is_set():
+            return False
+        return self._send(topic, payload, qos, retain, expires - time.time()) == mqtt.MQTT_ERR_SUCCESS
+
+    def _drain_loop(self):
+        """Thread gửi lại outbox theo lô mỗi khi kết nối (còn message thì thử lại định kỳ)"""
+        while True:
+            self._drain_wake.wait(5.0 if len(self.outbox) else None)
+            self._drain_wake.clear()
+            try:
+                total = 0
+                while self._connected.is_set() and len(self.outbox):
+                    sent = self.outbox.drain(self._drain_send, MQTT_OUTBOX_BATCH)
+                    if not sent:
+                        break
+                    total += sent
+                    time.sleep(0.05)  # Nhường đường cho message mới
+                if total:
+                    logger.info(f"📮 Đã gửi lại {total} message từ outbox (còn {len(self.outbox)})")
+            except Exception as e:
+                logger.error(f"❌ Lỗi gửi lại outbox: {e}", exc_info=True)
 
     def loop(self, timeout: float = 0.1):
         """Process MQTT messages"""
@@ -0,0 +1,120 @@
+"""
+MQTT Dispatcher
+===============
+Đưa message MQTT ra khỏi thread mạng của paho: callback on_message chỉ đưa (topic, payload thô)
+vào hàng đợi của lớp topic rồi trả về ngay, nên keepalive/ACK và các topic khác không bị chặn khi
+một handler chạy lâu (vd. phát xong một câu TTS).
+
+- Mỗi lớp topic (signaling, audio, command) một hàng đợi có giới hạn và một worker thread riêng:
+  thứ tự message trong một lớp (và do đó trong từng stream audio) được giữ nguyên
+- Hàng đợi đầy: bỏ message cũ nhất của lớp đó (đếm vào dropped), không chặn thread mạng
+- Giải mã payload (JSON/gói audio nhị phân) chạy trên worker
+- get_stats(): độ sâu hàng đợi, thời gian chờ trong hàng đợi và thời gian chạy handler theo lớp
+"""
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from config import MQTT_DISPATCH_QUEUES
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def classify_topic(topic: str) -> str:
+    """Lớp dispatch của một topic"""
+    if "/webrtc/" in topic:
+        return "signaling"
+    if topic.endswith("/audio"):
+        return "audio"
+    return "command"
+
+
+class _TopicQueue:
+    """Hàng đợi + worker của một lớp topic"""
+
+    def __init__(self, name: str, maxsize: int, process: Callable):
+        self.name = name
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._process = process
+        self._stats = {"received": 0, "processed": 0, "dropped": 0, "errors": 0, "max_depth": 0,
+                       "wait_total": 0.0, "wait_max": 0.0, "handle_total": 0.0, "handle_max": 0.0}
+        self._thread = threading.Thread(target=self._run, name=f"mqtt-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        """Thread mạng: xếp hàng, đầy thì bỏ message cũ nhất (không chặn)"""
+        self._stats["received"] += 1
+        while True:
+            try:
+                self._queue.put_nowait((time.perf_counter(), item))
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._stats["dropped"] += 1
+                except queue.Empty:
+                    pass
+        self._stats["max_depth"] = max(self._stats["max_depth"], self._queue.qsize())
+
+    def stop(self):
+        self._queue.put((0.0, None))
+
+    def _run(self):
+        while True:
+            enqueued, item = self._queue.get()
+            if item is None:
+                return
+            start = time.perf_counter()
+            try:
+                self._process(*item)
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"❌ Lỗi xử lý message {item[0]}: {e}", exc_info=True)
+            end = time.perf_counter()
+            wait, handle = start - enqueued, end - start
+            self._stats["processed"] += 1
+            self._stats["wait_total"] += wait
+            self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+            self._stats["handle_total"] += handle
+            self._stats["handle_max"] = max(self._stats["handle_max"], handle)
+
+    def get_stats(self) -> dict:
+        processed = self._stats["processed"]
+        return {
+            "depth": self._queue.qsize(),
+            "max_depth": self._stats["max_depth"],
+            "received": self._stats["received"],
+            "processed": processed,
+            "dropped": self._stats["dropped"],
+            "errors": self._stats["errors"],
+            "wait_ms_avg": self._stats["wait_total"] / processed * 1000 if processed else 0.0,
+            "wait_ms_max": self._stats["wait_max"] * 1000,
+            "handle_ms_avg": self._stats["handle_total"] / processed * 1000 if processed else 0.0,
+            "handle_ms_max": self._stats["handle_max"] * 1000,
+        }
+
+
+class MessageDispatcher:
+    """Phân phối message MQTT theo lớp topic sang các worker thread"""
+
+    def __init__(self, process: Callable[[str, bytes, Optional[str]], None], queue_sizes: Optional[dict] = None):
+        """
+        Args:
+            process: Hàm xử lý (topic, payload thô, content type v5 hoặc None) - chạy trên worker của lớp topic
+            queue_sizes: Dung lượng hàng đợi theo lớp (mặc định MQTT_DISPATCH_QUEUES)
+        """
+        sizes = queue_sizes or MQTT_DISPATCH_QUEUES
+        self._queues = {name: _TopicQueue(name, size, process) for name, size in sizes.items()}
+
+    def dispatch(self, topic: str, payload: bytes, content_type: Optional[str] = None):
+        """Gọi từ on_message (thread mạng của paho): chỉ xếp hàng"""
+        self._queues[classify_topic(topic)].put((topic, payload, content_type))
+
+    def get_stats(self) -> dict:
+        return {name: q.get_stats() for name, q in self._queues.items()}
+
+    def stop(self):
+        for q in self._queues.values():
+            q.stop()
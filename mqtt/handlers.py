@@ -5,58 +5,36 @@ Message Handlers
 
 import base64
 import json
-import os
-import sys
-import platform
 import numpy as np
 import time
 import threading
 import soundfile as sf
 import asyncio
-import av
 import sounddevice as sd
-from config import BASE_DIR, DEVICE_ID
-from module.voice_speaker import VoiceSpeaker
+from config import BASE_DIR, DEVICE_ID, TOPICS, TTS_STREAM_PLAYBACK, TTS_NACK_ENABLED, TTS_STREAM_TIMEOUT
+from module.voice_speaker import get_speaker
+from module.debug_recorder import debug_recorder
 from .gprs_connection import GPRSConnection
-from container import container
 
 from log import setup_logger
 logger = setup_logger(__name__)
 
 
-import pyaudio
        
 from .webrtc_manager import WebRTCManager
+from .reassembly import StreamReassembler
+from .timer_wheel import TimerWheel
 
 
-class SuppressALSAErrors:
-    """Context manager to suppress ALSA error messages"""
-    def __enter__(self):
-        # Redirect stderr to devnull to suppress ALSA warnings
-        self.stderr = sys.stderr
-        try:
-            sys.stderr = open(os.devnull, 'w')
-        except Exception:
-            pass
-        return self
-    
-    def __exit__(self, *args):
-        # Restore stderr
-        try:
-            sys.stderr.close()
-        except Exception:
-            pass
-        sys.stderr = self.stderr
-
-   
-audio_stream_buffers = {}
+# Các stream đang phát theo luồng (TTS_STREAM_PLAYBACK): stream_key -> StreamingPlayback
+audio_stream_players = {}
 # Thời gian tối đa (giây) để chờ đợi tất cả các chunks
-STREAM_TIMEOUT = 15  # Tăng thời gian timeout lên 15 giây
+STREAM_TIMEOUT = TTS_STREAM_TIMEOUT
 class MessageHandler:
     """Handle incoming MQTT messages"""
 
     def __init__(self, mqtt_client=None):
-        self.speaker = VoiceSpeaker("USB Audio Device")
+        self.speaker = get_speaker("USB Audio Device")
         # self.gprs = GPRSConnection()
         self._gprs_ready = False
         self.mqtt_client = mqtt_client
@@ -73,13 +51,10 @@ class MessageHandler:
         # VoiceMQTT reference (sẽ được set từ bên ngoài)
         self.voice_mqtt = None
         
-        # PyAudio state for WebRTC playback (tương tự audio_handler.py)
-        self._pyaudio_out = None
-        self._pyaudio_out_stream = None
+        # Audio cuộc gọi WebRTC phát qua làn "call" của mixer (VoiceSpeaker)
         self._audio_frame_count = 0
         
         # Playback config (có thể lấy từ config.py nếu có)
-        self.PLAYBACK_OUTPUT_RATE = 48000  # Default 48kHz cho WebRTC
         self.PLAYBACK_GAIN = 0.3
         self.PLAYBACK_AUTO_GAIN = False
         self.PLAYBACK_TARGET_RMS = 5000.0
@@ -88,9 +63,12 @@ class MessageHandler:
         self.PLAYBACK_COMPRESSOR_ENABLED = False
         self.PLAYBACK_COMPRESSOR_DRIVE = 2.0
         
-        # Khởi tạo luồng kiểm tra timeout cho audio streams
-        self.cleanup_thread = threading.Thread(target=self._cleanup_old_streams, daemon=True)
-        self.cleanup_thread.start()
+        # Hẹn giờ timeout/NACK/dọn dẹp của các audio stream trên một timer wheel (không polling)
+        self.timers = TimerWheel()
+        self.reassembler = StreamReassembler(
+            self._play_reassembled_stream, self.timers,
+            send_nack=self._send_audio_nack if TTS_NACK_ENABLED else None,
+            timeout=STREAM_TIMEOUT)
     
     def set_voice_mqtt(self, voice_mqtt):
         """Set VoiceMQTT instance để có thể pause/resume khi có cuộc gọi"""
@@ -110,26 +88,9 @@ class MessageHandler:
                 self.voice_mqtt.pause_vad()
                 logger.info("✅ VAD paused")
                 
-                # 2. Stop speaker stream
-                if hasattr(self, 'speaker') and self.speaker:
-                    try:
-                        self.speaker.stop_stream()
-                        logger.info("✅ Speaker stream stopped")
-                    except Exception as e:
-                        logger.warning(f"Could not stop speaker: {e}")
-                
-                # 3. Stop sounddevice globally
-                try:
-                    import sounddevice as sd
-                    sd.stop()
-                    logger.info("✅ Sounddevice stopped globally")
-                except Exception as e:
-                    logger.warning(f"Could not stop sounddevice: {e}")
+                # Loa do AudioMixer giữ và trộn cả audio cuộc gọi (làn "call") - không cần giải phóng
                 
-                # 4. Đợi 2 giây để đảm bảo device được release hoàn toàn
-                logger.info("⏳ Waiting 2s for device release...")
-                await asyncio.sleep(2.0)
-                logger.info("✅ Audio devices should be released now")
+                # Mic do MicBroker giữ và chia cho WebRTC - không cần chờ OS giải phóng thiết bị
                 
             except Exception as e:
                 logger.error(f"Error releasing audio devices: {e}")
@@ -195,26 +156,9 @@ class MessageHandler:
                     self.voice_mqtt.pause_vad()
                     logger.info("✅ VAD paused")
                     
-                    # 2. Stop speaker stream
-                    if hasattr(self, 'speaker') and self.speaker:
-                        try:
-                            self.speaker.stop_stream()
-                            logger.info("✅ Speaker stream stopped")
-                        except Exception as e:
-                            logger.warning(f"Could not stop speaker: {e}")
+                    # Loa do AudioMixer giữ và trộn cả audio cuộc gọi (làn "call") - không cần giải phóng
                     
-                    # 3. Stop sounddevice globally
-                    try:
-                        import sounddevice as sd
-                        sd.stop()
-                        logger.info("✅ Sounddevice stopped globally")
-                    except Exception as e:
-                        logger.warning(f"Could not stop sounddevice: {e}")
-                    
-                    # 4. Đợi 2 giây để đảm bảo device được release hoàn toàn
-                    logger.info("⏳ Waiting 2s for device release...")
-                    time.sleep(2.0)
-                    logger.info("✅ Audio devices should be released now")
+                    # Mic do MicBroker giữ và chia cho WebRTC - không cần chờ OS giải phóng thiết bị
                     
                 except Exception as e:
                     logger.error(f"Error releasing audio devices: {e}")
@@ -308,121 +252,23 @@ class MessageHandler:
             logger.error(f"❌ Error in async answer handler: {e}", exc_info=True)
     
     async def _handle_incoming_audio(self, track):
-        """Callback khi nhận audio track từ mobile - phát ra loa sử dụng PyAudio (tương tự audio_handler.py)"""
+        """Callback khi nhận audio track từ mobile - phát ra loa qua làn "call" của mixer"""
         try:
             logger.info(f"🎧 Receiving audio from mobile: {track.id}")
 
-            # Initialize PyAudio nếu chưa có
-            if self._pyaudio_out is None:
-                with SuppressALSAErrors():
-                    self._pyaudio_out = pyaudio.PyAudio()
+            started = False
 
-            current_cfg = (None, None)  # (rate, channels)
-            resampler = None
-            resample_cfg = (None, None)  # (rate, channels)
-            
-            # 🔊 Jetson Nano: Tìm USB Audio Device (card 3) cho playback
-            output_device_index = None
-            if platform.system() == "Linux":
-                with SuppressALSAErrors():
-                    try:
-                        info = self._pyaudio_out.get_host_api_info_by_index(0)
-                        numdevices = info.get('deviceCount', 0)
-                        for i in range(numdevices):
-                            try:
-                                device_info = self._pyaudio_out.get_device_info_by_host_api_device_index(0, i)
-                                name = device_info.get('name', '')
-                                max_out = device_info.get('maxOutputChannels', 0)
-                                
-                                # Tìm USB Audio Device hoặc hw:3,0
-                                if (max_out > 0 and 
-                                    ('USB Audio Device' in name or 'hw:3,0' in name)):
-                                    output_device_index = i
-                                    logger.info(f"🔊 Found USB speaker device: {name} (index={i})")
-                                    break
-                            except Exception:
-                                # Bỏ qua các device có vấn đề
-                                continue
-                    except Exception as e:
-                        logger.warning(f"Could not enumerate audio devices: {e}")
-            
             try:
                 while True:
                     frame = await track.recv()
-                    
-                    # Xác định số channels đầu ra (1 hoặc 2)
-                    in_channels = 1
-                    try:
-                        if getattr(frame, "layout", None) is not None:
-                            in_channels = getattr(frame.layout, "channels", 1) or 1
-                        else:
-                            probe = frame.to_ndarray()
-                            in_channels = 1 if probe.ndim == 1 else min(probe.shape[0], 2)
-                    except Exception:
-                        in_channels = 1
-                    #out_channels = 1 if in_channels == 1 else 2
-                    out_channels = 1
-
-                    # Tạo resampler nếu config thay đổi
-                    if resampler is None or resample_cfg != (self.PLAYBACK_OUTPUT_RATE, out_channels):
-                        layout = "mono" if out_channels == 1 else "stereo"
-                        try:
-                            resampler = av.audio.resampler.AudioResampler(
-                                format="s16", layout=layout, rate=self.PLAYBACK_OUTPUT_RATE
-                            )
-                            resample_cfg = (self.PLAYBACK_OUTPUT_RATE, out_channels)
-                            logger.info(f"🎛️ Resampler configured -> rate={self.PLAYBACK_OUTPUT_RATE}, channels={out_channels}")
-                        except Exception as e:
-                            logger.warning(f"Failed to create resampler, using raw frames: {e}")
-                            resampler = None
 
+                    # Downmix mono int16 ở tần số gốc của frame; làn "call" resample theo luồng
+                    # (bộ lọc polyphase dùng chung, module/resampler.py) về tần số của mixer
                     try:
-                        if resampler is not None:
-                            out_frames = resampler.resample(frame)
-                            chunks = []
-                            for rf in out_frames:
-                                arr = rf.to_ndarray()
-                                if arr.dtype != np.int16:
-                                    arr = arr.astype(np.int16, copy=False)
-                                if arr.ndim == 1:
-                                    ch = 1
-                                    pcm_arr = arr
-                                else:
-                                    ch = arr.shape[0]
-                                    if ch == 1:
-                                        pcm_arr = arr[0]
-                                    else:
-                                        pcm_arr = arr.T.reshape(-1)
-                                chunks.append(pcm_arr)
-                            pcm = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int16)
-                            rate = self.PLAYBACK_OUTPUT_RATE
-                            channels = out_channels
-                        else:
-                            # Fallback: dùng thuộc tính frame gốc
-                            rate = getattr(frame, "sample_rate", self.PLAYBACK_OUTPUT_RATE) or self.PLAYBACK_OUTPUT_RATE
-                            arr = frame.to_ndarray()
-                            if arr.dtype == np.float32 or arr.dtype == np.float64:
-                                arr = np.clip(arr, -1.0, 1.0)
-                                arr = (arr * 32767.0).astype(np.int16)
-                            elif arr.dtype == np.int32:
-                                arr = (arr >> 16).astype(np.int16)
-                            elif arr.dtype != np.int16:
-                                arr = arr.astype(np.int16, copy=False)
-                            if arr.ndim == 1:
-                                channels = 1
-                                pcm = arr
-                            else:
-                                channels = arr.shape[0]
-                                if channels > 2:
-                                    arr = np.mean(arr, axis=0).astype(np.int16)
-                                    channels = 1
-                                    pcm = arr
-                                elif channels == 1:
-                                    pcm = arr[0]
-                                else:
-                                    pcm = arr.T.reshape(-1)
+                        pcm = self._frame_to_mono_pcm16(frame)
+                        rate = frame.sample_rate
                     except Exception as e:
-                        logger.warning(f"Resample/convert error: {e}")
+                        logger.warning(f"Convert error: {e}")
                         await asyncio.sleep(0.01)
                         continue
 
@@ -448,43 +294,18 @@ class MessageHandler:
                             drive = float(self.PLAYBACK_COMPRESSOR_DRIVE)
                             if drive > 0.0:
                                 x = np.tanh(drive * x) / np.tanh(drive)
-                        # Clip an toàn và chuyển về int16
-                        x = np.clip(x, -1.0, 1.0)
-                        amplified = (x * 32767.0).astype(np.int16)
-                        pcm_bytes = amplified.tobytes()
-                    else:
-                        pcm_bytes = pcm.tobytes()
-
-                    # Mở lại stream nếu config thay đổi
-                    if current_cfg != (rate, channels) or self._pyaudio_out_stream is None:
-                        try:
-                            if self._pyaudio_out_stream is not None:
-                                self._pyaudio_out_stream.stop_stream()
-                                self._pyaudio_out_stream.close()
-                        except Exception:
-                            pass
-                        
-                        # 🔊 Mở stream với USB Audio Device nếu tìm thấy
-                        stream_kwargs = {
-                            'format': pyaudio.paInt16,
-                            'channels': channels,
-                            'rate': rate,
-                            'output': True,
-                            'frames_per_buffer': 960,
-                        }
-                        if output_device_index is not None:
-                            stream_kwargs['output_device_index'] = output_device_index
-                        
-                        self._pyaudio_out_stream = self._pyaudio_out.open(**stream_kwargs)
-                        logger.info(f"🔊 Audio playback started (rate={rate}, channels={channels}, device={output_device_index})")
-                        current_cfg = (rate, channels)
+                        # Clip an toàn (làn "call" nhận float32 trực tiếp)
+                        pcm = np.clip(x, -1.0, 1.0).astype(np.float32, copy=False)
 
+                    if not started:
+                        self.speaker.start_stream(sample_rate=rate, channels=1)
+                        started = True
                     try:
-                        self._pyaudio_out_stream.write(pcm_bytes)
+                        self.speaker.play_stream_frame(pcm, sample_rate=rate, channels=1)
                         # Debug: Log mỗi 100 frames
                         self._audio_frame_count += 1
                         if self._audio_frame_count % 100 == 0:
-                            logger.info(f"🔊 Audio frames written: {self._audio_frame_count}, bytes: {len(pcm_bytes)}")
+                            logger.info(f"🔊 Audio frames written: {self._audio_frame_count}, bytes: {pcm.nbytes}")
                     except Exception as werr:
                         logger.warning(f"Audio playback write issue: {werr}")
                         await asyncio.sleep(0.01)
@@ -497,12 +318,8 @@ class MessageHandler:
                 else:
                     logger.warning(f"Audio playback stopped due to error: {e}")
             finally:
-                # Cleanup stream
                 try:
-                    if self._pyaudio_out_stream is not None:
-                        self._pyaudio_out_stream.stop_stream()
-                        self._pyaudio_out_stream.close()
-                        self._pyaudio_out_stream = None
+                    self.speaker.stop_stream()
                 except Exception:
                     pass
                 logger.info("🔊 Audio playback finished")
@@ -510,43 +327,24 @@ class MessageHandler:
         except Exception as e:
             logger.error(f"❌ Error handling incoming audio: {e}", exc_info=True)
     
-    async def _handle_incoming_audio_fallback(self, track):
-        """Fallback sử dụng VoiceSpeaker nếu PyAudio không có"""
-        try:
-            logger.info(f"🎧 Using VoiceSpeaker fallback for audio playback")
-            speaker = container.get("speaker")
-            started = False
-            
-            while True:
-                try:
-                    frame: av.AudioFrame = await track.recv()
-                    sample_rate = frame.sample_rate
-                    frame_channels = len(frame.layout.channels)
-                    
-                    audio_array = frame.to_ndarray()
-                    if audio_array.ndim == 1:
-                        audio_array = audio_array.reshape(-1, 1)
-                    elif audio_array.ndim == 2 and audio_array.shape[0] in (1, 2) and audio_array.shape[0] <= audio_array.shape[1]:
-                        audio_array = audio_array.T
-                    
-                    if not started:
-                        speaker.start_stream(sample_rate=sample_rate, channels=min(2, frame_channels))
-                        started = True
-                    speaker.play_stream_frame(audio_array, sample_rate=sample_rate, channels=min(2, frame_channels))
-                    
-                except asyncio.CancelledError:
-                    break
-                except Exception as e:
-                    logger.error(f"❌ Error in fallback playback: {e}", exc_info=True)
-                    break
-        except Exception as e:
-            logger.error(f"❌ Error in fallback audio handler: {e}", exc_info=True)
-        finally:
-            try:
-                speaker.stop_stream()
-            except Exception:
-                pass
-    
+    @staticmethod
+    def _frame_to_mono_pcm16(frame) -> np.ndarray:
+        """av.AudioFrame (packed hoặc planar, s16/s32/float) -> PCM16 mono"""
+        arr = frame.to_ndarray()
+        if arr.dtype == np.float32 or arr.dtype == np.float64:
+            arr = (np.clip(arr, -1.0, 1.0) * 32767.0).astype(np.int16)
+        elif arr.dtype == np.int32:
+            arr = (arr >> 16).astype(np.int16)
+        elif arr.dtype != np.int16:
+            arr = arr.astype(np.int16, copy=False)
+        channels = len(frame.layout.channels)
+        if arr.ndim == 1 or channels == 1:
+            return arr.reshape(-1)
+        if arr.shape[0] == 1:
+            # Packed: (1, samples * channels) interleaved
+            arr = arr.reshape(-1, channels).T
+        return arr.mean(axis=0).astype(np.int16)
+
     def _on_webrtc_state_change(self, state: str):
         """Callback khi trạng thái WebRTC thay đổi"""
         logger.info(f"🔄 WebRTC state changed to: {state}")
@@ -606,7 +404,7 @@ class MessageHandler:
         Xử lý luồng âm thanh từ thiết bị và chuyển đổi thành văn bản khi nhận đủ
         """
         try:
-            stream_id = payload.get("serverStreamId")
+            stream_id = payload.get("serverStreamId") or payload.get("streamId")
             chunk_index = payload.get("chunkIndex", 0)
             total_chunks = payload.get("totalChunks", 1)
             is_last = payload.get("isLast", False)
@@ -615,122 +413,89 @@ class MessageHandler:
             
             # Kiểm tra dữ liệu âm thanh
             data_str = payload.get("data", "")
-            if not data_str:
+            if not len(data_str):
                 logger.error(f"Empty audio data for chunk {chunk_index}")
                 return
                 
             logger.debug(f"Received audio chunk {chunk_index} with sample rate {sample_rate} from server (stream: {stream_id})")
             
-            # Giải mã âm thanh từ base64 an toàn
-            try:
-                audio_chunk = base64.b64decode(data_str)
-            except Exception as e:
-                logger.error(f"Error decoding base64 data: {e}")
-                return
+            if isinstance(data_str, str):
+                # Payload JSON: giải mã âm thanh từ base64 an toàn
+                try:
+                    audio_chunk = base64.b64decode(data_str)
+                except Exception as e:
+                    logger.error(f"Error decoding base64 data: {e}")
+                    return
+            else:
+                # Gói nhị phân: data đã là audio thô (memoryview của payload)
+                audio_chunk = data_str
 
             
             # Tạo key duy nhất cho stream này
             stream_key = f"{stream_id}"
+
+            if TTS_STREAM_PLAYBACK:
+                # Phát ngay khi đủ pre-roll, thread MQTT chỉ đưa chunk vào jitter buffer
+                player = audio_stream_players.get(stream_key)
+                if player is None:
+                    logger.info(f"🎶 Phát theo luồng audio từ server (stream: {stream_id}, {sample_rate}Hz)")
+                    player = self.speaker.open_stream_playback(stream_key, sample_rate, idle_timeout=STREAM_TIMEOUT)
+                    audio_stream_players[stream_key] = player
+                    self.timers.schedule(STREAM_TIMEOUT, self._expire_stream_player, stream_key)
+                player.add_chunk(chunk_index, audio_chunk, is_last, total_chunks)
+                return
             
-            # Khởi tạo buffer cho stream nếu chưa tồn tại
-            if stream_key not in audio_stream_buffers:
-                audio_stream_buffers[stream_key] = {
-                    "chunks": {},
-                    "total_chunks": total_chunks,
-                    "received_chunks": 0,
-                    "format": format_audio,
-                    "sample_rate": sample_rate,
-                    "timestamp": time.time()
-                }
-            
-            # Lưu chunk vào buffer
-            audio_stream_buffers[stream_key]["chunks"][chunk_index] = audio_chunk
-            audio_stream_buffers[stream_key]["received_chunks"] += 1
-            
-            logger.debug(f"Received audio chunk {chunk_index+1}/{total_chunks} from server (stream: {stream_id})")
-            
-            # Kiểm tra xem đã nhận đủ chunks chưa hoặc đã nhận chunk cuối cùng
-            if is_last or audio_stream_buffers[stream_key]["received_chunks"] >= total_chunks:
-                # Xử lý ngay cả khi chưa nhận đủ tất cả các chunks
-                logger.info(f"Completed audio stream {stream_id} from server, processing...")
-                
-                # Kết hợp các chunks theo thứ tự
-                all_chunks = []
-                for i in range(total_chunks):
-                    if i in audio_stream_buffers[stream_key]["chunks"]:
-                        all_chunks.append(audio_stream_buffers[stream_key]["chunks"][i])
-                    else:
-                        logger.warning(f"Missing chunk {i} in stream {stream_id} from server")
-                
-                # Kết hợp tất cả chunks
-                combined_audio = b''.join(all_chunks)
-                logger.info(f"Playing audio from server (stream: {stream_id})")
-                file_path = os.path.join(
-                                    BASE_DIR, "debug", f"audio_response_from_server.wav")
-                try:
-                    audio_np = np.frombuffer(combined_audio, dtype=np.int16)
-                    sf.write(
-                        file_path, audio_np, audio_stream_buffers[stream_key]["sample_rate"], subtype='PCM_16')
-                    logger.debug(
-                        f"💾 Đã lưu file âm thanh: {file_path}")
-                except Exception as e:
-                    logger.error(
-                        f"❌ Lỗi khi lưu file âm thanh: {e}")
-                self.speaker.play_audio_data(combined_audio, audio_stream_buffers[stream_key]["sample_rate"])
-                # self.speaker.play_file(file_path)
-                    
-                # Xóa buffer sau khi xử lý xong
-                del audio_stream_buffers[stream_key]
+            # Ghi chunk vào buffer cấp phát trước của stream, đủ chunk (hoặc hết chờ) thì phát
+            self.reassembler.add_chunk(stream_key, chunk_index, total_chunks, audio_chunk, is_last,
+                                       sample_rate, format_audio)
                 
         except Exception as e:
             logger.error(f"Error processing audio from server: {e}")
             import traceback
             logger.error(traceback.format_exc())
 
-    def _cleanup_old_streams(self):
-        """Kiểm tra và xử lý các audio streams bị timeout"""
-        while True:
-            try:
-                current_time = time.time()
-                streams_to_process = []
-                
-                # Kiểm tra các streams đã quá thời gian chờ
-                for stream_key, stream_data in list(audio_stream_buffers.items()):
-                    if current_time - stream_data["timestamp"] > STREAM_TIMEOUT:
-                        if stream_data["received_chunks"] > 0:
-                            logger.warning(f"Stream {stream_key} timed out with {stream_data['received_chunks']}/{stream_data['total_chunks']} chunks. Processing anyway.")
-                            streams_to_process.append(stream_key)
-                
-                # Xử lý các streams bị timeout
-                for stream_key in streams_to_process:
-                    stream_data = audio_stream_buffers[stream_key]
-                    
-                    # Kết hợp các chunks theo thứ tự
-                    all_chunks = []
-                    for i in range(stream_data["total_chunks"]):
-                        if i in stream_data["chunks"]:
-                            all_chunks.append(stream_data["chunks"][i])
-                    
-                    # Kết hợp tất cả chunks
-                    if all_chunks:
-                        combined_audio = b''.join(all_chunks)
-                        logger.info(f"Playing timed out audio from server (stream: {stream_key}, {len(all_chunks)}/{stream_data['total_chunks']} chunks)")
-                        self.speaker.play_audio_data(combined_audio, stream_data["sample_rate"])
-                    
-                    # Xóa buffer sau khi xử lý
-                    del audio_stream_buffers[stream_key]
-                
-                # Ngủ 1 giây trước khi kiểm tra lại
-                time.sleep(1)
-            except Exception as e:
-                logger.error(f"Error in cleanup thread: {e}")
-                time.sleep(5)  # Ngủ dài hơn nếu có lỗi
+    def _play_reassembled_stream(self, stream):
+        """Phát một stream đã ghép (gọi từ thread MQTT hoặc thread timer - chỉ xếp hàng, không chờ phát)"""
+        missing = stream.missing()
+        if missing:
+            logger.warning(f"Missing {len(missing)}/{stream.expected} chunks in stream {stream.stream_id} "
+                           f"from server: {missing[:20]}")
+        combined_audio = stream.assemble()
+        logger.info(f"Playing audio from server (stream: {stream.stream_id}, "
+                    f"{stream.received}/{stream.expected} chunks, {stream.duplicates} duplicates)")
+        debug_recorder.record("audio_response_from_server", combined_audio, stream.sample_rate)
+        self.speaker.play_audio_data(combined_audio, stream.sample_rate, wait=False)
+
+    def _send_audio_nack(self, stream_id: str, missing: list):
+        """Xin server gửi lại các chunk TTS còn thiếu"""
+        if not self.mqtt_client:
+            return
+        payload = {
+            "deviceId": DEVICE_ID,
+            "streamId": stream_id,
+            "missing": missing,
+            "ts": int(time.time() * 1000),
+        }
+        self.mqtt_client.publish(TOPICS['device_audio_nack'], payload, qos=1)
+
+    def _expire_stream_player(self, stream_key: str):
+        """Timer: bỏ stream phát theo luồng đã xong (giữ thêm STREAM_TIMEOUT để bỏ qua chunk đến trễ)"""
+        player = audio_stream_players.get(stream_key)
+        if player is None:
+            return
+        if not player.finished or time.time() - player.finished_at < STREAM_TIMEOUT:
+            self.timers.schedule(STREAM_TIMEOUT, self._expire_stream_player, stream_key)
+            return
+        del audio_stream_players[stream_key]
     
     def handle_command(self, payload: dict):
         """Handle commands from server"""
         command = payload.get("command")
         if command == "send_sms":
             self.handle_send_sms(payload)
+        elif command == "debug_audio":
+            # { "command": "debug_audio", "enabled": true }
+            debug_recorder.set_enabled(bool(payload.get("enabled", True)))
 
     def handle_send_sms(self, payload: dict):
         """
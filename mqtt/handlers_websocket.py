@@ -11,7 +11,8 @@ import threading
 import numpy as np
 import soundfile as sf
 from config import BASE_DIR
-from module.voice_speaker import VoiceSpeaker
+from module.voice_speaker import get_speaker
+from module.debug_recorder import debug_recorder
 
 from log import setup_logger
 logger = setup_logger(__name__)
@@ -26,7 +27,7 @@ class MessageHandlerWebSocket:
     """Handle incoming MQTT messages for WebSocket-based calls"""
 
     def __init__(self, mqtt_client=None, websocket_manager=None):
-        self.speaker = VoiceSpeaker("USB Audio Device")
+        self.speaker = get_speaker("USB Audio Device")
         self.mqtt_client = mqtt_client
         self.websocket_manager = websocket_manager
         
@@ -93,10 +94,7 @@ class MessageHandlerWebSocket:
                     except Exception as e:
                         logger.warning(f"Could not stop sounddevice: {e}")
                     
-                    # Wait for device release
-                    logger.info("⏳ Waiting 1s for device release...")
-                    time.sleep(1.0)
-                    logger.info("✅ Audio devices released")
+                    # Mic is shared through MicBroker - no device release wait needed
                     
                 except Exception as e:
                     logger.error(f"Error releasing audio devices: {e}")
@@ -189,13 +187,8 @@ class MessageHandlerWebSocket:
                 logger.info(f"Playing audio from server (stream: {stream_id})")
                 
                 # Save debug file
-                file_path = os.path.join(BASE_DIR, "debug", f"audio_response_from_server.wav")
-                try:
-                    audio_np = np.frombuffer(combined_audio, dtype=np.int16)
-                    sf.write(file_path, audio_np, audio_stream_buffers[stream_key]["sample_rate"], subtype='PCM_16')
-                    logger.debug(f"💾 Saved audio file: {file_path}")
-                except Exception as e:
-                    logger.error(f"❌ Error saving audio file: {e}")
+                debug_recorder.record("audio_response_from_server", combined_audio,
+                                      audio_stream_buffers[stream_key]["sample_rate"])
                 
                 # Play audio
                 self.speaker.play_audio_data(combined_audio, audio_stream_buffers[stream_key]["sample_rate"])
@@ -252,6 +245,8 @@ class MessageHandlerWebSocket:
         command = payload.get("command")
         if command == "send_sms":
             self.handle_send_sms(payload)
+        elif command == "debug_audio":
+            debug_recorder.set_enabled(bool(payload.get("enabled", True)))
 
     def handle_send_sms(self, payload: dict):
         """
@@ -0,0 +1,166 @@
+"""
+MQTT Outbox
+===========
+Lưu xuống đĩa các message publish khi mất kết nối broker rồi gửi lại khi kết nối lại
+(thay cho hàng đợi RAM không giới hạn của paho - mất khi khởi động lại, phình khi mất mạng lâu).
+
+- SQLite chế độ WAL (ghi nhanh, an toàn khi mất điện), một bảng outbox
+- Mỗi lớp topic một chính sách (MQTT_OUTBOX_POLICIES): ưu tiên (nhỏ gửi trước) và thời gian giữ;
+  lớp không có chính sách (ping, NACK) không lưu - gửi lại muộn cũng vô nghĩa
+- Giới hạn tổng số message: đầy thì bỏ message cũ nhất của lớp ưu tiên thấp nhất
+- drain(): gửi theo lô, thứ tự ưu tiên rồi thứ tự ghi (cảnh báo vật cản/SOS trước GPS cũ),
+  bỏ message đã quá hạn
+- Topic retain (GPS, trạng thái) chỉ giữ bản mới nhất; bản đã bị message gửi trực tiếp thay thế
+  (supersede) thì không gửi lại - tránh vị trí cũ ghi đè vị trí mới đang retain trên broker
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from config import MQTT_OUTBOX_PATH, MQTT_OUTBOX_MAX_MESSAGES, MQTT_OUTBOX_POLICIES
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def outbox_class(topic: str) -> Optional[str]:
+    """Lớp outbox của một topic (None = không lưu khi mất kết nối)"""
+    if topic.endswith("/ping") or topic.endswith("/nack"):
+        return None
+    if topic.endswith("/obstacle"):
+        return "alert"
+    if "/webrtc/" in topic:
+        return "signaling"
+    if "/stt/" in topic:
+        return "stt"
+    if topic.endswith("/gps"):
+        return "gps"
+    if topic.endswith("/info") or topic.endswith("/status"):
+        return "status"
+    return "default"
+
+
+class Outbox:
+    """Hàng đợi publish bền vững (SQLite WAL) có ưu tiên, hạn giữ và giới hạn kích thước"""
+
+    def __init__(self, path: str = MQTT_OUTBOX_PATH, max_messages: int = MQTT_OUTBOX_MAX_MESSAGES,
+                 policies: dict = MQTT_OUTBOX_POLICIES):
+        """
+        Args:
+            path: File SQLite
+            max_messages: Số message tối đa trên đĩa
+            policies: Lớp topic -> (ưu tiên, thời gian giữ giây)
+        """
+        self.path = path
+        self.max_messages = max_messages
+        self.policies = policies
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload BLOB NOT NULL, "
+            "qos INTEGER NOT NULL, retain INTEGER NOT NULL, priority INTEGER NOT NULL, "
+            "created REAL NOT NULL, expires REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_order ON outbox (priority, id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_retained ON outbox (topic) WHERE retain = 1")
+        self._count = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self._stats = {"stored": 0, "sent": 0, "expired": 0, "dropped": 0, "skipped": 0, "superseded": 0}
+        self._superseded = set()  # Topic retain đã gửi trực tiếp kể từ lúc lấy lô drain hiện tại
+        if self._count:
+            logger.info(f"📮 Outbox còn {self._count} message từ lần chạy trước ({path})")
+
+    def __len__(self):
+        return self._count
+
+    def put(self, topic: str, payload: bytes, qos: int = 0, retain: bool = False) -> bool:
+        """Lưu một message; False nếu lớp topic không được lưu"""
+        policy = self.policies.get(outbox_class(topic))
+        if policy is None:
+            self._stats["skipped"] += 1
+            return False
+        priority, ttl = policy
+        now = time.time()
+        with self._lock:
+            if retain:
+                # Broker chỉ giữ message retain cuối của topic: bản cũ hơn gửi lại cũng vô ích
+                self._delete_retained(topic)
+            self._db.execute(
+                "INSERT INTO outbox (topic, payload, qos, retain, priority, created, expires) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (topic, bytes(payload), qos, int(retain), priority, now, now + ttl))
+            self._count += 1
+            self._stats["stored"] += 1
+            if self._count > self.max_messages:
+                # Bỏ dư 10% để không phải xoá (và log) ở mỗi lần ghi khi mất mạng lâu
+                self._drop_oldest(self._count - self.max_messages + self.max_messages // 10)
+        return True
+
+    def drain(self, send: Callable[[str, bytes, int, bool, float], bool], batch: int = 50) -> int:
+        """
+        Gửi một lô theo thứ tự ưu tiên: send(topic, payload, qos, retain, expires) trả False
+        (vd. lại mất kết nối) thì dừng, message đó và các message sau giữ lại cho lần sau.
+
+        Returns:
+            Số message đã gửi
+        """
+        with self._lock:
+            self._expire()
+            rows = self._db.execute(
+                "SELECT id, topic, payload, qos, retain, expires FROM outbox ORDER BY priority, id LIMIT ?",
+                (batch,)).fetchall()
+            self._superseded.clear()
+        sent = []
+        for row_id, topic, payload, qos, retain, expires in rows:
+            if retain and topic in self._superseded:
+                continue  # Bản mới đã gửi trực tiếp trong lúc gửi lô này (supersede đã xoá dòng)
+            if not send(topic, payload, qos, bool(retain), expires):
+                break
+            sent.append((row_id,))
+        if sent:
+            with self._lock:
+                self._db.execute("BEGIN")
+                deleted = self._db.executemany("DELETE FROM outbox WHERE id = ?", sent).rowcount
+                self._db.execute("COMMIT")
+                self._count -= deleted
+                self._stats["sent"] += len(sent)
+        return len(sent)
+
+    def supersede(self, topic: str):
+        """Message retain của topic vừa gửi trực tiếp tới broker: bỏ bản cũ đang chờ trong outbox"""
+        with self._lock:
+            self._delete_retained(topic)
+            self._superseded.add(topic)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, pending=self._count)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _delete_retained(self, topic: str):
+        deleted = self._db.execute("DELETE FROM outbox WHERE topic = ? AND retain = 1", (topic,)).rowcount
+        if deleted:
+            self._count -= deleted
+            self._stats["superseded"] += deleted
+
+    def _expire(self):
+        expired = self._db.execute("DELETE FROM outbox WHERE expires < ?", (time.time(),)).rowcount
+        if expired:
+            self._count -= expired
+            self._stats["expired"] += expired
+            logger.info(f"🗑️ Outbox bỏ {expired} message quá hạn")
+
+    def _drop_oldest(self, n: int):
+        dropped = self._db.execute(
+            "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY priority DESC, id LIMIT ?)",
+            (n,)).rowcount
+        self._count -= dropped
+        self._stats["dropped"] += dropped
+        logger.warning(f"⚠️ Outbox đầy ({self.max_messages}) - bỏ {dropped} message cũ nhất ưu tiên thấp")
@@ -0,0 +1,252 @@
+"""
+Stream Reassembly
+=================
+Ghép các chunk audio TTS của server (chế độ không phát theo luồng) thành một đoạn để phát.
+
+- Mỗi stream một buffer cấp phát trước (totalChunks x kích thước chunk): chunk ghi thẳng vào vị trí
+  theo chunkIndex, không giữ dict chunk và không b''.join khi stream đủ
+- Bitmap chunk đã nhận: chunk trùng (QoS 1 gửi lại) bị bỏ, không làm stream "đủ" sớm
+- Thiếu chunk (đã có chunk sau nó): chờ `nack_delay`, gửi NACK các chunk thiếu (nếu bật) rồi chờ tiếp,
+  tối đa `nack_retries` lần; hết lượt mà đã có chunk cuối thì phát phần đã có
+- Không có chunk mới trong `timeout` giây thì phát phần đã có
+- Các hẹn giờ chạy trên một TimerWheel dùng chung (không có thread polling)
+"""
+import threading
+import time
+from typing import Callable, List, Optional
+
+from config import TTS_STREAM_TIMEOUT, TTS_NACK_DELAY_MS, TTS_NACK_RETRIES
+from log import setup_logger
+from .timer_wheel import TimerWheel
+
+logger = setup_logger(__name__)
+
+
+class ChunkBuffer:
+    """Buffer cấp phát trước của một stream, ghi chunk theo chunkIndex"""
+
+    MAX_CHUNKS = 4096  # Chặn chunkIndex/totalChunks bất thường (bitmap và buffer cấp phát theo nó)
+
+    def __init__(self, stream_id: str, total_chunks: int, sample_rate: int, fmt: str = "pcm16le"):
+        self.stream_id = stream_id
+        self.total_chunks = min(max(1, total_chunks), self.MAX_CHUNKS)
+        self.sample_rate = sample_rate
+        self.format = fmt
+        self._slot = 0  # Kích thước một ô (byte) - biết khi có chunk đầu
+        self._buffer = bytearray()
+        self._lengths = [0] * self.total_chunks
+        self._bitmap = 0  # Bit i = đã có chunk i
+        self._nacked = 0  # Bit i = đã NACK chunk i
+        self.end_index: Optional[int] = None  # Số chunk thật (biết khi có chunk cuối)
+        self.highest = -1
+        self.received = 0
+        self.duplicates = 0
+        self.repaired = 0
+        self.nacks = 0
+        self.created = time.time()
+        self.last_arrival = self.created
+        self.gap_timer = None
+
+    @property
+    def expected(self) -> int:
+        return self.end_index if self.end_index is not None else self.total_chunks
+
+    @property
+    def complete(self) -> bool:
+        return self._bitmap == (1 << self.expected) - 1
+
+    def add(self, index: int, data, is_last: bool = False) -> bool:
+        """Ghi chunk vào ô của nó; False nếu chunk trùng/không hợp lệ"""
+        if not 0 <= index < self.MAX_CHUNKS:
+            return False
+        if index >= self.total_chunks:
+            self._grow(index + 1)
+        if is_last:
+            self.end_index = index + 1
+        bit = 1 << index
+        if self._bitmap & bit:
+            self.duplicates += 1
+            return False
+        size = len(data)
+        if size > self._slot:
+            self._resize_slot(size)
+        offset = index * self._slot
+        self._buffer[offset:offset + size] = data
+        self._lengths[index] = size
+        self._bitmap |= bit
+        self.received += 1
+        if self._nacked & bit:
+            self.repaired += 1
+        self.highest = max(self.highest, index)
+        self.last_arrival = time.time()
+        return True
+
+    def has_gap(self) -> bool:
+        """Có chunk thiếu trước chunk đã nhận cao nhất (hoặc trước chunk cuối)"""
+        limit = self.expected if self.end_index is not None else self.highest + 1
+        mask = (1 << limit) - 1
+        return self._bitmap & mask != mask
+
+    def missing(self, limit: Optional[int] = None) -> List[int]:
+        """Các chunkIndex còn thiếu trong [0, limit) (mặc định: cả stream)"""
+        limit = self.expected if limit is None else limit
+        return [i for i in range(limit) if not (self._bitmap >> i) & 1]
+
+    def mark_nacked(self, indices: List[int]):
+        for i in indices:
+            self._nacked |= 1 << i
+        self.nacks += 1
+
+    def assemble(self):
+        """Audio đã ghép theo thứ tự (bỏ qua chunk thiếu) - memoryview vào buffer nếu liền mạch"""
+        count = self.expected
+        view = memoryview(self._buffer)
+        last = count - 1
+        if self.complete and all(n == self._slot for n in self._lengths[:last]):
+            return view[:last * self._slot + self._lengths[last]]
+        return b"".join(view[i * self._slot:i * self._slot + self._lengths[i]]
+                        for i in range(count) if (self._bitmap >> i) & 1)
+
+    def _grow(self, total: int):
+        self._lengths.extend([0] * (total - self.total_chunks))
+        self._buffer.extend(bytes((total - self.total_chunks) * self._slot))
+        self.total_chunks = total
+
+    def _resize_slot(self, size: int):
+        """Chunk lớn hơn ô hiện tại (chunk đầu tới là chunk cuối ngắn, hoặc chunk không đều)"""
+        old, old_slot = self._buffer, self._slot
+        self._slot = size
+        self._buffer = bytearray(self.total_chunks * size)
+        for i, n in enumerate(self._lengths):
+            if n:
+                self._buffer[i * size:i * size + n] = old[i * old_slot:i * old_slot + n]
+
+
+class StreamReassembler:
+    """Ghép chunk của nhiều stream, gửi NACK chunk thiếu và phát khi đủ/hết chờ"""
+
+    def __init__(self, on_complete: Callable[[ChunkBuffer], None], timers: TimerWheel,
+                 send_nack: Optional[Callable[[str, List[int]], None]] = None,
+                 timeout: float = TTS_STREAM_TIMEOUT, nack_delay_ms: int = TTS_NACK_DELAY_MS,
+                 nack_retries: int = TTS_NACK_RETRIES):
+        """
+        Args:
+            on_complete: Nhận ChunkBuffer khi stream đủ hoặc hết chờ (không được chặn lâu -
+                có thể chạy trên thread của TimerWheel)
+            timers: TimerWheel dùng chung
+            send_nack: Gửi NACK (stream_id, các chunkIndex thiếu); None = không NACK, chỉ chờ
+            timeout: Stream không có chunk mới bấy nhiêu giây thì phát phần đã có
+            nack_delay_ms: Chờ bấy nhiêu ms sau khi thấy thiếu chunk trước khi NACK/xét lại
+            nack_retries: Số lần NACK tối đa mỗi stream
+        """
+        self._on_complete = on_complete
+        self._timers = timers
+        self._send_nack = send_nack
+        self.timeout = timeout
+        self.nack_delay = nack_delay_ms / 1000.0
+        self.nack_retries = nack_retries if send_nack else 0
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._finished = set()  # Stream đã phát, giữ thêm `timeout` để bỏ chunk đến trễ
+        self._stats = {"streams": 0, "complete": 0, "partial": 0, "duplicates": 0, "late": 0,
+                       "missing": 0, "nacks": 0, "repaired": 0}
+
+    def add_chunk(self, stream_id: str, index: int, total_chunks: int, data, is_last: bool = False,
+                  sample_rate: int = 44100, fmt: str = "pcm16le"):
+        """Thêm một chunk (thread MQTT); stream đủ thì gọi on_complete ngay trên thread này"""
+        with self._lock:
+            if stream_id in self._finished:
+                self._stats["late"] += 1
+                logger.debug(f"⏭️ Bỏ chunk {index} đến sau khi stream {stream_id} đã phát")
+                return
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                stream = ChunkBuffer(stream_id, total_chunks, sample_rate, fmt)
+                self._streams[stream_id] = stream
+                self._stats["streams"] += 1
+                self._timers.schedule(self.timeout, self._check_timeout, stream)
+            if not stream.add(index, data, is_last):
+                self._stats["duplicates"] += 1
+                logger.debug(f"⏭️ Bỏ chunk {index} trùng/không hợp lệ của stream {stream_id}")
+                return
+            logger.debug(f"Received audio chunk {index + 1}/{stream.expected} from server (stream: {stream_id})")
+            if stream.complete:
+                self._retire(stream)
+            else:
+                if stream.gap_timer is None and stream.has_gap():
+                    stream.gap_timer = self._timers.schedule(self.nack_delay, self._check_gaps, stream)
+                return
+        self._deliver(stream)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, active=len(self._streams))
+
+    def _check_gaps(self, stream: ChunkBuffer):
+        """Timer: stream còn thiếu chunk sau nack_delay - NACK, hoặc phát phần đã có nếu hết lượt"""
+        with self._lock:
+            if self._streams.get(stream.stream_id) is not stream:
+                return
+            stream.gap_timer = None
+            if not stream.has_gap():
+                return
+            limit = stream.expected if stream.end_index is not None else stream.highest + 1
+            missing = stream.missing(limit)
+            if stream.nacks >= self.nack_retries:
+                if stream.end_index is None:
+                    return  # Chưa có chunk cuối: chờ tiếp, chunk mới tới sẽ hẹn xét lại
+                self._retire(stream)
+                missing = None
+            else:
+                stream.mark_nacked(missing)
+                self._stats["nacks"] += 1
+                stream.gap_timer = self._timers.schedule(self.nack_delay * (stream.nacks + 1),
+                                                         self._check_gaps, stream)
+        if missing is None:
+            self._deliver(stream)
+            return
+        logger.info(f"🔁 NACK {len(missing)} chunk thiếu của stream {stream.stream_id} "
+                    f"(lần {stream.nacks}): {missing[:20]}")
+        try:
+            self._send_nack(stream.stream_id, missing)
+        except Exception as e:
+            logger.error(f"❌ Lỗi gửi NACK stream {stream.stream_id}: {e}")
+
+    def _check_timeout(self, stream: ChunkBuffer):
+        """Timer: hết `timeout` không có chunk mới thì phát phần đã có, chưa hết thì hẹn lại"""
+        with self._lock:
+            if self._streams.get(stream.stream_id) is not stream:
+                return
+            idle = time.time() - stream.last_arrival
+            if idle < self.timeout:
+                self._timers.schedule(self.timeout - idle, self._check_timeout, stream)
+                return
+            logger.warning(f"⏰ Stream {stream.stream_id} hết thời gian chờ với "
+                           f"{stream.received}/{stream.expected} chunk - phát phần đã có")
+            self._retire(stream)
+        self._deliver(stream)
+
+    def _retire(self, stream: ChunkBuffer):
+        """Gỡ stream khỏi danh sách đang ghép (giữ lock)"""
+        del self._streams[stream.stream_id]
+        if stream.gap_timer is not None:
+            stream.gap_timer.cancel()
+            stream.gap_timer = None
+        self._finished.add(stream.stream_id)
+        self._timers.schedule(self.timeout, self._forget, stream.stream_id)
+        missing = len(stream.missing())
+        self._stats["complete" if missing == 0 else "partial"] += 1
+        self._stats["missing"] += missing
+        self._stats["repaired"] += stream.repaired
+
+    def _forget(self, stream_id: str):
+        with self._lock:
+            self._finished.discard(stream_id)
+
+    def _deliver(self, stream: ChunkBuffer):
+        if stream.received == 0:
+            return
+        try:
+            self._on_complete(stream)
+        except Exception as e:
+            logger.error(f"❌ Lỗi phát stream {stream.stream_id}: {e}", exc_info=True)
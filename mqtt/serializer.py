@@ -0,0 +1,85 @@
+"""
+MQTT Serializer
+===============
+Mã hoá/giải mã payload JSON của MQTT và đếm lưu lượng theo topic.
+
+- orjson nếu đã cài (`pip install orjson`, nhanh hơn json nhiều lần, ra thẳng bytes),
+  không có thì dùng json của thư viện chuẩn với dạng gọn (không khoảng trắng)
+- MQTT_SERIALIZER: "auto" (mặc định), "orjson" hoặc "json"
+- TrafficStats: số message/byte gửi và nhận theo topic
+"""
+import json
+import threading
+from typing import Any
+
+from config import MQTT_SERIALIZER
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """Kiểu numpy (scalar/mảng) trong payload"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonSerializer:
+    """json của thư viện chuẩn"""
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+    def loads(self, data) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class OrjsonSerializer:
+    """orjson (tự hỗ trợ numpy với OPT_SERIALIZE_NUMPY)"""
+
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, data) -> Any:
+        return orjson.loads(data)
+
+
+def get_serializer(name: str = MQTT_SERIALIZER):
+    """Serializer theo tên cấu hình (orjson chưa cài thì về json)"""
+    if name in ("auto", "orjson") and orjson is not None:
+        return OrjsonSerializer()
+    if name == "orjson":
+        logger.warning("⚠️ MQTT_SERIALIZER=orjson nhưng chưa cài orjson - dùng json")
+    return JsonSerializer()
+
+
+class TrafficStats:
+    """Đếm message/byte MQTT theo topic và chiều (tx/rx)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def count(self, direction: str, topic: str, size: int):
+        with self._lock:
+            stats = self._topics.get(topic)
+            if stats is None:
+                stats = self._topics[topic] = {"tx_messages": 0, "tx_bytes": 0, "rx_messages": 0, "rx_bytes": 0}
+            stats[direction + "_messages"] += 1
+            stats[direction + "_bytes"] += size
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {topic: dict(stats) for topic, stats in self._topics.items()}
@@ -0,0 +1,185 @@
+"""
+Telemetry Publisher
+===================
+Gộp GPS, pin, trạng thái cảm biến và sức khoẻ pipeline thành một bản ghi gọn trên `device_status`
+(thay cho các vòng publish GPS 5 giây/lần của GPSManager/GPSMQTT).
+
+- Một thread lấy mẫu mỗi TELEMETRY_SAMPLE_S (chỉ đọc trạng thái cục bộ, không gửi gì)
+- Gửi khi có thay đổi (cách lần trước ít nhất TELEMETRY_MIN_INTERVAL_S) hoặc khi tới hạn
+  TELEMETRY_MAX_INTERVAL_S (heartbeat), giá trị không đổi thì không gửi lại
+- GPS coi là đổi khi đã di chuyển >= TELEMETRY_GPS_MIN_MOVE_M; các bộ đếm sức khoẻ (underflow loa,
+  message MQTT bị bỏ, outbox) chỉ đi kèm, tự chúng không kích hoạt gửi
+- TELEMETRY_GPS_LEGACY: gửi kèm {latitude, longitude, speed_kmh} lên `device_gps` khi vị trí đổi
+  (app mobile đang đọc topic này). Khác GPSManager cũ (qos=0, không retain, 5 giây/lần): gửi qos=1,
+  retain=True và chỉ khi di chuyển - app đọc vị trí retain khi subscribe thay vì chờ lần gửi kế tiếp
+- `device_info` (retain) gửi một lần khi bắt đầu
+"""
+import glob
+import math
+import os
+import socket
+import threading
+import time
+from typing import Optional
+
+from config import (DEVICE_ID, TOPICS, TELEMETRY_SAMPLE_S, TELEMETRY_MIN_INTERVAL_S, TELEMETRY_MAX_INTERVAL_S,
+                    TELEMETRY_GPS_MIN_MOVE_M, TELEMETRY_SPEED_MIN_CHANGE_KMH, TELEMETRY_GPS_LEGACY)
+from container import container
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Trường chỉ đi kèm bản ghi, thay đổi của chúng không kích hoạt gửi
+PASSIVE_FIELDS = ("uf", "drop", "obx")
+
+
+def _distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Khoảng cách xấp xỉ (equirectangular) - đủ chính xác cho vài chục mét"""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.hypot(x, y) * 6371000.0
+
+
+def _find_battery() -> Optional[str]:
+    """Thư mục power_supply của pin (None nếu máy không có pin báo qua sysfs)"""
+    for path in sorted(glob.glob("/sys/class/power_supply/*")):
+        try:
+            with open(os.path.join(path, "type")) as f:
+                if f.read().strip() == "Battery" and os.path.exists(os.path.join(path, "capacity")):
+                    return path
+        except OSError:
+            continue
+    return None
+
+
+class TelemetryPublisher:
+    """Lấy mẫu trạng thái thiết bị, gửi một bản ghi gọn khi đổi hoặc tới hạn"""
+
+    def __init__(self, mqtt_client, gps_service=None):
+        """
+        Args:
+            mqtt_client: MQTTClient
+            gps_service: GPSService (mặc định lấy từ container, chưa có thì tạo)
+        """
+        self.mqtt_client = mqtt_client
+        if gps_service is None:
+            if container.has("gps"):
+                gps_service = container.get("gps")
+            else:
+                from module.gps import GPSService
+                gps_service = GPSService()
+        self.gps_service = gps_service
+        self._battery = _find_battery()
+        self._last: Optional[dict] = None  # Bản ghi đã gửi gần nhất
+        self._last_sent = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"samples": 0, "published": 0, "suppressed": 0}
+        container.register("telemetry", self)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._publish_info()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ Telemetry started (lấy mẫu {TELEMETRY_SAMPLE_S}s, gửi khi đổi, "
+                    f"heartbeat {TELEMETRY_MAX_INTERVAL_S}s)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def get_stats(self) -> dict:
+        return dict(self._stats, last=self._last)
+
+    def sample(self) -> dict:
+        """Một bản ghi trạng thái (bỏ các trường không đọc được)"""
+        record = {}
+        lat, lng = self.gps_service.get_location()
+        if lat is not None and lng is not None:
+            record["lat"] = round(lat, 6)
+            record["lng"] = round(lng, 6)
+            speed = self.gps_service.get_speed_kmh()
+            if speed is not None:
+                record["spd"] = round(speed, 1)  # Km/h lẻ: thiết bị hỗ trợ đi bộ chỉ 0-5 km/h
+        if self._battery is not None:
+            try:
+                with open(os.path.join(self._battery, "capacity")) as f:
+                    record["bat"] = int(f.read())
+                with open(os.path.join(self._battery, "status")) as f:
+                    record["chg"] = f.read().strip() == "Charging"
+            except (OSError, ValueError):
+                pass
+        for field, name, check in (("obs", "obstacle_detection_system", "is_detection_enabled"),
+                                   ("cam", "camera", "is_running"),
+                                   ("lane", "lane_segmentation", "is_running")):
+            if container.has(name):
+                try:
+                    record[field] = bool(getattr(container.get(name), check)())
+                except Exception:
+                    pass
+        if container.has("speaker"):
+            record["uf"] = container.get("speaker").mixer.device_underflows
+        record["drop"] = sum(q["dropped"] for q in self.mqtt_client.dispatcher.get_stats().values())
+        if self.mqtt_client.outbox is not None:
+            record["obx"] = len(self.mqtt_client.outbox)
+        return record
+
+    def _gps_moved(self, record: dict) -> bool:
+        last = self._last
+        if "lat" not in record:
+            return False
+        if last is None or "lat" not in last:
+            return True
+        return _distance_m(last["lat"], last["lng"], record["lat"], record["lng"]) >= TELEMETRY_GPS_MIN_MOVE_M
+
+    def _changed(self, record: dict) -> bool:
+        last = self._last
+        if last is None or self._gps_moved(record) or ("lat" in record) != ("lat" in last):
+            return True
+        if abs(record.get("spd", 0.0) - last.get("spd", 0.0)) >= TELEMETRY_SPEED_MIN_CHANGE_KMH:
+            return True
+        return any(record.get(k) != last.get(k) for k in record.keys() | last.keys()
+                   if k not in PASSIVE_FIELDS and k not in ("lat", "lng", "spd"))
+
+    def _run(self):
+        while not self._stop.wait(TELEMETRY_SAMPLE_S):
+            try:
+                record = self.sample()
+                self._stats["samples"] += 1
+                now = time.time()
+                since = now - self._last_sent
+                if since >= TELEMETRY_MAX_INTERVAL_S or (since >= TELEMETRY_MIN_INTERVAL_S and self._changed(record)):
+                    self._publish(record, now)
+                else:
+                    self._stats["suppressed"] += 1
+            except Exception as e:
+                logger.error(f"❌ Lỗi telemetry: {e}", exc_info=True)
+
+    def _publish(self, record: dict, now: float):
+        gps_moved = self._gps_moved(record)
+        self.mqtt_client.publish(TOPICS["device_status"], dict(record, ts=int(now)), qos=0, retain=True)
+        if TELEMETRY_GPS_LEGACY and gps_moved:
+            self.mqtt_client.publish(TOPICS["device_gps"], {
+                "latitude": record["lat"],
+                "longitude": record["lng"],
+                "speed_kmh": record.get("spd", 0.0),
+            }, qos=1, retain=True)
+        if "lat" in record and not gps_moved and self._last is not None and "lat" in self._last:
+            # Giữ mốc vị trí đã gửi để khoảng di chuyển nhỏ cộng dồn được
+            record["lat"], record["lng"] = self._last["lat"], self._last["lng"]
+        self._last = record
+        self._last_sent = now
+        self._stats["published"] += 1
+        logger.debug(f"📡 Telemetry: {record}")
+
+    def _publish_info(self):
+        self.mqtt_client.publish(TOPICS["device_info"], {
+            "deviceId": DEVICE_ID,
+            "host": socket.gethostname(),
+            "startedAt": int(time.time()),
+            "battery": self._battery is not None,
+        }, qos=1, retain=True)
@@ -0,0 +1,101 @@
+"""
+Timer Wheel
+===========
+Hẹn giờ cho nhiều việc ngắn (timeout stream, NACK, dọn dẹp) bằng một thread duy nhất thay vì
+mỗi việc một thread polling.
+
+- Vòng `slots` ô, mỗi ô là một tick `tick` giây: schedule/cancel O(1), mỗi tick chỉ xét một ô
+- Hẹn xa hơn một vòng thì timer nằm lại trong ô cho tới đúng tick của nó
+- Không có timer nào đang chờ thì thread ngủ hẳn (không thức dậy theo tick)
+- Callback chạy trên thread của wheel: phải ngắn, không chặn (việc dài thì đẩy sang thread khác)
+"""
+import math
+import threading
+import time
+from typing import Callable
+
+from log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class Timer:
+    """Một lần hẹn giờ (trả về từ TimerWheel.schedule)"""
+
+    __slots__ = ("tick", "callback", "args", "cancelled")
+
+    def __init__(self, tick: int, callback: Callable, args: tuple):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Hashed timer wheel một thread"""
+
+    def __init__(self, tick: float = 0.05, slots: int = 256, name: str = "timer-wheel"):
+        """
+        Args:
+            tick: Độ phân giải (giây) - timer chạy trễ tối đa một tick
+            slots: Số ô của vòng
+            name: Tên thread
+        """
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._current = 0  # Tick đã xử lý xong
+        self._origin = time.monotonic()  # Thời điểm của tick 0
+        self._pending = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """Gọi callback(*args) sau `delay` giây (làm tròn lên theo tick)"""
+        with self._lock:
+            if self._pending == 0:
+                # Wheel đang ngủ: đặt lại mốc để tick hiện tại là "bây giờ"
+                self._origin = time.monotonic() - self._current * self.tick
+            timer = Timer(self._current + max(1, math.ceil(delay / self.tick)), callback, args)
+            self._slots[timer.tick % len(self._slots)].append(timer)
+            self._pending += 1
+        self._wake.set()
+        return timer
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                idle = self._pending == 0
+                next_at = self._origin + (self._current + 1) * self.tick
+            delay = None if idle else next_at - time.monotonic()
+            if delay is None or delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            self._advance()
+
+    def _advance(self):
+        with self._lock:
+            self._current += 1
+            slot = self._slots[self._current % len(self._slots)]
+            due = [t for t in slot if t.tick <= self._current]
+            if due:
+                slot[:] = [t for t in slot if t.tick > self._current]
+                self._pending -= len(due)
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"❌ Lỗi timer {getattr(timer.callback, '__name__', timer.callback)}: {e}",
+                             exc_info=True)
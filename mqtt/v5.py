@@ -0,0 +1,97 @@
+"""
+MQTT v5
+=======
+Các thuộc tính MQTT v5 cho publish của thiết bị (MQTT_PROTOCOL="5"):
+
+- Topic alias cho topic tần suất cao (MQTT_TOPIC_ALIASES), chỉ với message QoS 0: message đầu gửi
+  topic + alias, đã ghi ra kết nối (on_publish) thì các message sau chỉ gửi alias (topic rỗng).
+  Alias chỉ có hiệu lực trong một kết nối: mất kết nối thì thôi dùng alias, kết nối lại thì đăng ký
+  lại. QoS 0 không bao giờ được paho gửi lại nên không message nào mang alias sang kết nối mới
+- Message expiry theo lớp topic (thời gian giữ trong MQTT_OUTBOX_POLICIES): broker bỏ GPS cũ,
+  offer SOS quá hạn... thay vì giao cho client kết nối muộn
+- Content type (JSON / nhị phân): bên nhận biết ngay payload là gì, không phải dò
+"""
+import threading
+from typing import Optional
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from config import MQTT_OUTBOX_POLICIES
+from log import setup_logger
+from .outbox import outbox_class
+
+logger = setup_logger(__name__)
+
+CONTENT_JSON = "application/json"
+CONTENT_BINARY = "application/octet-stream"
+
+# Reason code CONNACK: broker không hỗ trợ phiên bản giao thức (paho cũng trả mã này khi broker 3.1.1
+# trả CONNACK "unacceptable protocol version")
+UNSUPPORTED_PROTOCOL_VERSION = 132
+
+
+def message_expiry(topic: str) -> Optional[int]:
+    """Thời gian sống (giây) của message trên topic theo lớp outbox (None = không hết hạn)"""
+    policy = MQTT_OUTBOX_POLICIES.get(outbox_class(topic))
+    return policy[1] if policy else None
+
+
+def connect_properties(session_expiry: int) -> Properties:
+    """CONNECT v5: broker giữ session (subscription, message QoS>0) bấy nhiêu giây sau khi mất kết nối"""
+    props = Properties(PacketTypes.CONNECT)
+    props.SessionExpiryInterval = session_expiry
+    return props
+
+
+def publish_properties(content_type: str, expiry: Optional[float] = None,
+                       alias: Optional[int] = None) -> Properties:
+    props = Properties(PacketTypes.PUBLISH)
+    props.ContentType = content_type
+    if expiry is not None:
+        props.MessageExpiryInterval = max(1, int(expiry))
+    if alias is not None:
+        props.TopicAlias = alias
+    return props
+
+
+class TopicAliases:
+    """Topic alias phía gửi của một kết nối MQTT v5 (alias cố định theo thứ tự MQTT_TOPIC_ALIASES)"""
+
+    def __init__(self, topics: list):
+        self._topics = list(topics)
+        self._lock = threading.Lock()
+        self._alias = {}
+        self._established = set()  # Topic broker đã biết alias (được gửi alias trống topic)
+        self._pending = {}  # mid của message đăng ký alias -> topic
+        self.saved_bytes = 0
+
+    def reset(self, maximum: int):
+        """Kết nối mới: broker cho tối đa `maximum` alias (TopicAliasMaximum trong CONNACK), 0 = không dùng"""
+        with self._lock:
+            self._alias = {topic: i + 1 for i, topic in enumerate(self._topics[:maximum])}
+            self._established.clear()
+            self._pending.clear()
+        if self._alias:
+            logger.info(f"🏷️ MQTT v5 topic alias: {self._alias}")
+
+    def lookup(self, topic: str):
+        """(topic cần gửi, alias) - topic rỗng nếu broker đã biết alias"""
+        with self._lock:
+            alias = self._alias.get(topic)
+            if alias is not None and topic in self._established:
+                self.saved_bytes += len(topic)
+                return "", alias
+            return topic, alias
+
+    def registering(self, topic: str, mid: int):
+        """Đã xếp hàng message QoS 0 topic + alias (mid): chờ paho ghi ra kết nối"""
+        with self._lock:
+            if topic in self._alias and topic not in self._established:
+                self._pending[mid] = topic
+
+    def on_publish(self, mid: int):
+        with self._lock:
+            topic = self._pending.pop(mid, None)
+            if topic is not None:
+                self._established.add(topic)
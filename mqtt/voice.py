@@ -8,6 +8,8 @@ import time
 from config import *
 from container import container
 from module.voice_mic import VoiceStreamer as BaseVoiceStreamer
+from module.audio_codec import OpusStreamEncoder, encode_opus, opus_available
+from .audio_protocol import pack_audio
 from log import setup_logger
 from module.voice_speaker import VoiceSpeaker
 
@@ -22,6 +24,21 @@ class VoiceMQTT:
         self.base_streamer = BaseVoiceStreamer(
             MIC_NAME, sample_rate=AUDIO_SAMPLE_RATE, chunk_duration_ms=AUDIO_CHUNK_MS)
 
+        # Định dạng audio gửi lên server STT (pcm16le hoặc opus)
+        self.uplink_format = STT_UPLINK_FORMAT
+        if self.uplink_format == "opus" and not opus_available():
+            logger.warning("⚠️ PyAV không có encoder Opus - gửi pcm16le")
+            self.uplink_format = "pcm16le"
+        # Audio câu nói từ VoiceStreamer đã được resample về process_rate
+        self.audio_rate = self.base_streamer.process_rate
+        self.uplink_rate = STT_OPUS_RATE if self.uplink_format == "opus" else self.audio_rate
+
+        # Trạng thái stream STT của câu đang nói (STT_STREAMING)
+        self._stream_id = None
+        self._stream_index = 0
+        self._stream_start = None
+        self._stream_encoder = None
+
     def set_mqtt_client(self, mqtt_client):
         """Set MQTT client for sending audio"""
         self.mqtt_client = mqtt_client
@@ -34,7 +51,27 @@ class VoiceMQTT:
             speaker.play_file(os.path.join(BASE_DIR, "audio", "processing.wav"))
             self._send_audio_chunks(audio_data)
 
-        self.base_streamer.set_callbacks(on_speech_complete=on_speech_complete)
+        def on_speech_stream_complete(audio_data, duration):
+            # Audio đã được stream trong lúc nói - chỉ cần đánh dấu kết thúc câu
+            self._end_stream()
+            logger.info(f"Speech detected: {duration:.1f}s")
+            speaker: VoiceSpeaker = container.get("speaker")
+            speaker.play_file(os.path.join(BASE_DIR, "audio", "processing.wav"))
+
+        def on_barge_in():
+            # Người dùng nói chen: dừng TTS/cảnh báo đang phát để nghe câu mới
+            if ECHO_BARGE_IN_STOP:
+                speaker: VoiceSpeaker = container.get("speaker")
+                speaker.stop_playback()
+
+        if STT_STREAMING:
+            self.base_streamer.set_callbacks(
+                on_speech_complete=on_speech_stream_complete,
+                on_speech_audio=self._stream_audio,
+                on_speech_cancel=self._cancel_stream,
+                on_barge_in=on_barge_in)
+        else:
+            self.base_streamer.set_callbacks(on_speech_complete=on_speech_complete, on_barge_in=on_barge_in)
         self.base_streamer.start_listening()
 
     def stop_continuous_listening(self):
@@ -45,17 +82,96 @@ class VoiceMQTT:
         """Tạm dừng VAD (Voice Activity Detection) - Dùng khi có cuộc gọi WebRTC"""
         logger.info("⏸️ Pausing VAD for WebRTC call")
         self.base_streamer.stop_listening()
+        self._cancel_stream()
     
     def resume_vad(self):
         """Tiếp tục VAD sau khi cuộc gọi WebRTC kết thúc"""
         logger.info("▶️ Resuming VAD after WebRTC call")
         self.start_continuous_listening()
 
+    def _publish_audio(self, stream_id: str, chunk_index: int, total_chunks: int, data: bytes,
+                       is_last: bool, streaming: bool = False, cancelled: bool = False):
+        """Gửi một chunk audio STT: gói nhị phân (AUDIO_PAYLOAD_FORMAT=binary) hoặc JSON + base64"""
+        timestamp = int(time.time() * 1000)
+        if AUDIO_PAYLOAD_FORMAT == "binary":
+            payload = pack_audio(stream_id, chunk_index, total_chunks, data,
+                                 format=self.uplink_format, sample_rate=self.uplink_rate,
+                                 timestamp=timestamp, is_last=is_last,
+                                 cancelled=cancelled, streaming=streaming)
+        else:
+            payload = {
+                "deviceId": DEVICE_ID,
+                "streamId": stream_id,
+                "chunkIndex": chunk_index,
+                "totalChunks": total_chunks,
+                "isLast": is_last,
+                "timestamp": timestamp,
+                "format": self.uplink_format,
+                "sampleRate": self.uplink_rate,
+                "data": base64.b64encode(data).decode()
+            }
+            if streaming:
+                payload["streaming"] = True
+            if cancelled:
+                payload["cancelled"] = True
+        self.mqtt_client.publish(TOPICS['device_stt'], payload, qos=1)
+
+    def _publish_stream_chunk(self, data: bytes, is_last: bool, cancelled: bool = False):
+        # Chưa biết tổng số chunk khi đang nói - message cuối mang tổng thật
+        total_chunks = self._stream_index + 1 if is_last else 0
+        self._publish_audio(self._stream_id, self._stream_index, total_chunks, data,
+                            is_last, streaming=True, cancelled=cancelled)
+
+    def _stream_audio(self, audio_data: bytes):
+        """Gửi đoạn audio mới của câu đang nói (mở stream ở đoạn đầu tiên)"""
+        if not self.mqtt_client:
+            return
+        if self._stream_id is None:
+            self._stream_start = time.time()
+            self._stream_id = f"voice_{int(self._stream_start * 1000)}"
+            self._stream_index = 0
+            if self.uplink_format == "opus":
+                self._stream_encoder = OpusStreamEncoder(self.audio_rate, STT_OPUS_RATE, STT_OPUS_BITRATE)
+            logger.info(f"📡 Bắt đầu stream STT {self._stream_id} ({self.uplink_format})")
+        if self._stream_encoder is not None:
+            audio_data = self._stream_encoder.encode(audio_data)
+            if not audio_data:
+                return  # Encoder chưa ra trang Ogg nào
+        self._publish_stream_chunk(audio_data, False)
+        self._stream_index += 1
+
+    def _end_stream(self):
+        """Message cuối (không có audio) báo server câu nói đã kết thúc"""
+        if not self.mqtt_client or self._stream_id is None:
+            return
+        tail = b""
+        if self._stream_encoder is not None:
+            tail = self._stream_encoder.finish()
+            logger.debug(f"🗜️ Opus: {self._stream_encoder.input_bytes / 1024:.0f}KB PCM -> "
+                         f"{self._stream_encoder.output_bytes / 1024:.1f}KB")
+            self._stream_encoder = None
+        self._publish_stream_chunk(tail, True)
+        logger.info(f"Sent {self._stream_index + 1} chunks to MQTT "
+                    f"(stream {time.time() - self._stream_start:.1f}s)")
+        self._stream_id = None
+
+    def _cancel_stream(self):
+        """Huỷ stream của câu quá ngắn để server bỏ phần đã nhận"""
+        if not self.mqtt_client or self._stream_id is None:
+            return
+        self._publish_stream_chunk(b"", True, cancelled=True)
+        logger.info(f"🚫 Huỷ stream STT {self._stream_id}")
+        self._stream_id = None
+        self._stream_encoder = None
+
     def _send_audio_chunks(self, audio_data: bytes):
         """Send audio data as chunks via MQTT"""
         if not self.mqtt_client:
             return
 
+        if self.uplink_format == "opus":
+            audio_data = encode_opus(audio_data, self.audio_rate, STT_OPUS_RATE, STT_OPUS_BITRATE)
+
         stream_id = f"voice_{int(time.time() * 1000)}"
         chunk_size = 1024 * 8  # 8KB per chunk  
         total_chunks = (len(audio_data) + chunk_size - 1) // chunk_size
@@ -64,20 +180,7 @@ class VoiceMQTT:
             start = i * chunk_size
             end = min(start + chunk_size, len(audio_data))
             chunk_data = audio_data[start:end]
-
-            payload = {
-                "deviceId": DEVICE_ID,
-                "streamId": stream_id,
-                "chunkIndex": i,
-                "totalChunks": total_chunks,
-                "isLast": (i == total_chunks - 1),
-                "timestamp": int(time.time() * 1000),
-                "format": "pcm16le",
-                "sampleRate": AUDIO_SAMPLE_RATE,
-                "data": base64.b64encode(chunk_data).decode()
-            }
-
-            self.mqtt_client.publish(TOPICS['device_stt'], payload, qos=1)
+            self._publish_audio(stream_id, i, total_chunks, chunk_data, i == total_chunks - 1)
         logger.info(f"Sent {total_chunks} chunks to MQTT")
         
     def stop(self):
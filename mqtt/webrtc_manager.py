@@ -34,6 +34,8 @@ import numpy as np
 
 from log import setup_logger
 from container import container
+from module.mic_broker import get_mic_broker
+from module.resampler import StreamingResampler
 
 logger = setup_logger(__name__)
 
@@ -115,10 +117,15 @@ class CameraVideoTrack(MediaStreamTrack):
 
 
 class PyAudioSourceTrack(MediaStreamTrack):
-    """Audio track sử dụng PyAudio (tương tự audio_handler.py)"""
+    """
+    Audio track từ microphone: đọc từ subscription của MicBroker (mic dùng chung, không mở
+    lại thiết bị), hoặc tự mở PyAudio khi không có broker (tương tự audio_handler.py).
+    Mic không hỗ trợ `rate` thì mở ở tần số khác rồi resample theo luồng về `rate`.
+    """
     kind = "audio"
 
-    def __init__(self, rate=48000, channels=1, frames_per_buffer=960, device_index=None, gain=1.0, noise_gate=0):
+    def __init__(self, rate=48000, channels=1, frames_per_buffer=960, device_index=None, gain=1.0, noise_gate=0,
+                 subscription=None):
         super().__init__()
         self._rate = rate
         self._channels = channels
@@ -129,6 +136,16 @@ class PyAudioSourceTrack(MediaStreamTrack):
         self._noise_gate = noise_gate
         self._queue = queue.Queue(maxsize=200)  # Increased buffer for smoother audio
         self._frame_count = 0
+        self._subscription = subscription
+        self._use_broker = subscription is not None
+        self._resampler = None  # PyAudio mở ở tần số khác `rate`
+        self._pending = np.empty(0, dtype=np.int16)
+
+        if subscription is not None:
+            # Broker đã resample về `rate` - chỉ cần đọc đúng frames_per_buffer mẫu mỗi frame
+            self._channels = 1
+            logger.info(f"🎤 Using MicBroker microphone with gain={self._gain}x, rate={self._rate}, noise_gate={self._noise_gate}")
+            return
 
         try:
             import pyaudio
@@ -136,7 +153,7 @@ class PyAudioSourceTrack(MediaStreamTrack):
             
             # USB mics typically support 48000 or 44100
             supported_rates = [48000, 44100]
-            selected_rate = rate
+            device_rate = rate
             
             if device_index is not None:
                 # Test requested rate first
@@ -164,9 +181,10 @@ class PyAudioSourceTrack(MediaStreamTrack):
                                 input_channels=channels,
                                 input_format=pyaudio.paInt16
                             ):
-                                selected_rate = test_rate
-                                logger.info(f"⚠️ Rate {rate} not supported, using {selected_rate}")
-                                self._rate = selected_rate
+                                device_rate = test_rate
+                                logger.info(f"⚠️ Rate {rate} not supported, capturing at {device_rate} "
+                                            f"and resampling to {rate}")
+                                self._resampler = StreamingResampler(device_rate, rate)
                                 break
                         except Exception:
                             continue
@@ -174,7 +192,7 @@ class PyAudioSourceTrack(MediaStreamTrack):
             stream_kwargs = {
                 'format': pyaudio.paInt16,
                 'channels': self._channels,
-                'rate': self._rate,
+                'rate': device_rate,
                 'input': True,
                 'frames_per_buffer': self._chunk,
                 'stream_callback': self._on_audio,
@@ -207,10 +225,27 @@ class PyAudioSourceTrack(MediaStreamTrack):
                 pass
         return (None, 0)
 
+    def _next_chunk(self) -> bytes:
+        if not self._use_broker:
+            if self._resampler is None:
+                return self._queue.get()
+            # Gom mẫu đã resample cho đủ đúng một frame
+            while len(self._pending) < self._chunk:
+                converted = self._resampler.process_int16(np.frombuffer(self._queue.get(), dtype=np.int16))
+                self._pending = np.concatenate((self._pending, converted))
+            chunk, self._pending = self._pending[:self._chunk], self._pending[self._chunk:]
+            return chunk.tobytes()
+        subscription = self._subscription
+        samples = subscription.read(self._chunk, timeout=1.0, dtype=np.int16) if subscription else None
+        if samples is None:
+            # Mic không có dữ liệu - gửi im lặng để giữ nhịp frame
+            return bytes(self._chunk * 2)
+        return samples.tobytes()
+
     async def recv(self):
         # Wait for next chunk of audio from the callback
         loop = asyncio.get_running_loop()
-        data = await loop.run_in_executor(None, self._queue.get)
+        data = await loop.run_in_executor(None, self._next_chunk)
         
         self._frame_count += 1
         
@@ -258,6 +293,9 @@ class PyAudioSourceTrack(MediaStreamTrack):
         return frame
 
     def stop(self):
+        if self._subscription is not None:
+            self._subscription.broker.unsubscribe(self._subscription)
+            self._subscription = None
         try:
             if hasattr(self, "_stream") and self._stream:
                 self._stream.stop_stream()
@@ -643,42 +681,62 @@ class WebRTCManager:
                     frames_per_buffer = 2048  # Larger default for smoother audio
                     logger.info(f"📋 Using default mic config: device={mic_device_index}, rate={requested_rate}, gain={mic_gain}, noise_gate={noise_gate}, buffer={frames_per_buffer}")
                 
-                # ✅ Tạo audio track với retry logic nếu device bận
-                max_retries = 5
-                retry_delay = 1.0  # 1 giây giữa các lần thử
+                # Ưu tiên mic dùng chung của MicBroker: thiết bị đã mở sẵn, không phải chờ/thử lại
+                audio_track = None
+                try:
+                    broker = get_mic_broker()
+                    audio_track = PyAudioSourceTrack(
+                        rate=requested_rate,
+                        channels=1,
+                        frames_per_buffer=frames_per_buffer,
+                        gain=mic_gain,
+                        noise_gate=noise_gate,
+                        subscription=broker.subscribe("webrtc", rate=requested_rate)
+                    )
+                    self.pc.addTrack(audio_track)
+                    self.audio_player = audio_track
+                    logger.info(f"✅ Audio track added from MicBroker (rate={requested_rate}, gain={mic_gain}x, buffer={frames_per_buffer})")
+                except Exception as e:
+                    logger.warning(f"⚠️ MicBroker unavailable, opening PyAudio directly: {e}")
+                    audio_track = None
+
+                if audio_track is None:
+                    # ✅ Tạo audio track với retry logic nếu device bận
+                    max_retries = 5
+                    retry_delay = 1.0  # 1 giây giữa các lần thử
                 
-                logger.info(f"🎤 Attempting to create audio track (device={mic_device_index}, rate={requested_rate}, gain={mic_gain}x, buffer={frames_per_buffer})")
+                    logger.info(f"🎤 Attempting to create audio track (device={mic_device_index}, rate={requested_rate}, gain={mic_gain}x, buffer={frames_per_buffer})")
                 
-                for attempt in range(max_retries):
-                    try:
-                        logger.debug(f"🔄 Audio track creation attempt {attempt+1}/{max_retries}...")
+                    for attempt in range(max_retries):
+                        try:
+                            logger.debug(f"🔄 Audio track creation attempt {attempt+1}/{max_retries}...")
                         
-                        audio_track = PyAudioSourceTrack(
-                            rate=requested_rate,
-                            channels=1,
-                            frames_per_buffer=frames_per_buffer,
-                            device_index=mic_device_index,
-                            gain=mic_gain,
-                            noise_gate=noise_gate
-                        )
-                        self.pc.addTrack(audio_track)
-                        self.audio_player = audio_track  # Store reference
-                        logger.info(f"✅ Audio track added using PyAudio (device={mic_device_index}, rate={requested_rate}, gain={mic_gain}x, buffer={frames_per_buffer})")
-                        break  # Success - thoát khỏi retry loop
+                            audio_track = PyAudioSourceTrack(
+                                rate=requested_rate,
+                                channels=1,
+                                frames_per_buffer=frames_per_buffer,
+                                device_index=mic_device_index,
+                                gain=mic_gain,
+                                noise_gate=noise_gate
+                            )
+                            self.pc.addTrack(audio_track)
+                            self.audio_player = audio_track  # Store reference
+                            logger.info(f"✅ Audio track added using PyAudio (device={mic_device_index}, rate={requested_rate}, gain={mic_gain}x, buffer={frames_per_buffer})")
+                            break  # Success - thoát khỏi retry loop
                         
-                    except Exception as e:
-                        if "[Errno -9985]" in str(e) and attempt < max_retries - 1:
-                            logger.warning(f"⚠️ Device unavailable (attempt {attempt+1}/{max_retries}): {e}")
-                            logger.warning(f"   Possible causes: VoiceSpeaker or AudioHandler still using device")
-                            logger.warning(f"   Retrying in {retry_delay}s...")
-                            import time as time_module
-                            time_module.sleep(retry_delay)
-                        else:
-                            # Lần thử cuối hoặc lỗi khác
-                            logger.critical(f"❌ FAILED to create audio track after {max_retries} attempts!")
-                            logger.critical(f"   Error: {e}")
-                            logger.critical(f"   Debug: Check if VoiceSpeaker/AudioHandler released the device")
-                            raise
+                        except Exception as e:
+                            if "[Errno -9985]" in str(e) and attempt < max_retries - 1:
+                                logger.warning(f"⚠️ Device unavailable (attempt {attempt+1}/{max_retries}): {e}")
+                                logger.warning(f"   Possible causes: VoiceSpeaker or AudioHandler still using device")
+                                logger.warning(f"   Retrying in {retry_delay}s...")
+                                import time as time_module
+                                time_module.sleep(retry_delay)
+                            else:
+                                # Lần thử cuối hoặc lỗi khác
+                                logger.critical(f"❌ FAILED to create audio track after {max_retries} attempts!")
+                                logger.critical(f"   Error: {e}")
+                                logger.critical(f"   Debug: Check if VoiceSpeaker/AudioHandler released the device")
+                                raise
                             
             except ImportError:
                 logger.warning("⚠️ PyAudio not installed - microphone will not work")
@@ -1068,6 +1126,7 @@ class WebRTCManager:
             logger.info("🔒 Closing WebRTC connection...")
             
             # Stop audio player FIRST để giải phóng microphone device
+            used_broker = getattr(self.audio_player, '_use_broker', False)
             if self.audio_player:
                 try:
                     logger.info("🎤 Stopping audio player (releasing microphone)...")
@@ -1177,9 +1236,10 @@ class WebRTCManager:
             # Clear buffered candidates
             self.pending_ice_candidates.clear()
             
-            # Đợi lâu hơn để device được giải phóng hoàn toàn
-            logger.debug("⏳ Waiting 2s for OS to release audio device...")
-            await asyncio.sleep(2.0)
+            # Đợi lâu hơn để device được giải phóng hoàn toàn (mic của MicBroker không đóng nên không cần)
+            if not used_broker:
+                logger.debug("⏳ Waiting 2s for OS to release audio device...")
+                await asyncio.sleep(2.0)
             
             # Reset closing flag
             self._is_closing = False
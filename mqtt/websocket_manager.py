@@ -19,6 +19,7 @@ import threading
 
 from log import setup_logger
 from container import container
+from module.mic_broker import get_mic_broker
 
 logger = setup_logger(__name__)
 
@@ -315,72 +316,25 @@ class WebSocketManager:
     
     async def _stream_audio(self):
         """Stream audio from microphone to all connected clients"""
+        subscription = None
         try:
-            # Initialize PyAudio for input
-            pa = pyaudio.PyAudio()
+            # Subscribe to the shared microphone (MicBroker owns the device)
+            broker = get_mic_broker()
+            subscription = broker.subscribe("websocket", rate=self.audio_rate)
+            loop = asyncio.get_event_loop()
             
-            # Find USB Audio Device for input
-            input_device_index = None
-            try:
-                info = pa.get_host_api_info_by_index(0)
-                numdevices = info.get('deviceCount', 0)
-                for i in range(numdevices):
-                    try:
-                        device_info = pa.get_device_info_by_host_api_device_index(0, i)
-                        name = device_info.get('name', '')
-                        max_in = device_info.get('maxInputChannels', 0)
-                        
-                        if max_in > 0 and ('USB Audio Device' in name or 'hw:3,0' in name):
-                            input_device_index = i
-                            logger.info(f"🎤 Found USB microphone: {name} (index={i})")
-                            break
-                    except Exception:
-                        continue
-            except Exception as e:
-                logger.warning(f"Could not enumerate audio devices: {e}")
-            
-            # Audio queue for callback
-            audio_queue = queue.Queue(maxsize=100)
-            
-            def audio_callback(in_data, frame_count, time_info, status):
-                try:
-                    audio_queue.put_nowait(in_data)
-                except queue.Full:
-                    # Drop oldest
-                    try:
-                        audio_queue.get_nowait()
-                        audio_queue.put_nowait(in_data)
-                    except Exception:
-                        pass
-                return (None, pyaudio.paContinue)
-            
-            # Open input stream
-            stream_kwargs = {
-                'format': pyaudio.paInt16,
-                'channels': self.audio_channels,
-                'rate': self.audio_rate,
-                'input': True,
-                'frames_per_buffer': self.audio_chunk,
-                'stream_callback': audio_callback,
-            }
-            if input_device_index is not None:
-                stream_kwargs['input_device_index'] = input_device_index
-            
-            stream = pa.open(**stream_kwargs)
-            stream.start_stream()
-            
-            logger.info(f"🎤 Audio streaming started (rate={self.audio_rate}, device={input_device_index})")
+            logger.info(f"🎤 Audio streaming started (rate={self.audio_rate}, device={broker.mic_index})")
             
             chunk_count = 0
             
             while self.is_streaming:
-                # Get audio chunk from queue
-                try:
-                    audio_data = await asyncio.get_event_loop().run_in_executor(
-                        None, audio_queue.get, True, 1.0
-                    )
-                except queue.Empty:
+                # Get audio chunk from the broker subscription
+                samples = await loop.run_in_executor(
+                    None, subscription.read, self.audio_chunk, 1.0, np.int16
+                )
+                if samples is None:
                     continue
+                audio_data = samples.tobytes()
                 
                 # Create message
                 message = {
@@ -405,15 +359,13 @@ class WebSocketManager:
                 if chunk_count % 100 == 0:
                     logger.debug(f"🎤 Sent audio chunk {chunk_count} to {len(self.clients)} clients")
             
-            # Cleanup
-            stream.stop_stream()
-            stream.close()
-            pa.terminate()
-            
         except asyncio.CancelledError:
             logger.info("🎤 Audio streaming cancelled")
         except Exception as e:
             logger.error(f"❌ Error in audio streaming: {e}", exc_info=True)
+        finally:
+            if subscription is not None:
+                broker.unsubscribe(subscription)
     
     async def broadcast(self, message: dict):
         """Broadcast message to all connected clients"""